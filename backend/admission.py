@@ -0,0 +1,70 @@
+"""Admission control for WebSocket connections.
+
+Every socket is checked against a cap on open sockets and a token-bucket
+accept rate before the server does any work for it. There is no per-user
+cap: a user's newest session replaces the previous one, so each user holds
+at most one. A rejection carries a retry hint so clients in a reconnect
+storm spread out instead of hammering in lockstep.
+"""
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, NamedTuple, Optional
+
+
+@dataclass
+class AdmissionLimits:
+    """Connection limits; 0 turns a limit off"""
+    max_connections: int = 0  # Open sockets, authenticated or not
+    accept_rate: float = 0.0  # New sockets per second, sustained
+    accept_burst: int = 0  # New sockets allowed at once; defaults to one second's worth
+    auth_timeout: float = 10.0  # Seconds a socket may stay unauthenticated
+    retry_after: float = 1.0  # Base retry hint when the server is at capacity
+
+
+class Rejection(NamedTuple):
+    reason: str  # "capacity" or "rate"
+    retry_after: float  # Seconds the client should wait before reconnecting
+
+    def close_reason(self) -> str:
+        return f"{self.reason}; retry_after={self.retry_after:.2f}"
+
+
+class AdmissionControl:
+    """Counts open and authenticated sockets and meters the accept rate"""
+
+    def __init__(self, limits: AdmissionLimits, clock: Callable[[], float] = time.monotonic):
+        self.limits = limits
+        self.clock = clock
+        self.open = 0  # Admitted sockets not yet released
+        self.authenticated = 0  # Of those, sockets that have authenticated
+        self._burst = limits.accept_burst or max(1, int(limits.accept_rate))
+        self._tokens = float(self._burst)
+        self._refilled_at = clock()
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * random.uniform(1.0, 2.0)
+
+    def admit(self) -> Optional[Rejection]:
+        """Take a connection slot and an accept token, or say why not"""
+        limits = self.limits
+        if limits.max_connections and self.open >= limits.max_connections:
+            return Rejection("capacity", self._jittered(limits.retry_after))
+        if limits.accept_rate:
+            now = self.clock()
+            self._tokens = min(self._burst, self._tokens + (now - self._refilled_at) * limits.accept_rate)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return Rejection("rate", self._jittered((1 - self._tokens) / limits.accept_rate))
+            self._tokens -= 1
+        self.open += 1
+        return None
+
+    def release(self):
+        self.open -= 1
+
+    def authenticate(self):
+        self.authenticated += 1
+
+    def release_authenticated(self):
+        self.authenticated -= 1
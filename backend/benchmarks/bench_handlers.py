@@ -0,0 +1,100 @@
+"""Handler throughput with no network: requests go straight into the ASGI app in-process.
+
+Usage: python benchmarks/bench_handlers.py [--requests 20000] [--concurrency 1] [--users 1000]
+
+Measures create_user, list_users, send_message (to a recipient on an
+in-memory WebSocket, drained concurrently) and send_batch. The numbers
+cover routing, validation, middleware and the handler itself. They exclude
+sockets, HTTP parsing and the kernel, so regressions in handler code show
+up without network noise.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from harness import InProcessServer
+
+
+REPORT = sys.stdout  # The server prints to stdout; results go here even while that is silenced
+
+
+async def timed(label: str, total: int, concurrency: int, make_request):
+    latencies = []
+
+    async def worker(count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            response = await make_request()
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code < 400, response.text
+            # An in-process request may never suspend; give writer tasks the turn a real socket read would
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(total // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{label:>14}: {len(latencies) / elapsed:>8,.0f} req/s  "
+          f"p50 {statistics.median(latencies) * 1e6:>6.0f} us  p99 {latencies[int(0.99 * len(latencies))] * 1e6:>6.0f} us",
+          file=REPORT)
+    return len(latencies)
+
+
+async def run(args):
+    async with InProcessServer() as server:
+        names = iter(f"bench_{i}" for i in range(10 ** 9))
+        await timed("create_user", args.requests, args.concurrency,
+                    lambda: server.http.post("/api/users/create", json={"name": next(names)}))
+
+    # A fresh server, so list_users sees exactly --users users
+    async with InProcessServer() as server:
+        http = server.http
+        await http.post("/api/users/create_batch", json={"names": [f"filler_{i}" for i in range(args.users)]})
+        await timed("list_users", max(args.concurrency, args.requests // 10), args.concurrency,
+                    lambda: http.get("/api/users/list"))
+
+        sender = await server.create_user("sender")
+        recipient = await server.create_user("recipient")
+        ws = await server.websocket(recipient)
+        received = 0
+
+        async def drain():
+            nonlocal received
+            while True:
+                await ws.recv(timeout=None)
+                received += 1
+
+        drainer = asyncio.create_task(drain())
+        headers = {"x-user-id": sender}
+        body = {"recipient_name": "recipient", "message": "x" * 64}
+        sent = await timed("send_message", args.requests, args.concurrency,
+                           lambda: http.post("/api/messages/send", json=body, headers=headers))
+        batch = {"messages": [body] * 100}
+        sent += 100 * await timed("send_batch/100", max(args.concurrency, args.requests // 100), args.concurrency,
+                                  lambda: http.post("/api/messages/send_batch", json=batch, headers=headers))
+        deadline = time.monotonic() + 10
+        while received < sent and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        drainer.cancel()
+        print(f"{'delivered':>14}: {received:,} of {sent:,} frames", file=REPORT)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--users", type=int, default=1000, help="registered users while timing list_users")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's own log output")
+    args = parser.parse_args()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
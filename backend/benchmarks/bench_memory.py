@@ -0,0 +1,112 @@
+"""Measure memory per registered user and per idle connection.
+
+Usage: python benchmarks/bench_memory.py [--users 200000] [--sessions 20000]
+
+Users are compared against the two plain ``Dict[str, str]`` maps the server
+used before ``UserRegistry``. Sessions are compared against the same fields
+on an unslotted object with an ``asyncio.Queue``. Both kinds of session
+include their writer task, since every WebSocket has one.
+"""
+import argparse
+import asyncio
+import gc
+import sys
+import tracemalloc
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from registry import UserRegistry
+from sessions import SendLimits, Session
+
+
+def measure(build) -> int:
+    """Bytes still allocated by whatever ``build()`` returns"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+class QueueSession:
+    """The pre-slots session layout: instance dict, asyncio.Queue and writer task"""
+
+    def __init__(self, user_id, websocket, limits, evict_code, expiry=None):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.limits = limits
+        self.evict_code = evict_code
+        self.expiry = expiry
+        self.queued_bytes = 0
+        self.queued_frames = 0
+        self.over_limit_since = None
+        self.closed = False
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        while True:
+            await self._queue.get()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--sessions", type=int, default=20_000)
+    args = parser.parse_args()
+
+    # Names and IDs arrive as fresh strings from request bodies, so they are built outside the measurement
+    names = [f"user_{i:07d}" for i in range(args.users)]
+    ids = [str(uuid.uuid4()) for _ in range(args.users)]
+
+    def dicts():
+        users, user_names = {}, {}
+        for name, user_id in zip(names, ids):
+            users[name] = user_id
+            user_names[user_id] = name
+        return users, user_names
+
+    def registry():
+        reg = UserRegistry()
+        for name, user_id in zip(names, ids):
+            reg.add(name, user_id)
+        return reg
+
+    # The strings the dicts keep alive count against them; the registry lets the ID strings go
+    id_bytes = sum(sys.getsizeof(user_id) for user_id in ids)
+    baseline = measure(dicts) + id_bytes
+    compact = measure(registry)
+    print(f"users: dict pair {baseline / args.users:.0f} B/user, "
+          f"UserRegistry {compact / args.users:.0f} B/user ({args.users:,} users)")
+
+    async def sessions():
+        limits = SendLimits()
+        websocket = object()  # Never written to: the sessions stay idle
+
+        async def build(cls):
+            built = [cls(user_id, websocket, limits, 1013) for user_id in ids[:args.sessions]]
+            await asyncio.sleep(0)  # Let every writer task start and park on its queue
+            return built
+
+        for label, cls in (("asyncio.Queue", QueueSession), ("Session", Session)):
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            built = await build(cls)
+            used = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            print(f"sessions: {label} {used / args.sessions:.0f} B/connection ({args.sessions:,} idle)")
+            for session in built:
+                session._writer.cancel()
+            await asyncio.sleep(0)
+
+    asyncio.run(sessions())
+
+
+if __name__ == "__main__":
+    main()
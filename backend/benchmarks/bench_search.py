@@ -0,0 +1,57 @@
+"""Index a synthetic message history and time search queries against it.
+
+Usage: python benchmarks/bench_search.py [--messages 1000000]
+"""
+import argparse
+import random
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from history import HistoryStore
+from search import SearchIndex
+
+WORDS = [
+    "deploy", "rollback", "staging", "prod", "latency", "cache", "queue", "agent", "review",
+    "merge", "ticket", "alert", "database", "migration", "schema", "token", "retry", "timeout",
+    "build", "release", "metrics", "dashboard", "incident", "customer", "invoice", "config",
+]
+QUERIES = ["deploy", "deploy rollback", "database migration schema", "incident customer alert", "nonexistentterm"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = WORDS + [f"word{i}" for i in range(20_000)]
+    users = [f"agent{i}" for i in range(args.users)]
+    store = HistoryStore()
+    index = SearchIndex()
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        sender, recipient = rng.sample(users, 2)
+        text = " ".join(rng.choice(WORDS) if rng.random() < 0.2 else rng.choice(vocabulary) for _ in range(12))
+        index.add(store.append(store.direct_key(sender, recipient), f"m{i}", sender, text, timestamp=float(i)))
+    elapsed = time.perf_counter() - start
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"indexed {args.messages:,} messages in {elapsed:.1f}s "
+          f"({args.messages / elapsed:,.0f} msg/s, {elapsed / args.messages * 1e6:.1f} us/append), "
+          f"{len(index.postings):,} terms, max RSS {rss_mb:,.0f} MB")
+
+    for query in QUERIES:
+        for participant in (None, users[0]):
+            start = time.perf_counter()
+            hits = index.search(query, limit=20, participant=participant)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"q={query!r:32} participant={participant or '-':8} hits={len(hits):3} {elapsed:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
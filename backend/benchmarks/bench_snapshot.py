@@ -0,0 +1,67 @@
+"""Cold-start cost of restoring the user registry from a snapshot, by registry size.
+
+Usage: python benchmarks/bench_snapshot.py [--users 10000,100000,1000000]
+
+For each size it writes a snapshot and times loading it back into an empty
+registry. For comparison it times replaying the same users one row at a time
+(a JSON list of {"name", "id"} records fed to ``registry.add``), which is how
+a log or dump would be restored.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import snapshot
+from registry import UserRegistry
+
+
+def bench(count: int, directory: str):
+    registry = UserRegistry()
+    registry.add_new(f"user_{i}" for i in range(count))
+    names, ids = registry.export()
+
+    path = os.path.join(directory, f"snapshot_{count}.bin")
+    start = time.perf_counter()
+    snapshot.write(path, names, ids, [])
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loaded = snapshot.load(path)
+    restored = UserRegistry()
+    restored.restore(loaded.names, loaded.ids)
+    load_time = time.perf_counter() - start
+    assert len(restored) == count
+
+    dump_path = os.path.join(directory, f"dump_{count}.json")
+    with open(dump_path, "w") as f:
+        json.dump([{"name": name, "id": user_id} for name, user_id in registry.items()], f)
+    start = time.perf_counter()
+    with open(dump_path) as f:
+        rows = json.load(f)
+    replayed = UserRegistry()
+    for row in rows:
+        replayed.add(row["name"], row["id"])
+    replay_time = time.perf_counter() - start
+
+    print(f"{count:>10,} users: snapshot {os.path.getsize(path) / 2 ** 20:>7.1f} MiB  "
+          f"write {write_time * 1000:>7.1f} ms  load {load_time * 1000:>7.1f} ms  | "
+          f"row replay {os.path.getsize(dump_path) / 2 ** 20:>7.1f} MiB  {replay_time * 1000:>7.1f} ms  "
+          f"({replay_time / load_time:.1f}x slower)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default="10000,100000,1000000", help="comma-separated registry sizes")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for count in (int(n) for n in args.users.split(",")):
+            bench(count, directory)
+
+
+if __name__ == "__main__":
+    main()
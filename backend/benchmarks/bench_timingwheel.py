@@ -0,0 +1,71 @@
+"""Schedule millions of message expiries on the timing wheel and time inserts and ticks.
+
+Usage: python benchmarks/bench_timingwheel.py [--timers 1000000] [--max-ttl 3600]
+
+For comparison it also times the same inserts as asyncio ``loop.call_later`` handles.
+"""
+import argparse
+import asyncio
+import random
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from timingwheel import TimingWheel
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--timers", type=int, default=1_000_000)
+    parser.add_argument("--max-ttl", type=float, default=3600.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    delays = [rng.uniform(0.1, args.max_ttl) for _ in range(args.timers)]
+    fired = 0
+
+    def on_expire(_):
+        nonlocal fired
+        fired += 1
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    wheel = TimingWheel()
+    start = time.perf_counter()
+    for delay in delays:
+        wheel.schedule(delay, on_expire)
+    insert_s = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"wheel: scheduled {args.timers:,} timers in {insert_s:.2f}s "
+          f"({insert_s / args.timers * 1e9:.0f} ns each, ~{(rss_after - rss_before) / 1024:.0f} MB RSS)")
+
+    # Tick through the whole range; the slowest ticks are the ones that cascade
+    ticks = int(args.max_ttl / wheel.resolution) + 2
+    slowest = 0.0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        tick_start = time.perf_counter()
+        wheel.tick()
+        slowest = max(slowest, time.perf_counter() - tick_start)
+    tick_s = time.perf_counter() - start
+    print(f"wheel: {ticks:,} ticks in {tick_s:.2f}s ({tick_s / ticks * 1e6:.1f} us mean, "
+          f"{slowest * 1e3:.1f} ms slowest), fired {fired:,}")
+    assert fired == args.timers
+
+    async def call_later_inserts():
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        handles = [loop.call_later(delay, on_expire, None) for delay in delays]
+        elapsed = time.perf_counter() - start
+        for handle in handles:
+            handle.cancel()
+        return elapsed
+
+    elapsed = asyncio.run(call_later_inserts())
+    print(f"call_later: scheduled {args.timers:,} handles in {elapsed:.2f}s ({elapsed / args.timers * 1e9:.0f} ns each)")
+
+
+if __name__ == "__main__":
+    main()
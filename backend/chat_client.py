@@ -0,0 +1,578 @@
+import asyncio
+import json
+import logging
+import random
+import ssl
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import httpx
+import websockets
+
+logger = logging.getLogger(__name__)
+
+SEND_RETRY_BASE = 0.2  # Seconds before the first retry of a send; doubles per attempt
+SEND_RETRY_MAX = 5.0  # Longest single wait between send attempts
+
+
+def retry_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff, so clients that failed together do not retry in lockstep"""
+    return random.uniform(0, min(SEND_RETRY_MAX, SEND_RETRY_BASE * 2 ** attempt))
+
+
+FrameHandler = Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]
+CallHandler = Callable[[str, Any], Union[Any, Awaitable[Any]]]
+
+
+class RpcError(Exception):
+    """A call or stream failed: the peer was offline or went away, returned an error, or the deadline passed"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+
+
+class ChatClient:
+    """Async client for the chat server.
+
+    HTTP calls share one pooled keep-alive ``httpx.AsyncClient``. A single
+    reader task owns ``ws.recv()`` and dispatches every frame by its ``type``
+    (frames without a type are chat messages, dispatched as ``"message"``);
+    the heartbeat task only sends and waits for the reader to see the reply.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        ws_url: str,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        max_concurrent_sends: int = 64,
+        send_retries: int = 2,
+        heartbeat_interval: float = 15.0,
+        heartbeat_timeout: float = 10.0,
+        timeout: float = 10.0,
+    ):
+        self.base_url = base_url
+        self.ws_url = ws_url
+        self.user_id: Optional[str] = None
+        self.username: Optional[str] = None
+        self.ws = None
+        self.connected = False
+        self.send_retries = send_retries
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=timeout,
+        )
+        self.handlers: Dict[str, List[FrameHandler]] = defaultdict(list)
+        self._send_slots = asyncio.Semaphore(max_concurrent_sends)
+        self._heartbeat_reply: Optional[asyncio.Future] = None
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._opening: Dict[str, asyncio.Future] = {}  # stream_id -> future for stream_opened
+        self._streams: Dict[str, "MessageStream"] = {}  # message_id -> our open outgoing streams
+        self._fragments: Dict[int, List[str]] = {}  # fragment_id -> pieces of a large frame received so far
+        self._call_handler: Optional[CallHandler] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def on(self, frame_type: str, handler: FrameHandler):
+        """Register a handler for frames of ``frame_type``"""
+        self.handlers[frame_type].append(handler)
+
+    async def register(self, username: str) -> bool:
+        """Register a new user"""
+        try:
+            response = await self.http.post("/api/users/create", json={"name": username})
+            if response.status_code == 201:
+                self.user_id = response.json()["id"]
+                self.username = username
+                logger.info(f"Registered successfully! User ID: {self.user_id}")
+                return True
+            logger.error(f"Registration failed: {response.text}")
+            return False
+        except Exception as e:
+            logger.error(f"Error during registration: {e}")
+            return False
+
+    async def connect_websocket(self):
+        """Connect to the WebSocket server, retrying until it succeeds"""
+        while True:
+            try:
+                if self.ws:
+                    try:
+                        await self.ws.close()
+                    except Exception:
+                        pass
+
+                logger.info("Attempting to connect to WebSocket...")
+                headers = {"X-User-ID": self.user_id} if self.user_id else {}
+                headers["X-Accept-Fragments"] = "1"  # Large frames arrive in pieces, so heartbeats are not stuck behind them
+                self._fragments.clear()
+                ssl_context = ssl._create_unverified_context() if self.ws_url.startswith(("wss", "https")) else None
+                self.ws = await websockets.connect(
+                    self.ws_url,
+                    ping_interval=None,  # We handle our own heartbeat
+                    ping_timeout=None,
+                    close_timeout=None,
+                    max_size=10_000_000,  # 10MB max message size
+                    extra_headers=headers,
+                    ssl=ssl_context,
+                )
+
+                # Wait for auth response
+                response_data = json.loads(await self.ws.recv())
+                if response_data.get("type") == "connection_status":
+                    logger.info(f"WebSocket connected: {response_data['message']}")
+                    self.connected = True
+                    return True
+                logger.error(f"Unexpected auth response: {response_data}")
+            except websockets.exceptions.ConnectionClosed as e:
+                self.connected = False
+                retry_after = self._retry_hint(e.rcvd)
+                logger.error(f"Connection refused ({e.rcvd.code if e.rcvd else 'no close frame'}), retrying in {retry_after:.1f}s")
+                await asyncio.sleep(retry_after)
+                continue
+            except Exception as e:
+                logger.error(f"Connection attempt failed: {e}")
+            self.connected = False
+            await asyncio.sleep(2)
+
+    @staticmethod
+    def _retry_hint(close, default: float = 2.0) -> float:
+        """Seconds to wait before reconnecting, from a server's "...; retry_after=N" close reason"""
+        if close is None or close.code != 1013:
+            return default
+        _, _, hint = close.reason.partition("retry_after=")
+        try:
+            return float(hint)
+        except ValueError:
+            return default
+
+    async def send_message(
+        self, recipient_name: str, message: str, idempotency_key: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Send a message to another user, returning the server's response body.
+
+        A "status" of 200 means the message was handed to the recipient's
+        session, not that it has been received; it can still be lost if that
+        connection drops before the write.
+
+        Every send carries an idempotency key (generated unless given), so a
+        send that timed out is retried up to ``send_retries`` times, with
+        jittered exponential backoff, without risking a duplicate delivery.
+        """
+        key = idempotency_key or uuid.uuid4().hex
+        async with self._send_slots:
+            for attempt in range(self.send_retries + 1):
+                try:
+                    response = await self.http.post(
+                        "/api/messages/send",
+                        headers={"X-User-ID": self.user_id or "", "Idempotency-Key": key},
+                        json={"recipient_name": recipient_name, "message": message},
+                    )
+                    if response.status_code == 200:
+                        logger.debug("Message sent successfully")
+                        return response.json()
+                    logger.error(f"Failed to send message: {response.text}")
+                    return None
+                except httpx.TransportError as e:
+                    logger.warning(f"Send attempt {attempt + 1} failed: {e!r}")
+                    if attempt < self.send_retries:
+                        await asyncio.sleep(retry_delay(attempt))
+                except Exception as e:
+                    logger.error(f"Error sending message: {e}")
+                    return None
+            return None
+
+    async def send_many(self, messages: Iterable[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """Send ``(recipient_name, message)`` pairs concurrently over the shared pool"""
+        return await asyncio.gather(*(self.send_message(r, m) for r, m in messages))
+
+    async def send_batch(self, messages: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Send ``(recipient_name, message)`` pairs in one request; one result per item.
+
+        Items carry idempotency keys, so the batch is retried on transport
+        errors without delivering any item twice.
+        """
+        items = [{"recipient_name": r, "message": m, "idempotency_key": uuid.uuid4().hex} for r, m in messages]
+        async with self._send_slots:
+            for attempt in range(self.send_retries + 1):
+                try:
+                    response = await self.http.post(
+                        "/api/messages/send_batch",
+                        headers={"X-User-ID": self.user_id or ""},
+                        json={"messages": items},
+                    )
+                    break
+                except httpx.TransportError:
+                    if attempt == self.send_retries:
+                        raise
+                    await asyncio.sleep(retry_delay(attempt))
+            response.raise_for_status()
+            return response.json()["results"]
+
+    async def call(self, recipient_name: str, body: Any = None, timeout: float = 30.0) -> Any:
+        """Call another connected user over the WebSocket and return the body of their reply.
+
+        Raises ``RpcError`` if the server reports an error; the server also
+        enforces ``timeout`` and answers with a 504 when it passes.
+        """
+        call_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        try:
+            await self.ws.send(json.dumps({
+                "type": "rpc_request",
+                "call_id": call_id,
+                "to": recipient_name,
+                "body": body,
+                "timeout_ms": int(timeout * 1000),
+            }))
+            # A little slack so the server's deadline error normally arrives first
+            frame = await asyncio.wait_for(future, timeout + 1.0)
+        finally:
+            self._calls.pop(call_id, None)
+        error = frame.get("error")
+        if error:
+            raise RpcError(error.get("code", 500), error.get("message", ""))
+        return frame.get("body")
+
+    def on_call(self, handler: CallHandler):
+        """Answer incoming calls with ``handler(caller_name, body)``; its return value is the reply body"""
+        self._call_handler = handler
+
+    async def _answer(self, frame: Dict[str, Any]):
+        reply: Dict[str, Any] = {"type": "rpc_response", "call_id": frame["call_id"]}
+        try:
+            result = self._call_handler(frame.get("from"), frame.get("body"))
+            if asyncio.iscoroutine(result):
+                result = await result
+            reply["body"] = result
+        except Exception as e:
+            reply["error"] = {"code": 500, "message": str(e)}
+        try:
+            await self.ws.send(json.dumps(reply))
+        except Exception as e:
+            logger.error(f"Could not answer call {frame['call_id']}: {e}")
+
+    async def stream(self, recipient_name: str, timeout: float = 10.0) -> "MessageStream":
+        """Open a streamed message to ``recipient_name``; write chunks, then close it"""
+        stream_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._opening[stream_id] = future
+        try:
+            await self.ws.send(json.dumps({"type": "stream_open", "stream_id": stream_id, "to": recipient_name}))
+            frame = await asyncio.wait_for(future, timeout)
+        finally:
+            self._opening.pop(stream_id, None)
+        if frame["type"] == "stream_error":
+            raise RpcError(frame["error"]["code"], frame["error"]["message"])
+        stream = MessageStream(self, frame["message_id"], frame["window"])
+        self._streams[stream.message_id] = stream
+        return stream
+
+    def outbox(self, **kwargs) -> "Outbox":
+        return Outbox(self, **kwargs)
+
+    async def start(self, transport: str = "websocket"):
+        """Connect and start receiving.
+
+        ``transport`` is ``"websocket"`` (reader and heartbeat tasks), or
+        ``"sse"`` / ``"poll"`` for networks that break long-lived WebSockets;
+        those only receive, and sending still goes over HTTP.
+        """
+        if transport == "websocket":
+            await self.connect_websocket()
+            self._tasks = [
+                asyncio.create_task(self._reader()),
+                asyncio.create_task(self._heartbeat()),
+            ]
+        elif transport == "sse":
+            self._tasks = [asyncio.create_task(self._sse_reader())]
+        elif transport == "poll":
+            self._tasks = [asyncio.create_task(self._poll_reader())]
+        else:
+            raise ValueError(f"Unknown transport: {transport}")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.ws:
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+        self.connected = False
+        await self.http.aclose()
+
+    async def _dispatch(self, frame: Dict[str, Any]):
+        frame_type = frame.get("type", "message")
+        if frame_type == "heartbeat":
+            if self._heartbeat_reply and not self._heartbeat_reply.done():
+                self._heartbeat_reply.set_result(frame)
+        elif frame_type == "rpc_response":
+            future = self._calls.get(frame.get("call_id"))
+            if future and not future.done():
+                future.set_result(frame)
+        elif frame_type == "rpc_request" and self._call_handler:
+            asyncio.create_task(self._answer(frame))
+        elif frame_type in ("stream_opened", "stream_error") and frame.get("stream_id") in self._opening:
+            future = self._opening[frame["stream_id"]]
+            if not future.done():
+                future.set_result(frame)
+        elif frame_type in ("stream_credit", "stream_error") and frame.get("message_id") in self._streams:
+            self._streams[frame["message_id"]]._on_frame(frame)
+        for handler in self.handlers.get(frame_type, ()):
+            try:
+                result = handler(frame)
+                if asyncio.iscoroutine(result):
+                    asyncio.create_task(result)
+            except Exception as e:
+                logger.error(f"Error in {frame_type} handler: {e}")
+
+    async def _reader(self):
+        """Sole consumer of ``ws.recv()``; reconnects on failure"""
+        while True:
+            if not self.ws or not self.connected:
+                await self.connect_websocket()
+                continue
+            try:
+                raw = await self.ws.recv()
+            except websockets.exceptions.ConnectionClosed as e:
+                self.connected = False
+                if e.rcvd and e.rcvd.code == 4005:
+                    # Another client for this user took over; reconnecting would just take it back
+                    logger.warning("Session replaced by a newer connection; not reconnecting")
+                    return
+                logger.warning(f"Connection closed, reconnecting: {e}")
+                continue
+            except Exception as e:
+                logger.warning(f"Receive error, reconnecting: {e}")
+                self.connected = False
+                await asyncio.sleep(1)
+                continue
+            if not raw.strip():
+                continue
+            try:
+                frame = json.loads(raw)
+                if frame.get("type") == "fragment":
+                    frame = self._reassemble(frame)
+                    if frame is None:
+                        continue
+            except json.JSONDecodeError:
+                continue
+            await self._dispatch(frame)
+
+    def _reassemble(self, fragment: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Collect one piece of a fragmented frame; the whole frame once the final piece arrives"""
+        pieces = self._fragments.setdefault(fragment["fragment_id"], [])
+        pieces.append(fragment["data"])
+        if not fragment["final"]:
+            return None
+        del self._fragments[fragment["fragment_id"]]
+        return json.loads("".join(pieces))
+
+    async def _sse_reader(self, retry_delay: float = 1.0):
+        """Receive frames from the Server-Sent Events endpoint; reconnects on failure"""
+        while True:
+            try:
+                async with self.http.stream(
+                    "GET", "/api/messages/events", headers={"X-User-ID": self.user_id or ""}, timeout=None
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if line.startswith("data: "):
+                            self.connected = True
+                            await self._dispatch(json.loads(line[6:]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Event stream error, reconnecting: {e}")
+            self.connected = False
+            await asyncio.sleep(retry_delay)
+
+    async def _poll_reader(self, wait: float = 25.0, retry_delay: float = 1.0):
+        """Receive frames by long-polling; each request waits server-side until frames arrive"""
+        while True:
+            try:
+                response = await self.http.get(
+                    "/api/messages/poll",
+                    params={"timeout": wait},
+                    headers={"X-User-ID": self.user_id or ""},
+                    timeout=wait + 10,
+                )
+                response.raise_for_status()
+                self.connected = True
+                for frame in response.json()["frames"]:
+                    await self._dispatch(frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Poll failed, retrying: {e}")
+                self.connected = False
+                await asyncio.sleep(retry_delay)
+
+    async def _heartbeat(self):
+        """Send periodic heartbeats and drop the socket if no reply arrives"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not self.ws or not self.connected:
+                continue
+            self._heartbeat_reply = loop.create_future()
+            try:
+                await self.ws.send("")
+                await asyncio.wait_for(self._heartbeat_reply, timeout=self.heartbeat_timeout)
+                logger.debug("Heartbeat ok")
+            except Exception as e:
+                logger.warning(f"Heartbeat failed, reconnecting: {e}")
+                self.connected = False
+                try:
+                    await self.ws.close()
+                except Exception:
+                    pass
+            finally:
+                self._heartbeat_reply = None
+
+
+class MessageStream:
+    """An open outgoing streamed message.
+
+    ``write`` waits for credit from the server, so at most ``window`` chunks
+    are ever queued for the recipient; ``close`` ends the message.
+    """
+
+    def __init__(self, client: ChatClient, message_id: str, window: int):
+        self.client = client
+        self.message_id = message_id
+        self.error: Optional[RpcError] = None
+        self._credit = asyncio.Semaphore(window)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close(error=str(exc) if exc else None)
+
+    async def write(self, data: str):
+        await self._credit.acquire()
+        if self.error:
+            raise self.error
+        await self.client.ws.send(json.dumps({"type": "stream_chunk", "message_id": self.message_id, "data": data}))
+
+    async def close(self, error: Optional[str] = None):
+        """End the message; pass ``error`` to tell the recipient it was aborted"""
+        if self.client._streams.pop(self.message_id, None) is None:
+            return
+        frame: Dict[str, Any] = {"type": "stream_close", "message_id": self.message_id}
+        if error:
+            frame["error"] = {"code": 500, "message": error}
+        if self.error is None:
+            await self.client.ws.send(json.dumps(frame))
+
+    def _on_frame(self, frame: Dict[str, Any]):
+        if frame["type"] == "stream_credit":
+            for _ in range(frame["credit"]):
+                self._credit.release()
+        else:
+            self.error = RpcError(frame["error"]["code"], frame["error"]["message"])
+            self.client._streams.pop(self.message_id, None)
+            self._credit.release()  # Wake a blocked writer so it sees the error
+
+
+class Outbox:
+    """Coalesces outgoing messages into batched sends.
+
+    Messages wait up to ``linger`` seconds (or until ``max_batch`` are queued)
+    and are then flushed with one ``send_batch`` call. At most ``max_pending``
+    messages are buffered; ``send`` blocks once the buffer is full, so a slow
+    server pushes back on the producer instead of growing memory.
+    """
+
+    def __init__(self, client: ChatClient, linger: float = 0.005, max_batch: int = 100, max_pending: int = 1000):
+        self.client = client
+        self.linger = linger
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def send(self, recipient_name: str, message: str) -> asyncio.Future:
+        """Queue a message; the returned future resolves to its send result"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((recipient_name, message, future))
+        return future
+
+    async def flush(self):
+        """Wait until everything queued so far has been sent"""
+        await self._queue.join()
+
+    async def close(self):
+        if self._flusher is None:
+            return
+        await self.flush()
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+
+    async def _collect(self) -> List[Tuple[str, str, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.linger
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                results = await self.client.send_batch([(r, m) for r, m, _ in batch])
+                for (_, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                logger.error(f"Batch send failed: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from bisect import bisect
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import metrics
+
+if TYPE_CHECKING:
+    import httpx
+
+NODE_HEADER = "x-cohora-node"  # Set on forwarded requests so they are never forwarded twice
+OWNER_HEADER = "x-cohora-owner"  # Redirect hint: base URL of the node that owns the user
+SECRET_HEADER = "x-cohora-cluster-secret"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes: List[str], vnodes: int = 128):
+        points: List[Tuple[int, str]] = sorted(
+            (_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        index = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class Cluster:
+    """Static cluster membership plus persistent keep-alive links to peer nodes.
+
+    Users are owned by ``ring.owner(user_id)``: that node holds their
+    connections and delivers their messages. The name -> id registry is
+    replicated to every node, with ``ring.owner(name)`` serializing creates.
+    """
+
+    def __init__(self, node_id: str, nodes: Dict[str, str], secret: str):
+        if node_id not in nodes:
+            raise ValueError(f"Node '{node_id}' is not in the cluster node list")
+        if not secret:
+            # Internal endpoints rewrite the registry; without a secret anyone could call them
+            raise ValueError("Cluster mode needs a shared secret (COHORA_CLUSTER_SECRET)")
+        self.node_id = node_id
+        self.nodes = nodes  # Maps node id -> base URL
+        self.secret = secret
+        self.ring = HashRing(sorted(nodes))
+        self._links: Dict[str, "httpx.AsyncClient"] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["Cluster"]:
+        """Build from COHORA_NODE_ID, COHORA_CLUSTER_NODES ("a=http://host:8001,b=...") and COHORA_CLUSTER_SECRET"""
+        node_id = os.environ.get("COHORA_NODE_ID")
+        spec = os.environ.get("COHORA_CLUSTER_NODES")
+        if not node_id or not spec:
+            return None
+        nodes = dict(item.split("=", 1) for item in spec.split(",") if item)
+        return cls(node_id, nodes, os.environ.get("COHORA_CLUSTER_SECRET", ""))
+
+    def owner(self, key: str) -> str:
+        return self.ring.owner(key)
+
+    def is_local(self, key: str) -> bool:
+        return self.owner(key) == self.node_id
+
+    def url(self, node_id: str) -> str:
+        return self.nodes[node_id]
+
+    def peers(self) -> List[str]:
+        return [node for node in self.nodes if node != self.node_id]
+
+    def link(self, node_id: str) -> "httpx.AsyncClient":
+        client = self._links.get(node_id)
+        if client is None:
+            # Imported on first use so single-node servers don't pay for it at startup
+            import httpx
+            client = self._links[node_id] = httpx.AsyncClient(
+                base_url=self.nodes[node_id],
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=64, keepalive_expiry=None),
+                headers={NODE_HEADER: self.node_id, SECRET_HEADER: self.secret},
+                timeout=10.0,
+            )
+        return client
+
+    def authorized(self, headers) -> bool:
+        return headers.get(NODE_HEADER) in self.nodes and hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(), self.secret.encode()
+        )
+
+    async def forward(self, node_id: str, method: str, path: str, **kwargs) -> "httpx.Response":
+        return await self.link(node_id).request(method, path, **kwargs)
+
+    async def broadcast(self, method: str, path: str, **kwargs) -> List[Any]:
+        """Send to every peer; failures, including error statuses, are logged and counted rather than raised"""
+        peers = self.peers()
+        results = await asyncio.gather(
+            *(self.forward(node, method, path, **kwargs) for node in peers),
+            return_exceptions=True,
+        )
+        for node, result in zip(peers, results):
+            failed = isinstance(result, BaseException) or result.status_code >= 400
+            if failed:
+                # The peer now disagrees with this node until it restarts and resyncs
+                metrics.counters["cluster_broadcast_failures"] += 1
+                reason = repr(result) if isinstance(result, BaseException) else f"HTTP {result.status_code}"
+                print(f"[Server] {method} {path} to node '{node}' failed: {reason}")
+        return results
+
+    async def close(self):
+        await asyncio.gather(*(client.aclose() for client in self._links.values()))
+        self._links.clear()
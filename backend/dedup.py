@@ -0,0 +1,41 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class IdempotencyCache:
+    """Remembers the response to recently used idempotency keys.
+
+    An LRU bounded by ``max_entries`` whose entries also expire ``ttl``
+    seconds after they were stored. Expired entries are dropped when they are
+    looked up or reach the LRU end, so there is no sweeper to run.
+    """
+
+    def __init__(self, max_entries: int = 100_000, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, now: Optional[float] = None) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.monotonic() if now is None else now
+        if now - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self._entries[key] = (now, value)
+        self._entries.move_to_end(key)
+        while self._entries:
+            oldest_key, (stored_at, _) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - stored_at <= self.ttl:
+                break
+            del self._entries[oldest_key]
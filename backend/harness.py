@@ -0,0 +1,195 @@
+"""Run the chat server in-process, with no sockets or ports.
+
+``InProcessServer`` loads a fresh copy of ``main`` so every instance starts
+with empty state, runs its startup and shutdown handlers, and talks to it
+through ``httpx.ASGITransport`` and an in-memory WebSocket client:
+
+    async with InProcessServer() as server:
+        alice = await server.create_user("alice")
+        ws = await server.websocket(alice)
+        await server.http.post("/api/messages/send", ...)
+        frame = await ws.recv_json()
+
+Streaming responses (Server-Sent Events) are not supported: the ASGI
+transport waits for the whole body. Long-poll works.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+import metrics
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+
+class WebSocketClosed(Exception):
+    def __init__(self, code: int, reason: str = ""):
+        super().__init__(f"WebSocket closed with code {code}: {reason}")
+        self.code = code
+        self.reason = reason
+
+
+class InMemoryWebSocket:
+    """A WebSocket client wired straight to an ASGI app through two queues"""
+
+    def __init__(self, app, path: str = "/ws", headers: Optional[Dict[str, str]] = None):
+        self.app = app
+        self.path, _, query = path.partition("?")
+        self.query = query
+        self.headers = headers or {}
+        self.close_code: Optional[int] = None
+        self.close_reason = ""
+        self._to_app: asyncio.Queue = asyncio.Queue()
+        self._from_app: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "scheme": "ws",
+            "http_version": "1.1",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "query_string": self.query.encode(),
+            "root_path": "",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in self.headers.items()],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+            "subprotocols": [],
+            "state": {},
+        }
+        self._to_app.put_nowait({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(scope, self._to_app.get, self._from_app.put))
+        message = await self._next()
+        if message["type"] != "websocket.accept":
+            raise WebSocketClosed(message.get("code", 1000), message.get("reason", ""))
+
+    async def _next(self) -> Dict[str, Any]:
+        """The app's next message; a close once the app has finished"""
+        if self.close_code is not None:
+            raise WebSocketClosed(self.close_code, self.close_reason)
+        get = asyncio.ensure_future(self._from_app.get())
+        await asyncio.wait((get, self._task), return_when=asyncio.FIRST_COMPLETED)
+        if not get.done():
+            get.cancel()
+            error = self._task.exception()
+            self.close_code = 1011 if error else 1006
+            raise WebSocketClosed(self.close_code, str(error or "handler returned without closing"))
+        message = get.result()
+        if message["type"] == "websocket.close":
+            self.close_code = message.get("code") or 1000
+            self.close_reason = message.get("reason") or ""
+            # Answer the close handshake as a real client would
+            self._to_app.put_nowait({"type": "websocket.disconnect", "code": self.close_code})
+            raise WebSocketClosed(self.close_code, self.close_reason)
+        return message
+
+    async def send(self, text: str):
+        self._to_app.put_nowait({"type": "websocket.receive", "text": text})
+
+    async def send_json(self, data: Any):
+        await self.send(json.dumps(data))
+
+    async def recv(self, timeout: Optional[float] = 5.0) -> str:
+        message = await asyncio.wait_for(self._next(), timeout)
+        return message.get("text") if message.get("text") is not None else message.get("bytes")
+
+    async def recv_json(self, timeout: Optional[float] = 5.0) -> Any:
+        return json.loads(await self.recv(timeout))
+
+    async def close(self, code: int = 1000):
+        if self._task is None or self._task.done():
+            return
+        if self.close_code is None:
+            self.close_code = code
+            self._to_app.put_nowait({"type": "websocket.disconnect", "code": code})
+        try:
+            await asyncio.wait_for(self._task, timeout=5)
+        except Exception:
+            pass
+
+
+def load_app_module(env: Optional[Dict[str, str]] = None) -> ModuleType:
+    """Execute main.py into a new module object, with only ``env``'s COHORA_* settings applied"""
+    saved = dict(os.environ)
+    try:
+        for key in [key for key in os.environ if key.startswith("COHORA_")]:
+            del os.environ[key]
+        os.environ.update(env or {})
+        spec = importlib.util.spec_from_file_location("main", BACKEND_DIR / "main.py")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+class InProcessServer:
+    """A private instance of the server app, with its own registry, sessions and background tasks"""
+
+    def __init__(self, env: Optional[Dict[str, str]] = None):
+        self.env = env
+        self.main: Optional[ModuleType] = None
+        self.http: Optional[httpx.AsyncClient] = None
+        self._websockets: List[InMemoryWebSocket] = []
+        self._lifespan_in: asyncio.Queue = asyncio.Queue()
+        self._lifespan_out: asyncio.Queue = asyncio.Queue()
+        self._lifespan: Optional[asyncio.Task] = None
+
+    @property
+    def app(self):
+        return self.main.app
+
+    async def start(self):
+        # Counters live in a shared module; start them from zero like a new process would
+        metrics.counters.clear()
+        self.main = load_app_module(self.env)
+        scope = {"type": "lifespan", "asgi": {"version": "3.0", "spec_version": "2.0"}, "state": {}}
+        self._lifespan = asyncio.create_task(self.app(scope, self._lifespan_in.get, self._lifespan_out.put))
+        await self._lifespan_event("startup")
+        self.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://testserver")
+
+    async def stop(self):
+        for ws in self._websockets:
+            await ws.close()
+        if self.http:
+            await self.http.aclose()
+        await self._lifespan_event("shutdown")
+        await self._lifespan
+
+    async def _lifespan_event(self, event: str):
+        self._lifespan_in.put_nowait({"type": f"lifespan.{event}"})
+        message = await self._lifespan_out.get()
+        if message["type"] != f"lifespan.{event}.complete":
+            raise RuntimeError(f"App {event} failed: {message.get('message', message['type'])}")
+
+    async def __aenter__(self) -> "InProcessServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def create_user(self, name: str) -> str:
+        response = await self.http.post("/api/users/create", json={"name": name})
+        response.raise_for_status()
+        return response.json()["id"]
+
+    async def websocket(
+        self, user_id: Optional[str] = None, path: str = "/ws", ack: bool = True, headers: Optional[Dict[str, str]] = None
+    ) -> InMemoryWebSocket:
+        """Connect, authenticating with the x-user-id header, and consume the connection_status ack"""
+        ws = InMemoryWebSocket(self.app, path, {**({"x-user-id": user_id} if user_id else {}), **(headers or {})})
+        await ws.connect()
+        self._websockets.append(ws)
+        if ack and user_id:
+            await ws.recv()
+        return ws
@@ -0,0 +1,140 @@
+import time
+from bisect import bisect_left, bisect_right
+from itertools import count
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+ConversationKey = Tuple[str, ...]
+
+
+class HistoryEntry(NamedTuple):
+    seq: int
+    message_id: str
+    conversation: ConversationKey
+    sender: str
+    message: str
+    timestamp: float
+
+
+class Conversation:
+    """Append-only log of one conversation.
+
+    ``seqs`` and ``timestamps`` are parallel to ``entries`` and both
+    non-decreasing, so cursor and time-range lookups are binary searches.
+    """
+
+    __slots__ = ("entries", "seqs", "timestamps")
+
+    def __init__(self):
+        self.entries: List[HistoryEntry] = []
+        self.seqs: List[int] = []
+        self.timestamps: List[float] = []
+
+
+class HistoryPage(NamedTuple):
+    entries: List[HistoryEntry]
+    next_cursor: Optional[int]
+
+
+class HistoryStore:
+    """Per-conversation message history with O(1) appends"""
+
+    def __init__(self):
+        self.conversations: Dict[ConversationKey, Conversation] = {}
+        self.participants: Dict[str, Set[ConversationKey]] = {}  # name -> direct conversations they are in
+        self.size = 0
+        self._seq = count(1)
+
+    @staticmethod
+    def direct_key(name_a: str, name_b: str) -> ConversationKey:
+        return ("dm",) + tuple(sorted((name_a, name_b)))
+
+    @staticmethod
+    def room_key(room_name: str) -> ConversationKey:
+        return ("room", room_name)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(
+        self,
+        key: ConversationKey,
+        message_id: str,
+        sender: str,
+        message: str,
+        timestamp: Optional[float] = None,
+    ) -> HistoryEntry:
+        conversation = self.conversations.get(key)
+        if conversation is None:
+            conversation = self.conversations[key] = Conversation()
+            if key[0] == "dm":
+                for name in key[1:]:
+                    self.participants.setdefault(name, set()).add(key)
+        timestamp = time.time() if timestamp is None else timestamp
+        # Keep timestamps sorted even if the wall clock steps backwards
+        if conversation.timestamps and timestamp < conversation.timestamps[-1]:
+            timestamp = conversation.timestamps[-1]
+        entry = HistoryEntry(next(self._seq), message_id, key, sender, message, timestamp)
+        conversation.entries.append(entry)
+        conversation.seqs.append(entry.seq)
+        conversation.timestamps.append(timestamp)
+        self.size += 1
+        return entry
+
+    def direct_conversations(self, name: str) -> Set[ConversationKey]:
+        return self.participants.get(name, set())
+
+    def drop_participant(self, name: str) -> List[HistoryEntry]:
+        """Remove every direct conversation ``name`` is part of, so a new holder of the name cannot read it.
+
+        Returns the removed entries. Room history is kept.
+        """
+        removed: List[HistoryEntry] = []
+        for key in self.participants.pop(name, ()):
+            conversation = self.conversations.pop(key)
+            removed.extend(conversation.entries)
+            self.size -= len(conversation.entries)
+            for other in key[1:]:
+                keys = self.participants.get(other)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.participants[other]
+        return removed
+
+    def drop_conversation(self, key: ConversationKey) -> List[HistoryEntry]:
+        """Remove one conversation, such as a deleted room's; returns its entries"""
+        conversation = self.conversations.pop(key, None)
+        if conversation is None:
+            return []
+        self.size -= len(conversation.entries)
+        return conversation.entries
+
+    def page(
+        self,
+        key: ConversationKey,
+        limit: int = 50,
+        before: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> HistoryPage:
+        """Return up to ``limit`` newest entries older than ``before`` within [since, until].
+
+        Entries are oldest first. ``next_cursor`` is passed back as ``before``
+        to fetch the preceding page, and is None once the range is exhausted.
+        """
+        conversation = self.conversations.get(key)
+        if conversation is None or limit <= 0:
+            return HistoryPage([], None)
+        hi = len(conversation.entries)
+        if before is not None:
+            hi = bisect_left(conversation.seqs, before)
+        if until is not None:
+            hi = min(hi, bisect_right(conversation.timestamps, until))
+        lo = 0
+        if since is not None:
+            lo = bisect_left(conversation.timestamps, since)
+        start = max(lo, hi - limit)
+        if start >= hi:
+            return HistoryPage([], None)
+        entries = conversation.entries[start:hi]
+        return HistoryPage(entries, entries[0].seq if start > lo else None)
@@ -0,0 +1,97 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import metrics
+
+
+class LoopMonitor:
+    """Measures event-loop lag and captures the stack of anything that blocks the loop.
+
+    A task on the loop sleeps for ``interval`` and records how late it wakes
+    up. A watchdog thread watches that task's heartbeat; when it goes stale
+    for longer than ``slow_threshold`` the loop thread is stuck in one
+    callback, so the thread grabs that thread's current stack.
+    """
+
+    def __init__(self, interval: float = 0.05, slow_threshold: float = 0.1, window: int = 1200, max_records: int = 100):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.lags: Deque[float] = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.slow_callbacks: Deque[Dict[str, Any]] = deque(maxlen=max_records)
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._current_stall: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            self._beat = time.monotonic()
+            stall = self._current_stall
+            if stall is not None:
+                # The loop is running again; record how long the stall lasted
+                stall["blocked_ms"] = round(lag * 1000, 1)
+                self._current_stall = None
+
+    def _watch(self):
+        check_every = max(0.01, self.slow_threshold / 2)
+        while not self._stop.wait(check_every):
+            stale_for = time.monotonic() - self._beat - self.interval
+            if stale_for < self.slow_threshold or self._current_stall is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stall = {
+                "detected_at": time.time(),
+                "blocked_ms": round(stale_for * 1000, 1),  # Updated when the loop resumes
+                "stack": traceback.format_stack(frame),
+            }
+            self._current_stall = stall
+            self.slow_callbacks.append(stall)
+            metrics.counters["loop_slow_callbacks"] += 1
+
+    def lag_stats(self) -> Dict[str, float]:
+        samples = sorted(self.lags)
+        if not samples:
+            return {"current_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+        def pct(p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+        return {
+            "current_ms": round(self.lags[-1] * 1000, 3),
+            "p50_ms": pct(0.5),
+            "p99_ms": pct(0.99),
+            "max_ms": round(self.max_lag * 1000, 3),
+        }
+
+    def recent_slow_callbacks(self, limit: int = 20) -> List[Dict[str, Any]]:
+        return list(self.slow_callbacks)[-limit:]
@@ -1,17 +1,99 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, status, Header
-from pyngrok import ngrok
-import uvicorn
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, status, Header, Query, Request, Response, Depends
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import asyncio
-from typing import Dict, Optional, Union
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple, Union
 from pydantic import BaseModel
 import uuid
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
 from enum import IntEnum
 
+import metrics
+from admission import AdmissionControl, AdmissionLimits
+from cluster import OWNER_HEADER, Cluster
+from dedup import IdempotencyCache
+from history import ConversationKey, HistoryEntry, HistoryStore
+from loopmonitor import LoopMonitor
+from profiler import EndpointLabelMiddleware, EndpointLabels, SamplingProfiler
+import snapshot
+from registry import UserRegistry, format_id, parse_id
+from rpc import PendingCall, RpcRouter
+from search import SearchIndex
+from sessions import MailboxSession, SendLimits, Session
+from streams import StreamRelay
+from timingwheel import TimingWheel
+from tracing import NOOP_TRACE, ReceiveTimeMiddleware, Tracer
+from unread import UnreadTracker
+
+# Endpoints the sampling profiler attributes CPU time to
+endpoint_labels = EndpointLabels({
+    "/api/messages/send": "send_message",
+    "/api/users/list": "list_users",
+    "/ws": "websocket"
+})
+
 app = FastAPI()
+app.add_middleware(ReceiveTimeMiddleware)
+app.add_middleware(EndpointLabelMiddleware, labels=endpoint_labels)
+
+class RedactCredentials(logging.Filter):
+    """Blank subscribe tokens and user IDs out of request lines in the access log"""
+    pattern = re.compile(r"([?&](?:token|user_id)=)[^&\s]*")
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # uvicorn.access logs (client, method, path with query, http version, status)
+        if isinstance(record.args, tuple) and len(record.args) >= 3 and isinstance(record.args[2], str):
+            args = list(record.args)
+            args[2] = self.pattern.sub(r"\1[redacted]", args[2])
+            record.args = tuple(args)
+        return True
+
+logging.getLogger("uvicorn.access").addFilter(RedactCredentials())
 
 # In-memory storage
-users: Dict[str, str] = {}  # Maps name -> id
-connections: Dict[str, WebSocket] = {}  # Maps user_id -> WebSocket
+USER_TTL = float(os.environ.get("COHORA_USER_TTL", "0"))  # Seconds of inactivity before a user is deleted; 0 = never
+registry = UserRegistry(track_seen=USER_TTL > 0)  # name <-> user ID, with IDs stored as 16 raw bytes
+connections: Dict[str, Session] = {}  # Maps user_id -> Session
+send_limits = SendLimits()  # Outbound buffer watermarks for every session
+admission = AdmissionControl(AdmissionLimits(
+    max_connections=int(os.environ.get("COHORA_MAX_CONNECTIONS", "0")),
+    accept_rate=float(os.environ.get("COHORA_ACCEPT_RATE", "0")),
+    accept_burst=int(os.environ.get("COHORA_ACCEPT_BURST", "0")),
+    auth_timeout=float(os.environ.get("COHORA_AUTH_TIMEOUT", "10")),
+))  # Caps on open sockets, per-user sessions and the accept rate
+idempotency_cache = IdempotencyCache()  # (sender_id, Idempotency-Key) -> (request fingerprint, original SendMessageResponse)
+expiry_wheel = TimingWheel()  # Expires queued frames sent with a ttl
+rooms: Dict[str, Set[str]] = {}  # Maps room name -> member user_ids
+history = HistoryStore()  # Delivered messages per conversation
+search_index = SearchIndex()  # Full-text index over history
+unread = UnreadTracker()  # Per-user unread counts and read cursors, by conversation
+rpc_router = RpcRouter()  # In-flight request/response calls between users
+stream_relay = StreamRelay()  # Open streamed messages, relayed chunk by chunk
+cluster: Optional[Cluster] = Cluster.from_env()  # None when running as a single node
+tracer = Tracer.from_env()  # Sampled per-message traces, served at /debug/traces
+DEBUG_TOKEN = os.environ.get("COHORA_DEBUG_TOKEN")  # Required by /debug endpoints, which are disabled without it
+loop_monitor = LoopMonitor(slow_threshold=float(os.environ.get("COHORA_SLOW_CALLBACK_MS", "100")) / 1000)
+loop_thread_id: Optional[int] = None  # Set at startup; the thread /debug/profile samples
+profile_lock = asyncio.Lock()  # One profile at a time
+background_tasks: List[asyncio.Task] = []  # Started at startup, cancelled at shutdown
+SNAPSHOT_FILE = os.environ.get("COHORA_SNAPSHOT_FILE")  # Registry and queued frames are saved here when set
+SNAPSHOT_INTERVAL = float(os.environ.get("COHORA_SNAPSHOT_INTERVAL", "30"))  # Seconds between snapshots
+snapshot_write: Optional[asyncio.Future] = None  # The snapshot being written on a worker thread, if any
+restored_frames: Dict[str, List[Tuple[str, float]]] = {}  # user_id -> messages queued before a restart, delivered on reconnect
+SUBSCRIBE_TOKEN_TTL = 300.0  # Seconds a ?token= for /api/messages/events and /poll stays valid
+subscribe_tokens = IdempotencyCache(ttl=SUBSCRIBE_TOKEN_TTL)  # Subscribe token -> user_id
+MAILBOX_IDLE_TIMEOUT = 60.0  # Seconds a long-poll mailbox survives without a poll
+FRAGMENT_SIZE = 64 * 1024  # Characters per fragment frame, for WebSocket clients that accept fragments
+SSE_KEEPALIVE_SECONDS = 15.0  # Comment line sent on an idle event stream so proxies keep it open
+USER_BATCH_CHUNK = 1000  # Names applied per pass of a bulk create before yielding to live traffic
+USER_SWEEP_BATCH = 1000  # Idle users expired per pass before yielding to live traffic
 
 # WebSocket Close Codes (RFC 6455)
 class WSCloseCode(IntEnum):
@@ -33,6 +115,8 @@ class WSCloseCode(IntEnum):
     AUTHENTICATION_FAILED = 4001
     INVALID_USER = 4002
     SESSION_EXPIRED = 4003
+    OWNER_MOVED = 4004  # Cluster mode: reconnect to the node named in the close reason
+    SESSION_REPLACED = 4005  # A newer WebSocket, event stream or long-poll for the same user took over
 
 # Message Status Codes
 class MessageStatus(IntEnum):
@@ -40,8 +124,14 @@ class MessageStatus(IntEnum):
     QUEUED = 202
     BAD_REQUEST = 400
     UNAUTHORIZED = 401
+    FORBIDDEN = 403
     NOT_FOUND = 404
+    CONFLICT = 409
+    UNPROCESSABLE = 422
+    TOO_MANY_REQUESTS = 429
     INTERNAL_ERROR = 500
+    SERVICE_UNAVAILABLE = 503
+    GATEWAY_TIMEOUT = 504
 
 # Pydantic models for request/response validation
 class CreateUserRequest(BaseModel):
@@ -54,12 +144,98 @@ class CreateUserResponse(BaseModel):
 class SendMessageRequest(BaseModel):
     recipient_name: str
     message: str
+    idempotency_key: Optional[str] = None
+    ttl_ms: Optional[int] = None
+    report_expiry: bool = False
 
 class SendMessageResponse(BaseModel):
     message_id: str
     status: MessageStatus
     details: str
 
+class SendBatchRequest(BaseModel):
+    messages: List[SendMessageRequest]
+
+class SendBatchResult(BaseModel):
+    message_id: Optional[str] = None
+    status: MessageStatus
+    details: str
+
+class SendBatchResponse(BaseModel):
+    results: List[SendBatchResult]
+
+class CreateRoomRequest(BaseModel):
+    name: str
+
+class RoomResponse(BaseModel):
+    name: str
+    members: List[str]
+
+class RoomMessageRequest(BaseModel):
+    message: str
+    ttl_ms: Optional[int] = None
+
+class RoomMessageResponse(BaseModel):
+    message_id: str
+    status: MessageStatus
+    details: str
+    delivered: int
+    offline: int
+
+class HistoryMessage(BaseModel):
+    cursor: int
+    message_id: str
+    from_user: str
+    message: str
+    timestamp: float
+
+class HistoryResponse(BaseModel):
+    messages: List[HistoryMessage]
+    next_cursor: Optional[int] = None
+
+class ReadReceiptRequest(BaseModel):
+    with_user: Optional[str] = None
+    room: Optional[str] = None
+    cursor: Optional[int] = None  # History cursor of the last message read; omitted = everything
+
+class ReadReceiptResponse(BaseModel):
+    unread: int
+    total_unread: int
+
+class ConversationUnread(BaseModel):
+    with_user: Optional[str] = None
+    room: Optional[str] = None
+    unread: int
+    last_read: Optional[int] = None
+    last_message: Optional[int] = None
+
+class UnreadSummaryResponse(BaseModel):
+    conversations: List[ConversationUnread]
+    total_unread: int
+
+class SearchResult(BaseModel):
+    cursor: int
+    message_id: str
+    from_user: str
+    with_user: Optional[str] = None
+    room: Optional[str] = None
+    snippet: str
+    score: float
+    timestamp: float
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+
+class RpcCallRequest(BaseModel):
+    recipient_name: str
+    body: Any = None
+    timeout_ms: Optional[int] = None
+
+class RpcCallResponse(BaseModel):
+    call_id: str
+    from_user: str
+    body: Any = None
+
 class MessageDelivery(BaseModel):
     from_user: str
     message: str
@@ -70,37 +246,294 @@ class MessageDelivery(BaseModel):
          response_model=CreateUserResponse,
          status_code=status.HTTP_201_CREATED)
 async def create_user(request: CreateUserRequest):
-    if request.name in users:
+    if cluster and not cluster.is_local(request.name):
+        # The name's owner node serializes creates so names stay unique cluster-wide
+        forwarded = await cluster.forward(
+            cluster.owner(request.name), "POST", "/api/users/create", json={"name": request.name}
+        )
+        if forwarded.status_code != status.HTTP_201_CREATED:
+            raise HTTPException(status_code=forwarded.status_code, detail=forwarded.json()["detail"])
+        return CreateUserResponse(**forwarded.json())
+    if request.name in registry:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Username already exists"
         )
     user_id = str(uuid.uuid4())
-    users[request.name] = user_id
+    registry.add(request.name, user_id)
+    if cluster:
+        await cluster.broadcast("POST", "/internal/users/replicate", json={"name": request.name, "id": user_id})
     return CreateUserResponse(id=user_id)
 
+@app.post("/internal/users/replicate",
+          status_code=status.HTTP_204_NO_CONTENT)
+async def replicate_user(request: Request):
+    if not cluster or not cluster.authorized(request.headers):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a cluster peer")
+    data = await request.json()
+    apply_replicated_users({data["name"]: data["id"]})
+
+def apply_replicated_users(users: Dict[str, str]):
+    """Add users created on a peer; an existing name or ID is never rebound"""
+    for name, user_id in users.items():
+        if not registry.setdefault(name, user_id) and registry.id_of(name) != user_id:
+            metrics.counters["replication_conflicts"] += 1
+            print(f"[Server] Ignored replicated user '{name}': name or ID already registered")
+
 @app.get("/api/users/list",
          status_code=status.HTTP_200_OK)
 async def list_users():
     return {
         "status": status.HTTP_200_OK,
-        "users": {name: id for name, id in users.items()}
+        "users": dict(registry.items())
     }
 
-@app.post("/api/messages/send",
-          response_model=SendMessageResponse,
+async def read_names(http_request: Request) -> List[Any]:
+    """Names from a { "names": [...] } body or an NDJSON stream.
+
+    NDJSON is parsed line by line as it arrives, so the raw upload is never
+    held whole; each line is a JSON string or a { "name": ... } object.
+    """
+    content_type = http_request.headers.get("content-type", "")
+    if "ndjson" not in content_type and "jsonl" not in content_type:
+        try:
+            names = (await http_request.json())["names"]
+        except (ValueError, KeyError, TypeError):
+            names = None
+        if not isinstance(names, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Expected { \"names\": [...] } or an application/x-ndjson body"
+            )
+        return names
+
+    def parse(line: bytes) -> Any:
+        try:
+            item = json.loads(line)
+        except ValueError:
+            return None
+        return item.get("name") if isinstance(item, dict) else item
+
+    names: List[Any] = []
+    buffer = b""
+    async for data in http_request.stream():
+        *lines, buffer = (buffer + data).split(b"\n")
+        names.extend(parse(line) for line in lines if line.strip())
+    if buffer.strip():
+        names.append(parse(buffer))
+    return names
+
+async def create_users(names: List[Any]) -> List[Dict[str, Any]]:
+    """Create users for one chunk of names; one result per name, in order"""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(names)
+    local: List[int] = []
+    remote: Dict[str, List[int]] = {}
+    for index, name in enumerate(names):
+        if not isinstance(name, str):
+            results[index] = {"name": None, "id": None, "status": status.HTTP_400_BAD_REQUEST,
+                              "details": "Expected a name string"}
+        elif cluster and not cluster.is_local(name):
+            remote.setdefault(cluster.owner(name), []).append(index)
+        else:
+            local.append(index)
+
+    created: Dict[str, str] = {}
+    for index, user_id in zip(local, registry.add_new(names[i] for i in local)):
+        name = names[index]
+        if user_id is None:
+            results[index] = {"name": name, "id": None, "status": status.HTTP_409_CONFLICT,
+                              "details": "Username already exists"}
+        else:
+            results[index] = {"name": name, "id": user_id, "status": status.HTTP_201_CREATED}
+            created[name] = user_id
+    if cluster and created:
+        await cluster.broadcast("POST", "/internal/users/replicate_batch", json={"users": created})
+
+    async def forward(node: str, indices: List[int]):
+        # Each owner node creates its own names, one request per node per chunk
+        try:
+            response = await cluster.forward(
+                node, "POST", "/api/users/create_batch", json={"names": [names[i] for i in indices]}
+            )
+            response.raise_for_status()
+            for index, line in zip(indices, response.text.splitlines()):
+                results[index] = json.loads(line)
+        except Exception as e:
+            print(f"[Server] Bulk create on node '{node}' failed: {e}")
+            for index in indices:
+                results[index] = {"name": names[index], "id": None, "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+                                  "details": f"Owner node '{node}' unavailable"}
+
+    if remote:
+        await asyncio.gather(*(forward(node, indices) for node, indices in remote.items()))
+    return results
+
+@app.post("/api/users/create_batch",
           status_code=status.HTTP_200_OK)
-async def send_message(
-    request: SendMessageRequest,
+async def create_users_batch(http_request: Request):
+    """Bulk registration: one NDJSON result line per name, in input order"""
+    names = await read_names(http_request)
+
+    async def results():
+        # Applied a chunk at a time, each chunk's results written before the next starts
+        for start in range(0, len(names), USER_BATCH_CHUNK):
+            chunk = await create_users(names[start:start + USER_BATCH_CHUNK])
+            yield "".join(json.dumps(result) + "\n" for result in chunk)
+            await asyncio.sleep(0)  # Let live traffic in between chunks
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+async def forget_users(user_ids: List[str], reason: str) -> List[str]:
+    """Delete users on this node: registry entry, room memberships and any live session.
+
+    A live WebSocket is closed with SESSION_EXPIRED. Returns the IDs that were registered here.
+    """
+    names: Dict[str, str] = {}
+    for user_id in user_ids:
+        name = registry.remove(user_id)
+        if name is not None:
+            names[user_id] = name
+    removed = list(names)
+    if not removed:
+        return removed
+    dropped: List[HistoryEntry] = []
+    for user_id, name in names.items():
+        restored_frames.pop(user_id, None)
+        unread.drop_user(user_id)
+        # Direct history is keyed by name, and the name can be registered again
+        for key in list(history.direct_conversations(name)):
+            for other in key[1:]:
+                other_id = registry.id_of(other)
+                if other_id:
+                    unread.drop_conversation(other_id, key)
+        dropped.extend(history.drop_participant(name))
+    gone = set(removed)
+    for room_name, members in list(rooms.items()):
+        members -= gone
+        if not members:
+            dropped.extend(drop_room(room_name))
+    # One removal for the whole batch, so a token shared by many users is rebuilt once per sweep
+    search_index.remove(dropped)
+
+    async def close(user_id: str, session: Session):
+        await session.close(WSCloseCode.SESSION_EXPIRED, reason)
+        await release_session(user_id, session)
+
+    await asyncio.gather(*(
+        close(user_id, connections[user_id]) for user_id in removed if user_id in connections
+    ))
+    return removed
+
+@app.delete("/api/users/{name}",
+            status_code=status.HTTP_204_NO_CONTENT)
+async def delete_user(
+    name: str,
     x_user_id: Union[str, None] = Header(default=None)
 ):
-    # Verify sender exists
-    sender_name = None
-    for name, id in users.items():
-        if request.recipient_name == name:
-            sender_name = name
-            break
+    """Users delete themselves: the x-user-id header must be the named user's ID"""
+    authenticate_sender(x_user_id)
+    user_id = registry.id_of(name)
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={
+                "code": MessageStatus.NOT_FOUND,
+                "message": f"User '{name}' not found"
+            }
+        )
+    if user_id != x_user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail={
+                "code": MessageStatus.FORBIDDEN,
+                "message": "Users can only delete themselves"
+            }
+        )
+    await forget_users([user_id], "user deleted")
+    metrics.counters["users_deleted"] += 1
+    print(f"[Server] Deleted user '{name}'")
+    if cluster:
+        await cluster.broadcast("POST", "/internal/users/remove", json={"ids": [user_id], "reason": "user deleted"})
+
+@app.post("/internal/users/remove",
+          status_code=status.HTTP_204_NO_CONTENT)
+async def replicate_removal(request: Request):
+    if not cluster or not cluster.authorized(request.headers):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a cluster peer")
+    data = await request.json()
+    await forget_users(data["ids"], data.get("reason", ""))
+
+@app.post("/internal/users/replicate_batch",
+          status_code=status.HTTP_204_NO_CONTENT)
+async def replicate_users(request: Request):
+    if not cluster or not cluster.authorized(request.headers):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a cluster peer")
+    data = await request.json()
+    apply_replicated_users(data["users"])
+
+def record_message(key: ConversationKey, message_id: str, sender_name: str, message: str) -> int:
+    """Append a delivered message to history and index it for search; returns its history cursor"""
+    entry = history.append(key, message_id, sender_name, message)
+    search_index.add(entry)
+    if cluster and key[0] == "dm":
+        # The recipient's owner delivered it; the sender's owner serves the sender's history and search
+        sender_id = registry.id_of(sender_name)
+        if sender_id and not cluster.is_local(sender_id):
+            asyncio.create_task(mirror_message(cluster.owner(sender_id), entry))
+    return entry.seq
+
+async def mirror_message(node_id: str, entry: HistoryEntry):
+    try:
+        response = await cluster.forward(node_id, "POST", "/internal/history/record", json={
+            "conversation": list(entry.conversation),
+            "message_id": entry.message_id,
+            "sender": entry.sender,
+            "message": entry.message,
+            "timestamp": entry.timestamp
+        })
+        response.raise_for_status()
+    except Exception as e:
+        metrics.counters["history_mirror_failures"] += 1
+        print(f"[Server] Could not copy message {entry.message_id} to node '{node_id}': {e!r}")
 
+@app.post("/internal/history/record",
+          status_code=status.HTTP_204_NO_CONTENT)
+async def record_mirrored_message(request: Request):
+    """A direct message delivered by another node, copied to the sender's owner"""
+    if not cluster or not cluster.authorized(request.headers):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a cluster peer")
+    data = await request.json()
+    entry = history.append(
+        tuple(data["conversation"]), data["message_id"], data["sender"], data["message"], data["timestamp"]
+    )
+    search_index.add(entry)
+
+def conversation_label(key: ConversationKey, caller_name: str) -> Tuple[Optional[str], Optional[str]]:
+    """(with_user, room) naming a conversation from the caller's side"""
+    kind, *names = key
+    if kind == "dm":
+        # A self-conversation has the caller on both sides
+        return (names[1] if names[0] == caller_name else names[0]), None
+    return None, names[0]
+
+def start_request_trace(name: str, http_request: Request, trace_id: Optional[str] = None):
+    """Start a trace at the request's arrival, covering body parsing and validation as its first span"""
+    received_at = getattr(http_request.state, "received_at", None) or time.perf_counter()
+    trace = tracer.start(name, trace_id, started=received_at)
+    trace.add_span("receive_and_validate", received_at, time.perf_counter())
+    return trace
+
+def authenticate_sender(x_user_id: Union[str, None]) -> str:
+    """Resolve the sender's name from the x-user-id header"""
+    if not x_user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={
+                "code": MessageStatus.UNAUTHORIZED,
+                "message": "Authentication required"
+            }
+        )
+    sender_name = registry.name_of(x_user_id)
     if not sender_name:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -109,9 +542,95 @@ async def send_message(
                 "message": "Invalid user ID"
             }
         )
+    registry.touch(x_user_id)  # Every authenticated request counts as activity
+    return sender_name
+
+def ttl_seconds(ttl_ms: Optional[int]) -> Optional[float]:
+    if ttl_ms is None:
+        return None
+    if ttl_ms <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "code": MessageStatus.BAD_REQUEST,
+                "message": "ttl_ms must be positive"
+            }
+        )
+    return ttl_ms / 1000
+
+def request_fingerprint(request: SendMessageRequest) -> bytes:
+    """What a repeated idempotency key must match for its original response to be replayed"""
+    return hashlib.sha256(json.dumps([request.recipient_name, request.message]).encode()).digest()
+
+async def forward_message(
+    request: SendMessageRequest,
+    x_user_id: str,
+    owner: str,
+    response: Optional[Response],
+    trace=NOOP_TRACE
+) -> SendMessageResponse:
+    """Relay a send to the recipient's owner node and pass its answer back"""
+    hint = {OWNER_HEADER: cluster.url(owner)}
+    if response is not None:
+        response.headers.update(hint)
+    headers = {"x-user-id": x_user_id}
+    if trace.sampled:
+        headers["x-trace-id"] = trace.trace_id
+    try:
+        with trace.span("forward"):
+            forwarded = await cluster.forward(
+                owner, "POST", "/api/messages/send",
+                json=request.model_dump(exclude_none=True),
+                headers=headers
+            )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "code": MessageStatus.INTERNAL_ERROR,
+                "message": "Failed to deliver message",
+                "error": f"Owner node '{owner}' unreachable: {e}"
+            },
+            headers=hint
+        )
+    if forwarded.status_code != status.HTTP_200_OK:
+        raise HTTPException(status_code=forwarded.status_code, detail=forwarded_error(forwarded), headers=hint)
+    return SendMessageResponse(**forwarded.json())
+
+def forwarded_error(forwarded: "httpx.Response") -> Dict[str, Any]:
+    """A peer's error response as {"code", "message"}, whatever shape its body had"""
+    try:
+        detail = forwarded.json().get("detail")
+    except (ValueError, AttributeError):
+        detail = forwarded.text or forwarded.reason_phrase
+    if isinstance(detail, dict) and isinstance(detail.get("code"), int) and isinstance(detail.get("message"), str):
+        return detail
+    # e.g. FastAPI's list of validation errors, or a plain-text 500 from a proxy
+    return {"code": forwarded.status_code, "message": detail if isinstance(detail, str) else json.dumps(detail)}
+
+async def deliver_message(
+    request: SendMessageRequest,
+    x_user_id: Union[str, None],
+    response: Optional[Response] = None,
+    from_peer: bool = False,
+    trace=NOOP_TRACE
+) -> SendMessageResponse:
+    # Verify sender exists
+    with trace.span("authenticate"):
+        sender_name = authenticate_sender(x_user_id)
+    ttl = ttl_seconds(request.ttl_ms)
+    if request.idempotency_key is not None and not 0 < len(request.idempotency_key) <= 255:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "code": MessageStatus.BAD_REQUEST,
+                "message": "Idempotency key must be 1-255 characters"
+            }
+        )
 
     # Get recipient's ID from their username
-    recipient_id = users.get(request.recipient_name)
+    with trace.span("lookup_recipient"):
+        recipient_id = registry.id_of(request.recipient_name)
     if not recipient_id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -121,6 +640,33 @@ async def send_message(
             }
         )
 
+    # A send a peer already forwarded is delivered here, never bounced on
+    if cluster and not from_peer and not cluster.is_local(recipient_id):
+        return await forward_message(request, x_user_id, cluster.owner(recipient_id), response, trace)
+
+    # Checked on the delivering node, so a retry that lands on another node is still caught.
+    # Local delivery never awaits, so the same key cannot be in flight twice.
+    dedup_key = (x_user_id, request.idempotency_key) if request.idempotency_key else None
+    if dedup_key:
+        fingerprint = request_fingerprint(request)
+        entry = idempotency_cache.get(dedup_key)
+        if entry is not None:
+            original_fingerprint, original = entry
+            if original_fingerprint != fingerprint:
+                # A reused key on a different message is a client bug; replaying would hide the new message
+                metrics.counters["idempotency_conflicts"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                    detail={
+                        "code": MessageStatus.UNPROCESSABLE,
+                        "message": "Idempotency key was already used for a different message"
+                    }
+                )
+            metrics.counters["idempotent_replays"] += 1
+            if response is not None:
+                response.headers["Idempotent-Replayed"] = "true"
+            return original
+
     if recipient_id not in connections:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -132,19 +678,44 @@ async def send_message(
     
     message_id = str(uuid.uuid4())
 
+    frame = {
+        "from": sender_name,
+        "message": request.message,
+        "message_id": message_id,
+        "timestamp": asyncio.get_event_loop().time()
+    }
+    if trace.sampled:
+        frame["trace_id"] = trace.trace_id
+
+    on_expired = None
+    if request.report_expiry:
+        def on_expired():
+            # Reaches the sender only if they are connected to this node
+            sender_session = connections.get(x_user_id)
+            if sender_session:
+                sender_session.send_json({
+                    "type": "message_expired",
+                    "message_id": message_id,
+                    "recipient": request.recipient_name
+                }, control=True)
+
     try:
-        await connections[recipient_id].send_json({
-            "from": sender_name,
-            "message": request.message,
-            "message_id": message_id,
-            "timestamp": asyncio.get_event_loop().time()
-        })
+        with trace.span("enqueue"):
+            if not connections[recipient_id].send_json(frame, trace, ttl=ttl, on_expired=on_expired):
+                raise ConnectionError("Recipient connection closed")
+        with trace.span("record_history"):
+            key = history.direct_key(sender_name, request.recipient_name)
+            unread.record(recipient_id, key, record_message(key, message_id, sender_name, request.message))
         
-        return SendMessageResponse(
+        # DELIVERED means handed to the recipient's session; its writer task puts it on the socket afterwards
+        delivered = SendMessageResponse(
             message_id=message_id,
             status=MessageStatus.DELIVERED,
             details=f"Message {message_id} delivered to {request.recipient_name}"
         )
+        if dedup_key:
+            idempotency_cache.put(dedup_key, (fingerprint, delivered))
+        return delivered
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -155,20 +726,623 @@ async def send_message(
             }
         )
 
+@app.post("/api/messages/send",
+          response_model=SendMessageResponse,
+          status_code=status.HTTP_200_OK)
+async def send_message(
+    request: SendMessageRequest,
+    response: Response,
+    http_request: Request,
+    x_user_id: Union[str, None] = Header(default=None),
+    x_cohora_node: Union[str, None] = Header(default=None),
+    x_trace_id: Union[str, None] = Header(default=None),
+    idempotency_key: Union[str, None] = Header(default=None)
+):
+    if idempotency_key is not None:
+        request.idempotency_key = idempotency_key
+    trace = start_request_trace("send_message", http_request, x_trace_id)
+    trace.set("recipient", request.recipient_name)
+    try:
+        return await deliver_message(
+            request, x_user_id, response, from_peer=x_cohora_node is not None, trace=trace
+        )
+    finally:
+        trace.release()
+
+@app.post("/api/messages/send_batch",
+          response_model=SendBatchResponse,
+          status_code=status.HTTP_200_OK)
+async def send_message_batch(
+    request: SendBatchRequest,
+    http_request: Request,
+    x_user_id: Union[str, None] = Header(default=None),
+    x_trace_id: Union[str, None] = Header(default=None)
+):
+    # Deliver in order so messages to the same recipient keep their ordering;
+    # each item reports its own status instead of failing the whole batch
+    trace = start_request_trace("send_batch", http_request, x_trace_id)
+    trace.set("size", len(request.messages))
+    results = []
+    try:
+        for item in request.messages:
+            try:
+                delivered = await deliver_message(item, x_user_id, trace=trace)
+                results.append(SendBatchResult(
+                    message_id=delivered.message_id,
+                    status=delivered.status,
+                    details=delivered.details
+                ))
+            except HTTPException as e:
+                detail = e.detail if isinstance(e.detail, dict) else {"code": e.status_code, "message": str(e.detail)}
+                results.append(SendBatchResult(
+                    status=detail["code"],
+                    details=detail["message"]
+                ))
+    finally:
+        trace.release()
+    return SendBatchResponse(results=results)
+
+def get_room(name: str) -> Set[str]:
+    members = rooms.get(name)
+    if members is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={
+                "code": MessageStatus.NOT_FOUND,
+                "message": f"Room '{name}' not found"
+            }
+        )
+    return members
+
+def drop_room(name: str) -> List[HistoryEntry]:
+    """Delete an empty room and its history, so whoever creates the name next cannot read it; returns the
+    dropped entries, which the caller removes from the search index"""
+    del rooms[name]
+    return history.drop_conversation(history.room_key(name))
+
+def room_response(name: str, members: Set[str]) -> RoomResponse:
+    return RoomResponse(name=name, members=sorted(registry.name_of(uid) for uid in members))
+
+@app.post("/api/rooms/create",
+          response_model=RoomResponse,
+          status_code=status.HTTP_201_CREATED)
+async def create_room(
+    request: CreateRoomRequest,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    authenticate_sender(x_user_id)
+    if request.name in rooms:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Room already exists"
+        )
+    rooms[request.name] = {x_user_id}
+    return room_response(request.name, rooms[request.name])
+
+@app.post("/api/rooms/{room_name}/join",
+          response_model=RoomResponse,
+          status_code=status.HTTP_200_OK)
+async def join_room(
+    room_name: str,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    authenticate_sender(x_user_id)
+    members = get_room(room_name)
+    members.add(x_user_id)
+    return room_response(room_name, members)
+
+@app.post("/api/rooms/{room_name}/leave",
+          response_model=RoomResponse,
+          status_code=status.HTTP_200_OK)
+async def leave_room(
+    room_name: str,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    authenticate_sender(x_user_id)
+    members = get_room(room_name)
+    members.discard(x_user_id)
+    if not members:
+        search_index.remove(drop_room(room_name))
+    return room_response(room_name, members)
+
+@app.post("/api/rooms/{room_name}/send",
+          response_model=RoomMessageResponse,
+          status_code=status.HTTP_200_OK)
+async def send_room_message(
+    room_name: str,
+    request: RoomMessageRequest,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    sender_name = authenticate_sender(x_user_id)
+    ttl = ttl_seconds(request.ttl_ms)
+    members = get_room(room_name)
+    if x_user_id not in members:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail={
+                "code": MessageStatus.FORBIDDEN,
+                "message": f"Not a member of room '{room_name}'"
+            }
+        )
+
+    # Only members are visited, and the frame is serialized once for all of them
+    message_id = str(uuid.uuid4())
+    payload = json.dumps({
+        "from": sender_name,
+        "room": room_name,
+        "message": request.message,
+        "message_id": message_id,
+        "timestamp": asyncio.get_event_loop().time()
+    })
+    # Each session's writer task sends independently, so queueing is the whole fan-out cost
+    delivered = sum(
+        1 for uid in members
+        if uid != x_user_id and uid in connections and connections[uid].send(payload, ttl=ttl)
+    )
+    key = history.room_key(room_name)
+    cursor = record_message(key, message_id, sender_name, request.message)
+    # Offline members count it as unread too
+    for uid in members:
+        if uid != x_user_id:
+            unread.record(uid, key, cursor)
+
+    return RoomMessageResponse(
+        message_id=message_id,
+        status=MessageStatus.DELIVERED,
+        details=f"Message {message_id} delivered to {delivered} member(s) of {room_name}",
+        delivered=delivered,
+        offline=len(members) - 1 - delivered
+    )
+
+def conversation_key(caller_name: str, caller_id: str, with_user: Optional[str], room: Optional[str]) -> ConversationKey:
+    """The direct conversation (with_user) or room (which the caller must be in) a request names"""
+    if (with_user is None) == (room is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "code": MessageStatus.BAD_REQUEST,
+                "message": "Specify exactly one of 'with_user' or 'room'"
+            }
+        )
+    if room is not None:
+        if caller_id not in get_room(room):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail={
+                    "code": MessageStatus.FORBIDDEN,
+                    "message": f"Not a member of room '{room}'"
+                }
+            )
+        return history.room_key(room)
+    return history.direct_key(caller_name, with_user)
+
+@app.get("/api/messages/history",
+         response_model=HistoryResponse,
+         status_code=status.HTTP_200_OK)
+async def get_history(
+    http_request: Request,
+    with_user: Optional[str] = None,
+    room: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    before: Optional[int] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    """Page backwards through a direct conversation (with_user) or a room, newest page first.
+
+    In cluster mode this is served by the caller's owner node, which holds both sides of their direct conversations.
+    """
+    caller_name = registry.name_of(authenticate_subscriber(http_request, x_user_id))
+    key = conversation_key(caller_name, x_user_id, with_user, room)
+    page = history.page(key, limit=limit, before=before, since=since, until=until)
+    return HistoryResponse(
+        messages=[
+            HistoryMessage(
+                cursor=entry.seq,
+                message_id=entry.message_id,
+                from_user=entry.sender,
+                message=entry.message,
+                timestamp=entry.timestamp
+            )
+            for entry in page.entries
+        ],
+        next_cursor=page.next_cursor
+    )
+
+@app.post("/api/messages/read",
+          response_model=ReadReceiptResponse,
+          status_code=status.HTTP_200_OK)
+async def mark_read(
+    request: ReadReceiptRequest,
+    http_request: Request,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    """Read receipt: everything in the conversation up to ``cursor`` (default: all of it) is read"""
+    # Counters live on the reader's owner node, which is where their messages are delivered
+    reader_id = authenticate_subscriber(http_request, x_user_id)
+    key = conversation_key(registry.name_of(reader_id), reader_id, request.with_user, request.room)
+    metrics.counters["read_receipts"] += 1
+    return ReadReceiptResponse(
+        unread=unread.mark_read(reader_id, key, request.cursor),
+        total_unread=unread.total(reader_id)
+    )
+
+@app.get("/api/messages/unread",
+         response_model=UnreadSummaryResponse,
+         status_code=status.HTTP_200_OK)
+async def get_unread(
+    http_request: Request,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    """Unread count and read cursor for every conversation the caller has received messages in"""
+    reader_id = authenticate_subscriber(http_request, x_user_id)
+    reader_name = registry.name_of(reader_id)
+    conversations = []
+    for key, state in unread.summary(reader_id):
+        with_user, room = conversation_label(key, reader_name)
+        conversations.append(ConversationUnread(
+            with_user=with_user,
+            room=room,
+            unread=len(state.unread),
+            last_read=state.last_read,
+            last_message=state.last_received
+        ))
+    return UnreadSummaryResponse(conversations=conversations, total_unread=unread.total(reader_id))
+
+@app.get("/api/messages/search",
+         response_model=SearchResponse,
+         status_code=status.HTTP_200_OK)
+async def search_messages(
+    http_request: Request,
+    q: str,
+    participant: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    """Ranked full-text search over the caller's direct conversations and rooms, on their owner node in cluster mode"""
+    caller_name = registry.name_of(authenticate_subscriber(http_request, x_user_id))
+    # Only the caller's own conversations are searched, so nobody else's messages are even scored
+    keys = list(history.direct_conversations(caller_name))
+    keys.extend(history.room_key(name) for name, members in rooms.items() if x_user_id in members)
+    scope = [history.conversations[key] for key in keys if key in history.conversations]
+
+    hits = search_index.search(
+        q, limit=limit, participant=participant, since=since, until=until, scope=scope
+    )
+    results = []
+    for hit in hits:
+        with_user, room = conversation_label(hit.entry.conversation, caller_name)
+        results.append(SearchResult(
+            cursor=hit.entry.seq,
+            message_id=hit.entry.message_id,
+            from_user=hit.entry.sender,
+            with_user=with_user,
+            room=room,
+            snippet=hit.snippet,
+            score=hit.score,
+            timestamp=hit.entry.timestamp
+        ))
+    return SearchResponse(results=results)
+
+def start_rpc_call(
+    caller_id: str,
+    caller_name: str,
+    recipient_name: str,
+    body: Any,
+    timeout_ms: Optional[int],
+    reply_to: Callable[[Any, Optional[Dict[str, Any]]], None],
+    track_caller: bool = True
+) -> Optional[PendingCall]:
+    """Open a call and push it to the callee's session; on failure reply_to gets the error and None is returned"""
+    callee_id = registry.id_of(recipient_name)
+    session = connections.get(callee_id) if callee_id else None
+    if session is None:
+        reply_to(None, {"code": MessageStatus.NOT_FOUND, "message": f"Recipient '{recipient_name}' not connected"})
+        return None
+    if isinstance(session, MailboxSession):
+        # SSE and long-poll have no way to send the rpc_response back
+        reply_to(None, {"code": MessageStatus.CONFLICT, "message": f"Recipient '{recipient_name}' is connected without a WebSocket and cannot answer calls"})
+        return None
+    timeout = timeout_ms / 1000 if timeout_ms and timeout_ms > 0 else None
+    call = rpc_router.open(caller_id, callee_id, reply_to, timeout, track_caller)
+    pushed = session.send_json({
+        "type": "rpc_request",
+        "call_id": call.call_id,
+        "from": caller_name,
+        "body": body,
+        "timeout_ms": int((call.deadline - asyncio.get_running_loop().time()) * 1000)
+    })
+    if not pushed:
+        rpc_router.cancel(call.call_id)
+        reply_to(None, {"code": MessageStatus.SERVICE_UNAVAILABLE, "message": f"Recipient '{recipient_name}' disconnected"})
+        return None
+    return call
+
+@app.post("/api/rpc/call",
+          response_model=RpcCallResponse,
+          status_code=status.HTTP_200_OK)
+async def rpc_call(
+    request: RpcCallRequest,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    """Call a connected user and wait for their rpc_response (or the deadline)"""
+    caller_name = authenticate_sender(x_user_id)
+    reply = asyncio.get_running_loop().create_future()
+
+    def reply_to(body: Any, error: Optional[Dict[str, Any]]):
+        if not reply.done():
+            reply.set_result((body, error))
+
+    # The HTTP request is the reply-to, so the caller's WebSocket going away must not drop the call
+    call = start_rpc_call(
+        x_user_id, caller_name, request.recipient_name, request.body, request.timeout_ms, reply_to, track_caller=False
+    )
+    try:
+        body, error = await reply
+    finally:
+        if call:
+            rpc_router.cancel(call.call_id)  # No-op unless the client gave up first
+    if error:
+        code = error["code"]
+        raise HTTPException(
+            status_code=code if 400 <= code < 600 else status.HTTP_502_BAD_GATEWAY,
+            detail={"code": code, "message": error["message"]}
+        )
+    return RpcCallResponse(call_id=call.call_id, from_user=request.recipient_name, body=body)
+
+def normalize_rpc_error(error: Any) -> Dict[str, Any]:
+    """A callee-supplied error as {"code": int, "message": str}; anything malformed becomes INTERNAL_ERROR"""
+    if not isinstance(error, dict):
+        return {"code": MessageStatus.INTERNAL_ERROR, "message": str(error)}
+    code = error.get("code")
+    if not isinstance(code, int) or isinstance(code, bool):
+        code = MessageStatus.INTERNAL_ERROR
+    message = error.get("message")
+    return {"code": code, "message": message if isinstance(message, str) else "Call failed"}
+
+def handle_rpc_frame(session: Session, user_id: str, data: Dict[str, Any]):
+    """Route an rpc_request from a caller's socket, or a callee's rpc_response back to its caller"""
+    if data["type"] == "rpc_response":
+        error = data.get("error")
+        if error is not None:
+            error = normalize_rpc_error(error)
+        rpc_router.resolve(data.get("call_id"), user_id, data.get("body"), error)
+        return
+
+    caller_call_id = data.get("call_id")
+    recipient_name = data.get("to")
+
+    def reply_to(body: Any, error: Optional[Dict[str, Any]]):
+        frame = {"type": "rpc_response", "call_id": caller_call_id, "from": recipient_name}
+        if error:
+            frame["error"] = error
+        else:
+            frame["body"] = body
+        session.send_json(frame)
+
+    if not caller_call_id or not isinstance(recipient_name, str):
+        reply_to(None, {"code": MessageStatus.BAD_REQUEST, "message": "rpc_request needs 'call_id' and 'to'"})
+        return
+    start_rpc_call(user_id, registry.name_of(user_id), recipient_name, data.get("body"), data.get("timeout_ms"), reply_to)
+
+def handle_stream_frame(session: Session, user_id: str, data: Dict[str, Any]):
+    """Open, relay or close a streamed message sent from the sender's socket"""
+    frame_type = data["type"]
+
+    def fail(code: MessageStatus, message: str, **ids):
+        session.send_json({"type": "stream_error", **ids, "error": {"code": code, "message": message}}, control=True)
+
+    if frame_type == "stream_open":
+        stream_id = data.get("stream_id")
+        recipient_name = data.get("to")
+        recipient_id = registry.id_of(recipient_name) if isinstance(recipient_name, str) else None
+        recipient = connections.get(recipient_id) if recipient_id else None
+        if recipient is None:
+            fail(MessageStatus.NOT_FOUND, f"Recipient '{recipient_name}' not connected", stream_id=stream_id)
+            return
+        if isinstance(recipient, MailboxSession):
+            # Credit comes back as chunks hit a socket, and SSE or long-poll has none to report it
+            fail(MessageStatus.CONFLICT, f"Recipient '{recipient_name}' is connected without a WebSocket and cannot receive streams",
+                 stream_id=stream_id)
+            return
+        stream = stream_relay.open(session, recipient, registry.name_of(user_id))
+        if stream is None:
+            fail(MessageStatus.TOO_MANY_REQUESTS, "Too many open streams", stream_id=stream_id)
+            return
+        recipient.send_json({
+            "type": "stream_open",
+            "from": stream.sender_name,
+            "message_id": stream.message_id,
+            "timestamp": asyncio.get_event_loop().time()
+        })
+        session.send_json({
+            "type": "stream_opened",
+            "stream_id": stream_id,
+            "message_id": stream.message_id,
+            "window": stream.window
+        }, control=True)
+        return
+
+    message_id = data.get("message_id")
+    stream = stream_relay.streams.get(message_id) if isinstance(message_id, str) else None
+    if stream is None or stream.sender is not session:
+        fail(MessageStatus.NOT_FOUND, "Unknown stream", message_id=message_id)
+        return
+    if frame_type == "stream_chunk":
+        chunk = data.get("data")
+        error = "Chunk data must be a string" if not isinstance(chunk, str) else stream_relay.relay(stream, chunk)
+        if error:
+            # Aborting is the only safe answer: dropping one chunk would corrupt the message
+            fail(MessageStatus.BAD_REQUEST, error, message_id=message_id)
+            stream_relay.close(stream, {"code": MessageStatus.BAD_REQUEST, "message": error})
+    else:
+        error = data.get("error")
+        if error is not None and not isinstance(error, dict):
+            error = {"code": MessageStatus.INTERNAL_ERROR, "message": str(error)}
+        stream_relay.close(stream, error)
+
+def register_session(user_id: str, session: Session):
+    """Make ``session`` the user's delivery target; the newest connection wins"""
+    previous = connections.get(user_id)
+    connections[user_id] = session
+    carried: List[Tuple[str, float]] = []
+    if previous is not None and previous is not session:
+        # A replaced session would stay open but never receive again; close it and move its queue over
+        carried = previous.replace(WSCloseCode.SESSION_REPLACED, "Replaced by a newer connection")
+        asyncio.create_task(release_session(user_id, previous))
+    now = time.time()
+    for payload, expires_at in [*restored_frames.pop(user_id, ()), *carried]:
+        if not expires_at:
+            session.send(payload)
+        elif expires_at > now:
+            session.send(payload, ttl=expires_at - now)
+
+async def release_session(user_id: str, session: Session):
+    """Close a session and, unless a newer one replaced it, drop the user's delivery state"""
+    await session.close(WSCloseCode.NORMAL_CLOSURE)
+    stream_relay.drop_session(session)
+    if connections.get(user_id) is session:
+        del connections[user_id]
+        rpc_router.drop_user(user_id)
+        print(f"[Server] Cleaned up connection for user '{user_id}'")
+
+def redirect_to_node(http_request: Request, node_id: str):
+    owner_url = cluster.url(node_id)
+    location = owner_url + http_request.url.path + (f"?{http_request.url.query}" if http_request.url.query else "")
+    raise HTTPException(
+        status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+        detail="User is served by another node",
+        headers={"Location": location, OWNER_HEADER: owner_url}
+    )
+
+def authenticate_subscriber(http_request: Request, x_user_id: Union[str, None], token: Union[str, None] = None) -> str:
+    """Resolve the user for SSE and long-poll, which also accept a ?token= from /api/messages/subscribe_token
+    because EventSource cannot set headers"""
+    subscriber_id = x_user_id
+    if not subscriber_id and token:
+        # Tokens are issued by the owner node and name it, so any node can send the request there
+        issuer = token.partition(".")[0]
+        if cluster and issuer != cluster.node_id and issuer in cluster.nodes:
+            redirect_to_node(http_request, issuer)
+        subscriber_id = subscribe_tokens.get(token)
+        if subscriber_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail={
+                    "code": MessageStatus.UNAUTHORIZED,
+                    "message": "Unknown or expired subscribe token"
+                }
+            )
+    authenticate_sender(subscriber_id)
+    if cluster and not cluster.is_local(subscriber_id):
+        redirect_to_node(http_request, cluster.owner(subscriber_id))
+    return subscriber_id
+
+def attach_mailbox(user_id: str, reuse: bool) -> MailboxSession:
+    session = connections.get(user_id)
+    if reuse and isinstance(session, MailboxSession) and not session.closed:
+        return session
+    session = MailboxSession(user_id, send_limits, WSCloseCode.TRY_AGAIN_LATER, expiry_wheel)
+    register_session(user_id, session)
+    print(f"[Server] User with ID '{user_id}' subscribed without a WebSocket")
+    session.send_json({
+        "type": "connection_status",
+        "status": status.HTTP_200_OK,
+        "message": "Connected successfully"
+    }, control=True)
+    return session
+
+@app.post("/api/messages/subscribe_token",
+          status_code=status.HTTP_200_OK)
+async def create_subscribe_token(
+    http_request: Request,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    """A short-lived ?token= for /api/messages/events and /poll, so the user ID never goes in a URL"""
+    subscriber_id = authenticate_subscriber(http_request, x_user_id)
+    token = secrets.token_urlsafe(24)
+    if cluster:
+        token = f"{cluster.node_id}.{token}"
+    subscribe_tokens.put(token, subscriber_id)
+    return {"status": status.HTTP_200_OK, "token": token, "expires_in": SUBSCRIBE_TOKEN_TTL}
+
+@app.get("/api/messages/events",
+         status_code=status.HTTP_200_OK)
+async def stream_events(
+    http_request: Request,
+    token: Optional[str] = None,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    """Server-Sent Events: every frame a WebSocket would receive, as one "data:" event each"""
+    subscriber_id = authenticate_subscriber(http_request, x_user_id, token)
+    session = attach_mailbox(subscriber_id, reuse=False)
+
+    async def events():
+        try:
+            while not session.closed:
+                registry.touch(subscriber_id)  # An open event stream keeps its user active
+                frames = await session.take(timeout=SSE_KEEPALIVE_SECONDS)
+                if frames:
+                    yield "".join(f"data: {frame}\n\n" for frame in frames)
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            await release_session(subscriber_id, session)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/messages/poll",
+         status_code=status.HTTP_200_OK)
+async def poll_messages(
+    http_request: Request,
+    timeout: float = Query(default=25.0, ge=0, le=60),
+    max_frames: int = Query(default=100, ge=1, le=1000),
+    token: Optional[str] = None,
+    x_user_id: Union[str, None] = Header(default=None)
+):
+    """Long-poll: wait up to ``timeout`` seconds for frames, then return everything queued"""
+    subscriber_id = authenticate_subscriber(http_request, x_user_id, token)
+    session = attach_mailbox(subscriber_id, reuse=True)
+    frames = await session.take(max_frames, timeout)
+    # Frames are already serialized; splice them in rather than parsing them back
+    return Response(
+        content='{"status": 200, "frames": [' + ",".join(frames) + "]}",
+        media_type="application/json"
+    )
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    print("[Server] WebSocket connection accepted")
+    rejection = admission.admit()
+    if rejection:
+        # Accepted only so the client gets the close code and retry hint; a refused handshake carries neither
+        metrics.counters[f"ws_rejected_{rejection.reason}"] += 1
+        await websocket.accept()
+        await websocket.close(code=WSCloseCode.TRY_AGAIN_LATER, reason=rejection.close_reason())
+        return
     user_id: Optional[str] = None
+    session: Optional[Session] = None
+    authenticated = False
     try:
+        # Inside the try, so a client that drops during the handshake still frees its slot
+        await websocket.accept()
+        metrics.counters["ws_accepted"] += 1
+        print("[Server] WebSocket connection accepted")
         # Attempt to get user_id from header
         user_id = websocket.headers.get("x-user-id")
+        # Clients that reassemble "fragment" frames say so, by header or in the auth message
+        accept_fragments = websocket.headers.get("x-accept-fragments") == "1"
         if user_id:
             # If header is provided, flush any duplicate auth message
             try:
                 extra = await asyncio.wait_for(websocket.receive_text(), timeout=0.1)
                 try:
-                    import json
                     data = json.loads(extra)
                     if "id" in data and data["id"] == user_id:
                         print("[Server] Duplicate auth message received and ignored")
@@ -180,61 +1354,313 @@ async def websocket_endpoint(websocket: WebSocket):
                 pass
         else:
             # If header not provided, wait for authentication JSON message
-            auth_data = await websocket.receive_json()
+            try:
+                auth_text = await asyncio.wait_for(websocket.receive_text(), timeout=admission.limits.auth_timeout)
+            except asyncio.TimeoutError:
+                metrics.counters["ws_auth_timeouts"] += 1
+                await websocket.close(code=WSCloseCode.AUTHENTICATION_FAILED, reason="authentication timed out")
+                return
+            try:
+                auth_data = json.loads(auth_text)
+            except ValueError:
+                print(f"[Server] Received non-JSON message during auth: {auth_text}")
+                auth_data = None
+            if not isinstance(auth_data, dict):
+                # Falls through to the invalid-user close below
+                auth_data = {}
             user_id = auth_data.get("id")
+            accept_fragments = auth_data.get("accept_fragments") is True
         
         # Validate user_id
-        if not user_id or not any(existing_id == user_id for existing_id in users.values()):
+        if registry.name_of(user_id) is None:
             await websocket.close(code=1008)
             return
+
+        if cluster and not cluster.is_local(user_id):
+            # Only the owner node delivers to this user; point the client there
+            await websocket.close(code=WSCloseCode.OWNER_MOVED, reason=cluster.url(cluster.owner(user_id)))
+            return
         
+        # No per-user cap: register_session closes the user's previous session, so each user holds at most one
+        admission.authenticate()
+        authenticated = True
+        registry.touch(user_id)
+
         # Store connection
-        connections[user_id] = websocket
+        session = Session(
+            user_id, websocket, send_limits, WSCloseCode.TRY_AGAIN_LATER, expiry_wheel,
+            fragment_size=FRAGMENT_SIZE if accept_fragments else 0
+        )
+        register_session(user_id, session)
         print(f"[Server] User with ID '{user_id}' connected")
         
         # Send connection acknowledgment
-        await websocket.send_json({
+        session.send_json({
             "type": "connection_status",
             "status": status.HTTP_101_SWITCHING_PROTOCOLS,
             "message": "Connected successfully"
-        })
+        }, control=True)
         
         # Keep connection alive and listen for messages
         while True:
             message = await websocket.receive_text()
+            registry.touch(user_id)  # Heartbeats count: a connected client stays active
+            trace = tracer.start("ws_receive")
             
             # Handle heartbeat
             if not message.strip():
-                await websocket.send_json({
-                    "type": "heartbeat",
-                    "status": "ok"
-                })
+                trace.set("kind", "heartbeat")
+                with trace.span("reply"):
+                    session.send_json({
+                        "type": "heartbeat",
+                        "status": "ok"
+                    }, trace, control=True)
+                trace.release()
                 continue
             
+            if message.lstrip().startswith("{"):
+                try:
+                    data = json.loads(message)
+                except ValueError:
+                    data = None
+                if isinstance(data, dict) and data.get("type") in ("rpc_request", "rpc_response"):
+                    trace.set("kind", data["type"])
+                    handle_rpc_frame(session, user_id, data)
+                    trace.release()
+                    continue
+                if isinstance(data, dict) and data.get("type") in ("stream_open", "stream_chunk", "stream_close"):
+                    trace.set("kind", data["type"])
+                    handle_stream_frame(session, user_id, data)
+                    trace.release()
+                    continue
+
             # Handle other messages
+            trace.set("kind", "text")
             print(f"[Server] Received message from {user_id}: {message}")
+            trace.release()
     except WebSocketDisconnect:
         print(f"[Server] Connection disconnected for user '{user_id}'")
     except Exception as e:
         print(f"[Server] Error in WebSocket connection for user '{user_id}': {str(e)}")
     finally:
-        if user_id in connections:
-            del connections[user_id]
-            print(f"[Server] Cleaned up connection for user '{user_id}'")
+        admission.release()
+        if authenticated:
+            admission.release_authenticated()
+        if session:
+            # A newer connection for the same user may have replaced this one
+            await release_session(user_id, session)
 
 # New background task for periodic status logging
 async def print_status_periodically():
     while True:
-        print(f"[Status Update] Current users: {users}")
-        print(f"[Status Update] Active WS connections: {list(connections.keys())}")
+        # Counts only: dumping every user blocks the loop once the registry is large
+        print(f"[Status Update] Current users: {len(registry)}")
+        print(f"[Status Update] Active WS connections: {len(connections)}")
         await asyncio.sleep(10)
 
+async def evict_slow_consumers_periodically(interval: float = 1.0):
+    # Sessions that stopped receiving sends also stop triggering the check in Session.send
+    while True:
+        await asyncio.sleep(interval)
+        for user_id, session in list(connections.items()):
+            session.check_slow()
+            # Mailboxes have no socket whose disconnect would clean them up
+            if isinstance(session, MailboxSession) and (session.closed or session.idle_for() > MAILBOX_IDLE_TIMEOUT):
+                await release_session(user_id, session)
+
+async def expire_idle_users_periodically(interval: float = 1.0):
+    # The registry keeps users in last-seen order, so each pass only visits users that are actually idle
+    while True:
+        await asyncio.sleep(interval)
+        while True:
+            idle = registry.idle_since(time.monotonic() - USER_TTL, USER_SWEEP_BATCH)
+            if cluster:
+                # Each user is expired by their owner node, which holds their socket
+                for user_id in idle:
+                    if not cluster.is_local(user_id):
+                        registry.untrack(user_id)
+                idle = [user_id for user_id in idle if cluster.is_local(user_id)]
+            expired = await forget_users(idle, "session expired")
+            if expired:
+                metrics.counters["users_expired"] += len(expired)
+                print(f"[Server] Expired {len(expired)} idle users")
+                if cluster:
+                    await cluster.broadcast("POST", "/internal/users/remove", json={"ids": expired, "reason": "session expired"})
+            if len(idle) < USER_SWEEP_BATCH:
+                break
+            await asyncio.sleep(0)  # Let live traffic in between batches
+
+@app.get("/api/metrics",
+         status_code=status.HTTP_200_OK)
+async def get_metrics():
+    return {
+        "status": status.HTTP_200_OK,
+        "counters": metrics.snapshot(),
+        "gauges": {
+            "connections": len(connections),
+            "sockets_open": admission.open,
+            "sockets_authenticating": admission.open - admission.authenticated,
+            "queued_bytes": sum(s.queued_bytes for s in connections.values()),
+            "queued_frames": sum(s.queued_frames for s in connections.values()),
+            "sessions_over_limit": sum(1 for s in connections.values() if s.over_limit_since is not None),
+            "rpc_pending": len(rpc_router.pending),
+            "streams_open": len(stream_relay.streams),
+            "expiry_timers": len(expiry_wheel),
+            **{f"loop_lag_{name}": value for name, value in loop_monitor.lag_stats().items()}
+        }
+    }
+
+def restore_snapshot():
+    """Load the registry and queued messages saved by a previous run, if there is a snapshot"""
+    if not SNAPSHOT_FILE or not os.path.exists(SNAPSHOT_FILE):
+        return
+    started = time.perf_counter()
+    try:
+        saved = snapshot.load(SNAPSHOT_FILE)
+    except (OSError, snapshot.SnapshotError) as e:
+        print(f"[Server] Ignoring snapshot '{SNAPSHOT_FILE}': {e}")
+        return
+    registry.restore(saved.names, saved.ids)
+    for raw, expires_at, payload in saved.frames:
+        restored_frames.setdefault(format_id(raw), []).append((payload, expires_at))
+    print(f"[Server] Restored {len(saved.names)} users and {len(saved.frames)} queued messages "
+          f"from snapshot in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+async def write_snapshot():
+    global snapshot_write
+    # Cancelling a periodic write does not stop its thread; let it finish so it cannot rename over a newer file
+    while snapshot_write is not None and not snapshot_write.done():
+        await asyncio.wait([snapshot_write])
+    # Copy on the loop, where nothing can change underneath; encode and write in a thread
+    names, ids = registry.export()
+    frames = [
+        (parse_id(user_id), expires_at, payload)
+        for user_id, session in connections.items()
+        for payload, expires_at in session.pending()
+    ]
+    frames += [
+        (parse_id(user_id), expires_at, payload)
+        for user_id, queued in restored_frames.items()
+        for payload, expires_at in queued
+    ]
+    started = time.perf_counter()
+    snapshot_write = asyncio.ensure_future(asyncio.to_thread(snapshot.write, SNAPSHOT_FILE, names, ids, frames))
+    await asyncio.shield(snapshot_write)
+    metrics.counters["snapshots_written"] += 1
+    return time.perf_counter() - started
+
+async def write_snapshots_periodically():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            await write_snapshot()
+        except Exception as e:
+            # Any failure, not just I/O, must leave the loop running for the next interval
+            metrics.counters["snapshot_failures"] += 1
+            print(f"[Server] Snapshot failed: {e!r}")
+
+async def sync_registry_from_peers():
+    # A restarted node starts empty; copy the replicated registry from any live peer
+    for node in cluster.peers():
+        try:
+            response = await cluster.forward(node, "GET", "/api/users/list")
+            for name, user_id in response.json()["users"].items():
+                registry.setdefault(name, user_id)
+            print(f"[Server] Synced {len(registry)} users from node '{node}'")
+            return
+        except Exception as e:
+            print(f"[Server] Could not sync registry from node '{node}': {e}")
+
+def require_debug_access(x_debug_token: Union[str, None] = Header(default=None)):
+    """Debug endpoints need COHORA_DEBUG_TOKEN in x-debug-token.
+
+    With no token configured they are disabled: a loopback client is not
+    necessarily local, since a tunnel or proxy on the same host forwards
+    public requests from 127.0.0.1.
+    """
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Debug endpoints are disabled; set COHORA_DEBUG_TOKEN")
+    if x_debug_token is None or not hmac.compare_digest(x_debug_token.encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Debug access denied")
+
+@app.get("/debug/traces",
+         status_code=status.HTTP_200_OK,
+         dependencies=[Depends(require_debug_access)])
+async def get_traces(limit: int = Query(default=100, ge=1, le=1000), trace_id: Optional[str] = None):
+    return {
+        "status": status.HTTP_200_OK,
+        "sample_rate": tracer.sample_rate,
+        "traces": tracer.recent(limit, trace_id)
+    }
+
+@app.get("/debug/loop",
+         status_code=status.HTTP_200_OK,
+         dependencies=[Depends(require_debug_access)])
+async def get_loop_stats(limit: int = Query(default=20, ge=1, le=100)):
+    """Event-loop lag and the stacks of recent callbacks that blocked the loop"""
+    return {
+        "status": status.HTTP_200_OK,
+        "slow_threshold_ms": loop_monitor.slow_threshold * 1000,
+        "lag": loop_monitor.lag_stats(),
+        "slow_callbacks": loop_monitor.recent_slow_callbacks(limit)
+    }
+
+@app.get("/debug/profile",
+         dependencies=[Depends(require_debug_access)])
+async def run_profile(
+    seconds: float = Query(default=10.0, gt=0, le=60),
+    interval_ms: float = Query(default=5.0, ge=1, le=100),
+    format: str = Query(default="json", pattern="^(json|collapsed)$")
+):
+    """Sample the live server for a bounded time.
+
+    format=collapsed returns flame-graph input ("frame;frame;frame count"
+    lines); json adds per-endpoint CPU attribution.
+    """
+    if profile_lock.locked():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running")
+    async with profile_lock:
+        profiler = SamplingProfiler(loop_thread_id, endpoint_labels.codes, interval_ms / 1000)
+        # Sampling runs in a worker thread so the loop keeps serving the traffic being profiled
+        await asyncio.to_thread(profiler.run, seconds)
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    return {
+        "status": status.HTTP_200_OK,
+        **profiler.summary(),
+        "collapsed": profiler.collapsed()
+    }
+
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(print_status_periodically())
+    global loop_thread_id
+    loop_thread_id = threading.get_ident()
+    loop_monitor.start()
+    expiry_wheel.start()
+    restore_snapshot()
+    background_tasks.append(asyncio.create_task(print_status_periodically()))
+    background_tasks.append(asyncio.create_task(evict_slow_consumers_periodically()))
+    if USER_TTL > 0:
+        background_tasks.append(asyncio.create_task(expire_idle_users_periodically()))
+    if SNAPSHOT_FILE:
+        background_tasks.append(asyncio.create_task(write_snapshots_periodically()))
+    if cluster:
+        print(f"[Server] Cluster node '{cluster.node_id}' of {sorted(cluster.nodes)}")
+        await sync_registry_from_peers()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    loop_monitor.stop()
+    expiry_wheel.stop()
+    for task in background_tasks:
+        task.cancel()
+    if SNAPSHOT_FILE:
+        elapsed = await write_snapshot()
+        print(f"[Server] Wrote snapshot of {len(registry)} users to '{SNAPSHOT_FILE}' in {elapsed * 1000:.1f}ms")
+    if cluster:
+        await cluster.close()
 
 if __name__ == "__main__":
-    public_url = ngrok.connect(8000, "http")
-    print(f"[Server] Public URL: {public_url}")
-    print(f"[Server] WebSocket URL: {public_url}/ws")
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # Kept for `python main.py`; see serve.py for options (python serve.py --help)
+    import serve
+    serve.main() 
\ No newline at end of file
@@ -0,0 +1,9 @@
+from collections import Counter
+from typing import Dict
+
+# Monotonic event counts, e.g. counters["slow_consumer_evictions"]
+counters: Counter = Counter()
+
+
+def snapshot() -> Dict[str, int]:
+    return dict(counters)
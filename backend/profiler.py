@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+IDLE = "idle"
+OTHER = "other"
+NO_PYTHON_FRAME = "<no python frame>"
+# Top-of-stack frames that mean the loop is waiting for I/O. asyncio waits in selectors.select; uvloop
+# polls in C, so the innermost Python frame left is whichever function started the loop.
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("asyncio/base_events.py", "run_forever"),
+    ("asyncio/base_events.py", "run_until_complete"),
+    ("asyncio/runners.py", "run"),
+    ("uvloop/__init__.py", "run"),
+    ("uvicorn/server.py", "run"),
+}
+
+
+def _is_idle_frame(code) -> bool:
+    path = code.co_filename.replace(os.sep, "/")
+    return any(code.co_name == name and path.endswith(suffix) for suffix, name in _IDLE_FRAMES)
+
+
+async def _run_endpoint(app, scope, receive, send):
+    await app(scope, receive, send)
+
+
+def _labeled_runner(label: str):
+    """A copy of ``_run_endpoint`` whose code object is unique to ``label``.
+
+    The sampler recognises the request an executing stack belongs to by
+    finding this code object in it, without touching another thread's locals.
+    """
+    code = _run_endpoint.__code__.replace(co_name=f"endpoint[{label}]", co_qualname=f"endpoint[{label}]")
+    return type(_run_endpoint)(code, _run_endpoint.__globals__, code.co_name)
+
+
+class EndpointLabels:
+    """Per-path labeled runners, and the code object -> label map the sampler looks for"""
+
+    def __init__(self, labels: Dict[str, str]):
+        self.runners = {path: _labeled_runner(label) for path, label in labels.items()}
+        self.codes = {self.runners[path].__code__: label for path, label in labels.items()}
+
+
+class EndpointLabelMiddleware:
+    """Runs requests for labeled paths inside their endpoint's labeled frame"""
+
+    def __init__(self, app, labels: EndpointLabels):
+        self.app = app
+        self.runners = labels.runners
+
+    async def __call__(self, scope, receive, send):
+        runner = self.runners.get(scope.get("path")) if scope["type"] != "lifespan" else None
+        if runner is None:
+            await self.app(scope, receive, send)
+        else:
+            await runner(self.app, scope, receive, send)
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval from a helper thread.
+
+    Stacks are kept collapsed ("root;...;leaf" -> count), ready for
+    flamegraph.pl or speedscope, and every sample is attributed to the
+    labeled endpoint on the stack, to the loop being idle, or to other work.
+    """
+
+    def __init__(self, thread_id: int, label_codes: Optional[Dict[Any, str]] = None, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.label_codes = label_codes or {}
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.endpoints: Counter = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+
+    def run(self, duration: float):
+        """Sample for ``duration`` seconds; blocks the calling (non-loop) thread"""
+        started = time.perf_counter()
+        deadline = started + duration
+        while time.perf_counter() < deadline:
+            self._sample()
+            time.sleep(self.interval)
+        self.elapsed = time.perf_counter() - started
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            # The thread is only in C code, such as a loop polling before any Python ran
+            self.samples += 1
+            self.endpoints[IDLE] += 1
+            self.stacks[NO_PYTHON_FRAME] += 1
+            return
+        top = frame
+        names = []
+        label = None
+        while frame is not None:
+            code = frame.f_code
+            if label is None:
+                label = self.label_codes.get(code)
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if _is_idle_frame(top.f_code):
+            # Whatever labeled frame sits below belongs to a request that is not running now
+            label = IDLE
+        self.samples += 1
+        self.endpoints[label or OTHER] += 1
+        self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        per_sample_ms = self.elapsed * 1000 / self.samples if self.samples else 0.0
+        busy = self.samples - self.endpoints.get(IDLE, 0)
+        return {
+            "duration_s": round(self.elapsed, 3),
+            "samples": self.samples,
+            "busy_fraction": round(busy / self.samples, 4) if self.samples else 0.0,
+            "endpoints": {
+                label: {
+                    "samples": count,
+                    "time_ms": round(count * per_sample_ms, 1),  # On the loop thread, busy time is CPU time
+                    "share_of_busy": round(count / busy, 4) if busy and label != IDLE else None,
+                }
+                for label, count in self.endpoints.most_common()
+            },
+        }
@@ -0,0 +1,150 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def format_id(raw: bytes) -> str:
+    """The canonical text form (lowercase, dashed UUID) of a 16-byte user ID"""
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def parse_id(user_id: Optional[str]) -> Optional[bytes]:
+    """16 raw bytes for a canonical user ID string; None for anything else"""
+    if not isinstance(user_id, str) or len(user_id) != 36:
+        return None
+    try:
+        raw = bytes.fromhex(user_id.replace("-", ""))
+    except ValueError:
+        return None
+    # Only the exact form we hand out, so one user has exactly one ID string
+    if len(raw) != 16 or format_id(raw) != user_id:
+        return None
+    return raw
+
+
+class UserRegistry:
+    """Registered users: name <-> 16-byte ID in two dicts.
+
+    Per user that is one name string, one 49-byte ``bytes`` ID instead of an
+    85-byte UUID string, and one entry in each dict. There is deliberately
+    no record object per user: at this size an extra object costs more than
+    it saves. IDs cross the API as strings and are converted at the edges.
+
+    With ``track_seen`` it also keeps each user's last-seen time, least
+    recently seen first, so idle users are found without scanning everyone.
+    """
+
+    def __init__(self, track_seen: bool = False):
+        self._ids: Dict[str, bytes] = {}  # name -> raw id
+        self._names: Dict[bytes, str] = {}  # raw id -> name
+        # raw id -> monotonic last-seen time; only kept when users can expire
+        self._seen: Optional["OrderedDict[bytes, float]"] = OrderedDict() if track_seen else None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    def add(self, name: str, user_id: str):
+        raw = parse_id(user_id)
+        if raw is None:
+            raise ValueError(f"Not a canonical user ID: {user_id!r}")
+        # Rebinding would leave the old ID -> name entry behind, still authenticating
+        if name in self._ids or raw in self._names:
+            raise ValueError(f"Name or ID already registered: {name!r}")
+        self._insert(name, raw)
+
+    def setdefault(self, name: str, user_id: str) -> bool:
+        """Add a user unless the name or ID is already registered (replication, registry sync); True if added"""
+        raw = parse_id(user_id)
+        if raw is not None and name not in self._ids and raw not in self._names:
+            self._insert(name, raw)
+            return True
+        return False
+
+    def add_new(self, names: Iterable[str]) -> List[Optional[str]]:
+        """Register every name not already taken under a fresh ID, in one pass.
+
+        Returns the new ID for each name, or None where the name was taken,
+        including by an earlier occurrence in the same batch.
+        """
+        ids = self._ids
+        created: List[Optional[str]] = []
+        for name in names:
+            if name in ids:
+                created.append(None)
+                continue
+            raw = uuid.uuid4().bytes
+            self._insert(name, raw)
+            created.append(format_id(raw))
+        return created
+
+    def _insert(self, name: str, raw: bytes):
+        self._ids[name] = raw
+        self._names[raw] = name
+        if self._seen is not None:
+            self._seen[raw] = time.monotonic()
+
+    def remove(self, user_id: str) -> Optional[str]:
+        """Delete a user; returns their name, or None if the ID was not registered"""
+        raw = parse_id(user_id)
+        name = self._names.pop(raw, None) if raw is not None else None
+        if name is None:
+            return None
+        del self._ids[name]
+        if self._seen is not None:
+            self._seen.pop(raw, None)
+        return name
+
+    def touch(self, user_id: str, now: Optional[float] = None):
+        """Record activity for a tracked user: O(1), moves them to the back of the idle order"""
+        if self._seen is None:
+            return
+        raw = parse_id(user_id)
+        if raw in self._seen:
+            self._seen[raw] = time.monotonic() if now is None else now
+            self._seen.move_to_end(raw)
+
+    def untrack(self, user_id: str):
+        """Stop tracking a user's activity, e.g. one another cluster node expires"""
+        if self._seen is not None:
+            self._seen.pop(parse_id(user_id), None)
+
+    def idle_since(self, cutoff: float, limit: int) -> List[str]:
+        """IDs of up to ``limit`` users not seen since ``cutoff``, least recently seen first"""
+        idle: List[str] = []
+        if self._seen is None:
+            return idle
+        for raw, seen in self._seen.items():
+            if seen >= cutoff or len(idle) >= limit:
+                break
+            idle.append(format_id(raw))
+        return idle
+
+    def export(self) -> Tuple[List[str], List[bytes]]:
+        """Names and their raw IDs as parallel lists, for a snapshot"""
+        return list(self._ids), list(self._ids.values())
+
+    def restore(self, names: List[str], raws: List[bytes]):
+        """Replace the contents with parallel lists from a snapshot, built by the dict constructors in one go"""
+        self._ids = dict(zip(names, raws))
+        self._names = dict(zip(raws, names))
+        if self._seen is not None:
+            # A restart is not inactivity: everyone restored gets a full TTL
+            self._seen = OrderedDict.fromkeys(raws, time.monotonic())
+
+    def id_of(self, name: str) -> Optional[str]:
+        raw = self._ids.get(name)
+        return format_id(raw) if raw is not None else None
+
+    def name_of(self, user_id: Optional[str]) -> Optional[str]:
+        raw = parse_id(user_id)
+        return self._names.get(raw) if raw is not None else None
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """(name, ID string) pairs, formatting IDs on the way out"""
+        for name, raw in self._ids.items():
+            yield name, format_id(raw)
@@ -0,0 +1,102 @@
+import asyncio
+import uuid
+from typing import Any, Callable, Dict, Optional, Set
+
+import metrics
+
+# reply(body, error): error is None or {"code": ..., "message": ...}
+ReplyTo = Callable[[Any, Optional[Dict[str, Any]]], None]
+
+
+class PendingCall:
+    __slots__ = ("call_id", "caller_id", "callee_id", "reply_to", "deadline", "timer")
+
+    def __init__(self, call_id: str, caller_id: str, callee_id: str, reply_to: ReplyTo, deadline: float):
+        self.call_id = call_id
+        self.caller_id = caller_id
+        self.callee_id = callee_id
+        self.reply_to = reply_to
+        self.deadline = deadline
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class RpcRouter:
+    """Tracks in-flight calls between users until they are answered, expire or lose an end.
+
+    Each call gets a server-side id that the callee echoes in its reply, and
+    a ``reply_to`` callback that delivers the result to whoever is waiting
+    (the caller's session, or an HTTP request's future). Deadlines are loop
+    timers, so an expired call costs nothing until it fires and an answered
+    one just cancels its timer.
+    """
+
+    def __init__(self, default_timeout: float = 30.0, max_timeout: float = 300.0):
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        self.pending: Dict[str, PendingCall] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+
+    def open(
+        self,
+        caller_id: str,
+        callee_id: str,
+        reply_to: ReplyTo,
+        timeout: Optional[float] = None,
+        track_caller: bool = True,
+    ) -> PendingCall:
+        """Register a call; with ``track_caller`` it is also dropped when the caller's session goes away"""
+        timeout = min(timeout or self.default_timeout, self.max_timeout)
+        loop = asyncio.get_running_loop()
+        call = PendingCall(uuid.uuid4().hex, caller_id, callee_id, reply_to, loop.time() + timeout)
+        call.timer = loop.call_at(call.deadline, self._expire, call.call_id)
+        self.pending[call.call_id] = call
+        self._by_user.setdefault(callee_id, set()).add(call.call_id)
+        if track_caller:
+            self._by_user.setdefault(caller_id, set()).add(call.call_id)
+        metrics.counters["rpc_calls"] += 1
+        return call
+
+    def resolve(self, call_id: str, responder_id: str, body: Any = None, error: Optional[Dict[str, Any]] = None) -> bool:
+        """Deliver the callee's reply; False if the call is unknown, expired or not addressed to ``responder_id``"""
+        call = self.pending.get(call_id)
+        if call is None or call.callee_id != responder_id:
+            metrics.counters["rpc_late_replies"] += 1
+            return False
+        self._finish(call, body, error)
+        metrics.counters["rpc_replies"] += 1
+        return True
+
+    def cancel(self, call_id: str):
+        """Forget a call without replying, e.g. because its caller stopped waiting"""
+        call = self.pending.get(call_id)
+        if call is not None:
+            self._finish(call, None, None, notify=False)
+
+    def drop_user(self, user_id: str):
+        """Fail calls waiting on a user whose session went away, and forget the calls it was waiting on"""
+        for call_id in list(self._by_user.get(user_id, ())):
+            call = self.pending.get(call_id)
+            if call is None:
+                continue
+            if call.callee_id == user_id and call.caller_id != user_id:
+                self._finish(call, None, {"code": 503, "message": "Recipient disconnected"})
+            else:
+                self._finish(call, None, None, notify=False)
+
+    def _expire(self, call_id: str):
+        call = self.pending.get(call_id)
+        if call is not None:
+            metrics.counters["rpc_timeouts"] += 1
+            self._finish(call, None, {"code": 504, "message": "Call deadline exceeded"})
+
+    def _finish(self, call: PendingCall, body: Any, error: Optional[Dict[str, Any]], notify: bool = True):
+        del self.pending[call.call_id]
+        call.timer.cancel()
+        for user_id in (call.caller_id, call.callee_id):
+            calls = self._by_user.get(user_id)
+            if calls is not None:
+                calls.discard(call.call_id)
+                if not calls:
+                    del self._by_user[user_id]
+        if notify:
+            call.reply_to(body, error)
@@ -0,0 +1,186 @@
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from history import Conversation, HistoryEntry
+
+TOKEN_RE = re.compile(r"\w+")
+SNIPPET_RADIUS = 60
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class Postings:
+    """Documents containing one term, in insertion (seq) order"""
+
+    __slots__ = ("seqs", "tfs")
+
+    def __init__(self):
+        self.seqs = array("q")
+        self.tfs = array("H")
+
+
+class SearchHit(NamedTuple):
+    entry: HistoryEntry
+    score: float
+    snippet: str
+
+
+class SearchIndex:
+    """Incrementally maintained inverted index over history entries, ranked with BM25"""
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.postings: Dict[str, Postings] = {}
+        self.entries: Dict[int, HistoryEntry] = {}
+        self.lengths: Dict[int, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, entry: HistoryEntry):
+        tokens = tokenize(entry.message)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = Postings()
+            postings.seqs.append(entry.seq)
+            postings.tfs.append(min(tf, 0xFFFF))
+        self.entries[entry.seq] = entry
+        self.lengths[entry.seq] = len(tokens)
+        self.total_length += len(tokens)
+
+    def remove(self, entries: Iterable[HistoryEntry]):
+        """Drop entries from the index; each affected postings list is rebuilt once"""
+        doomed: Dict[str, Set[int]] = {}
+        for entry in entries:
+            if self.entries.pop(entry.seq, None) is None:
+                continue
+            self.total_length -= self.lengths.pop(entry.seq)
+            for token in set(tokenize(entry.message)):
+                doomed.setdefault(token, set()).add(entry.seq)
+        for token, seqs in doomed.items():
+            postings = self.postings[token]
+            kept = Postings()
+            for seq, tf in zip(postings.seqs, postings.tfs):
+                if seq not in seqs:
+                    kept.seqs.append(seq)
+                    kept.tfs.append(tf)
+            if kept.seqs:
+                self.postings[token] = kept
+            else:
+                del self.postings[token]
+
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        participant: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        scope: Optional[Iterable[Conversation]] = None,
+    ) -> List[SearchHit]:
+        """Return the best ``limit`` entries containing every query term.
+
+        ``participant`` keeps entries sent by that user or from a direct
+        conversation they are part of. ``scope`` limits the search to those
+        conversations before anything is scored, so a caller's query costs
+        at most the size of their own history, not of the whole index.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or limit <= 0:
+            return []
+        term_postings = [self.postings.get(term) for term in terms]
+        if any(p is None for p in term_postings):
+            return []
+        rarest = min(term_postings, key=lambda p: len(p.seqs))
+
+        if scope is not None:
+            # Seqs in the scoped conversations and time range; each conversation's are sorted by seq and time
+            allowed: List[int] = []
+            for conversation in scope:
+                lo = 0 if since is None else bisect_left(conversation.timestamps, since)
+                hi = len(conversation.seqs) if until is None else bisect_right(conversation.timestamps, until)
+                allowed.extend(conversation.seqs[lo:hi])
+            if len(allowed) < len(rarest.seqs):
+                # Probe each term's postings for the caller's few messages
+                candidates = {seq for seq in allowed if all(tf_of(p, seq) for p in term_postings)}
+            else:
+                candidates = self._intersect(term_postings)
+                candidates.intersection_update(allowed)
+        else:
+            candidates = self._intersect(term_postings)
+        if not candidates:
+            return []
+
+        def keep(entry: HistoryEntry) -> bool:
+            if since is not None and entry.timestamp < since:
+                return False
+            if until is not None and entry.timestamp > until:
+                return False
+            if participant is not None and entry.sender != participant:
+                key = entry.conversation
+                if key[0] != "dm" or participant not in key[1:]:
+                    return False
+            return True
+
+        matches = [seq for seq in candidates if keep(self.entries[seq])]
+        if not matches:
+            return []
+
+        n = len(self.entries)
+        avg_length = self.total_length / n if n else 0.0
+        scores = dict.fromkeys(matches, 0.0)
+        for postings in term_postings:
+            df = len(postings.seqs)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            # Look up each match rather than walk the whole postings list
+            for seq in matches:
+                tf = tf_of(postings, seq)
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[seq] / (avg_length or 1))
+                scores[seq] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        # Ties go to the newest message
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return [SearchHit(self.entries[seq], score, snippet(self.entries[seq].message, terms)) for seq, score in best]
+
+    @staticmethod
+    def _intersect(term_postings: List[Postings]) -> Set[int]:
+        # Intersect starting from the rarest term to keep candidate sets small
+        ordered = sorted(term_postings, key=lambda p: len(p.seqs))
+        candidates = set(ordered[0].seqs)
+        for postings in ordered[1:]:
+            candidates.intersection_update(postings.seqs)
+            if not candidates:
+                break
+        return candidates
+
+
+def tf_of(postings: Postings, seq: int) -> int:
+    """Term frequency of ``seq`` in ``postings``, 0 if absent; postings are kept in seq order"""
+    i = bisect_left(postings.seqs, seq)
+    if i < len(postings.seqs) and postings.seqs[i] == seq:
+        return postings.tfs[i]
+    return 0
+
+
+def snippet(text: str, terms: List[str]) -> str:
+    """Excerpt of ``text`` around the first occurrence of any query term"""
+    lowered = text.lower()
+    positions = [m.start() for m in (re.search(rf"\b{re.escape(term)}\b", lowered) for term in terms) if m]
+    if not positions:
+        return text[:2 * SNIPPET_RADIUS]
+    start = max(0, min(positions) - SNIPPET_RADIUS)
+    end = min(len(text), min(positions) + SNIPPET_RADIUS)
+    return ("…" if start > 0 else "") + text[start:end] + ("…" if end < len(text) else "")
@@ -0,0 +1,147 @@
+"""Command-line entry point for the chat server.
+
+    python serve.py --port 8000 --loop uvloop
+    python serve.py --config cohora.toml --tunnel
+
+Settings come from defaults, then the TOML config file, then flags. The
+ngrok tunnel is opt-in and pyngrok is only imported when it is enabled.
+"""
+import argparse
+import os
+import sys
+import time
+
+_started = time.perf_counter()
+
+DEFAULTS = {
+    "host": "0.0.0.0",
+    "port": 8000,
+    "workers": 1,
+    "loop": "auto",
+    "http": "auto",
+    "ws": "auto",
+    "log_level": "info",
+    "tunnel": False,
+    "node_id": None,
+    "cluster_nodes": None,
+    "cluster_secret": None,
+    "trace_sample_rate": None,
+    "trace_file": None,
+    "debug_token": None,
+    "slow_callback_ms": None,
+    "user_ttl": None,
+    "snapshot_file": None,
+    "snapshot_interval": None,
+    "max_connections": None,
+    "accept_rate": None,
+    "accept_burst": None,
+    "auth_timeout": None,
+}
+
+# Settings passed to main.py (and every worker) as COHORA_* environment variables
+ENV_SETTINGS = (
+    "node_id", "cluster_nodes", "cluster_secret", "trace_sample_rate", "trace_file", "debug_token",
+    "slow_callback_ms", "user_ttl", "snapshot_file", "snapshot_interval",
+    "max_connections", "accept_rate", "accept_burst", "auth_timeout",
+)
+
+
+def parse_args(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Run the chat server")
+    parser.add_argument("--config", help="TOML file with any of the settings below")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int, help="worker processes; must be 1, see cluster mode to scale out")
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"])
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], help="HTTP parser implementation")
+    parser.add_argument("--ws", choices=["auto", "websockets", "wsproto"])
+    parser.add_argument("--log-level", dest="log_level", choices=["critical", "error", "warning", "info", "debug"])
+    parser.add_argument("--tunnel", action=argparse.BooleanOptionalAction, help="open an ngrok tunnel to the server")
+    parser.add_argument("--node-id", dest="node_id", help="cluster mode: this node's id")
+    parser.add_argument("--cluster-nodes", dest="cluster_nodes", help='cluster mode: "a=http://host:8001,b=http://host:8002"')
+    parser.add_argument("--cluster-secret", dest="cluster_secret")
+    parser.add_argument("--trace-sample-rate", dest="trace_sample_rate", type=float, help="fraction of requests to trace (default 0)")
+    parser.add_argument("--trace-file", dest="trace_file", help="append finished traces to this JSONL file")
+    parser.add_argument("--debug-token", dest="debug_token", help="token required by /debug endpoints")
+    parser.add_argument("--slow-callback-ms", dest="slow_callback_ms", type=float, help="report loop stalls longer than this (default 100)")
+    parser.add_argument("--user-ttl", dest="user_ttl", type=float, help="delete users inactive for this many seconds (default 0 = never)")
+    parser.add_argument("--snapshot-file", dest="snapshot_file", help="save the registry and queued messages here and restore them at startup")
+    parser.add_argument("--snapshot-interval", dest="snapshot_interval", type=float, help="seconds between snapshots (default 30)")
+    parser.add_argument("--max-connections", dest="max_connections", type=int, help="open WebSocket cap (default 0 = unlimited)")
+    parser.add_argument("--accept-rate", dest="accept_rate", type=float, help="new WebSockets per second (default 0 = unlimited)")
+    parser.add_argument("--accept-burst", dest="accept_burst", type=int, help="new WebSockets allowed at once (default: one second's worth)")
+    parser.add_argument("--auth-timeout", dest="auth_timeout", type=float, help="seconds a WebSocket may take to authenticate (default 10)")
+    args = vars(parser.parse_args(argv))
+
+    settings = dict(DEFAULTS)
+    config_path = args.pop("config")
+    if config_path:
+        import tomllib
+        with open(config_path, "rb") as f:
+            config = tomllib.load(f)
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            parser.error(f"unknown settings in {config_path}: {', '.join(sorted(unknown))}")
+        settings.update(config)
+    settings.update({key: value for key, value in args.items() if value is not None})
+    if settings["workers"] != 1:
+        # All state is in-process: each worker would be a separate server behind one port,
+        # so users created on one would be unknown to the rest and sends would randomly 404
+        parser.error("--workers must be 1; to scale out, run one process per node in cluster mode (--node-id, --cluster-nodes)")
+    if settings["tunnel"] and not (settings["debug_token"] or os.environ.get("COHORA_DEBUG_TOKEN")):
+        # Tunnelled requests arrive from 127.0.0.1; a public server must not rely on loopback meaning local
+        parser.error("--tunnel needs --debug-token (or COHORA_DEBUG_TOKEN)")
+    return settings
+
+
+def open_tunnel(port: int) -> str:
+    from pyngrok import ngrok
+    public_url = ngrok.connect(port, "http").public_url
+    print(f"[Server] Public URL: {public_url}")
+    print(f"[Server] WebSocket URL: {public_url.replace('http', 'ws', 1)}/ws")
+    return public_url
+
+
+def main(argv=None):
+    settings = parse_args(argv)
+    # These reach main.py through the environment, including worker processes
+    for key in ENV_SETTINGS:
+        if settings[key] is not None:
+            os.environ[f"COHORA_{key.upper()}"] = str(settings[key])
+
+    timings = {}
+    mark = time.perf_counter()
+    import uvicorn
+    timings["import uvicorn"] = time.perf_counter() - mark
+
+    uvicorn_options = dict(
+        host=settings["host"],
+        port=settings["port"],
+        loop=settings["loop"],
+        http=settings["http"],
+        ws=settings["ws"],
+        log_level=settings["log_level"],
+    )
+
+    if settings["tunnel"]:
+        mark = time.perf_counter()
+        open_tunnel(settings["port"])
+        timings["open tunnel"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    from main import app
+    timings["import app"] = time.perf_counter() - mark
+
+    def report_startup():
+        timings["server startup"] = time.perf_counter() - ready_mark
+        breakdown = ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in timings.items())
+        print(f"[Server] Ready in {(time.perf_counter() - _started) * 1000:.0f}ms ({breakdown})")
+
+    # Runs after the app's own startup handlers
+    app.router.on_startup.append(report_startup)
+    ready_mark = time.perf_counter()
+    uvicorn.run(app, **uvicorn_options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import WebSocket
+
+import metrics
+from timingwheel import TimingWheel
+from tracing import Trace
+
+
+@dataclass
+class SendLimits:
+    """Per-connection outbound buffer limits.
+
+    A session whose queue rises above a high watermark (bytes or frames) is
+    "over limit" until it drains below the low watermark. Staying over limit
+    for ``grace_seconds``, or ever exceeding ``hard_limit_bytes``, evicts it.
+    """
+    high_watermark_bytes: int = 4 * 1024 * 1024
+    low_watermark_bytes: int = 1024 * 1024
+    high_watermark_frames: int = 1000
+    low_watermark_frames: int = 250
+    hard_limit_bytes: int = 16 * 1024 * 1024
+    grace_seconds: float = 5.0
+
+
+_fragment_ids = itertools.count(1)  # Tags the pieces of one fragmented frame
+
+
+class QueuedFrame:
+    """A frame waiting in a session's queue; ``payload`` becomes None once written, taken or expired"""
+    __slots__ = ("payload", "trace", "queued_at", "on_written", "on_expired", "expires_at")
+
+    def __init__(self, payload, trace, queued_at, on_written, on_expired, expires_at=0.0):
+        self.payload: Optional[str] = payload
+        self.trace: Optional[Trace] = trace
+        self.queued_at: float = queued_at
+        self.on_written: Optional[Callable[[], None]] = on_written
+        self.on_expired: Optional[Callable[[], None]] = on_expired
+        self.expires_at: float = expires_at  # Unix time, so it still means something after a restart; 0 = never
+
+
+class Session:
+    """One authenticated WebSocket with an accounted outbound queue.
+
+    ``send`` never blocks the caller: frames are queued and written by a
+    per-session writer task, so a recipient that stops reading only grows
+    its own queue, which the watermarks keep bounded.
+
+    Sessions are slotted and queue into a bare deque with a single wakeup
+    future rather than an ``asyncio.Queue``, which carries its own getter
+    and putter deques and an Event per instance.
+
+    Control frames (acks, heartbeat replies, flow control) go in a separate
+    lane that the writer always empties first. With ``fragment_size`` set,
+    payloads longer than that are written as a run of "fragment" frames,
+    and control frames are let through between the pieces.
+    """
+    __slots__ = (
+        "user_id", "websocket", "limits", "evict_code", "expiry", "fragment_size", "queued_bytes",
+        "queued_frames", "over_limit_since", "closed", "_control", "_frames", "_waiter", "_writer",
+    )
+
+    def __init__(
+        self,
+        user_id: str,
+        websocket: Optional[WebSocket],
+        limits: SendLimits,
+        evict_code: int,
+        expiry: Optional[TimingWheel] = None,
+        fragment_size: int = 0,
+    ):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.limits = limits
+        self.evict_code = evict_code
+        self.expiry = expiry  # Schedules expiry of frames sent with a ttl
+        self.fragment_size = fragment_size  # 0 unless the client reassembles fragments
+        self.queued_bytes = 0  # Characters of queued text frames, a lower bound on bytes
+        self.queued_frames = 0
+        self.over_limit_since: Optional[float] = None
+        self.closed = False
+        # Control frames are few and small, so a list is cheaper here than a second deque
+        self._control: List[QueuedFrame] = []
+        self._frames: deque = deque()
+        self._waiter: Optional[asyncio.Future] = None  # Resolved by the next send or by shutdown
+        # Without a socket, frames wait in the queue until a MailboxSession consumer takes them
+        self._writer = asyncio.create_task(self._write_loop()) if websocket is not None else None
+
+    def send_json(
+        self,
+        data: Dict[str, Any],
+        trace: Optional[Trace] = None,
+        on_written: Optional[Callable[[], None]] = None,
+        ttl: Optional[float] = None,
+        on_expired: Optional[Callable[[], None]] = None,
+        control: bool = False,
+    ) -> bool:
+        return self.send(json.dumps(data), trace, on_written, ttl, on_expired, control)
+
+    def send(
+        self,
+        payload: str,
+        trace: Optional[Trace] = None,
+        on_written: Optional[Callable[[], None]] = None,
+        ttl: Optional[float] = None,
+        on_expired: Optional[Callable[[], None]] = None,
+        control: bool = False,
+    ) -> bool:
+        """Queue a text frame; returns False if the session is closed or was evicted.
+
+        A sampled ``trace`` is held until the frame has been written to the
+        socket, and ``on_written`` is called once it has; it is not called
+        for frames dropped because the session closed. A frame still queued
+        ``ttl`` seconds later is discarded and ``on_expired`` is called.
+        A ``control`` frame is written ahead of every queued non-control frame.
+        """
+        if self.closed:
+            return False
+        expires_at = time.time() + ttl if ttl is not None else 0.0
+        if trace is not None and trace.sampled:
+            frame = QueuedFrame(payload, trace.hold(), time.perf_counter(), on_written, on_expired, expires_at)
+        else:
+            frame = QueuedFrame(payload, None, 0.0, on_written, on_expired, expires_at)
+        (self._control if control else self._frames).append(frame)
+        self._wake()
+        if ttl is not None and self.expiry is not None:
+            self.expiry.schedule(ttl, self._expire, frame)
+        self.queued_bytes += len(payload)
+        self.queued_frames += 1
+        if self.over_limit_since is None and (
+            self.queued_bytes > self.limits.high_watermark_bytes
+            or self.queued_frames > self.limits.high_watermark_frames
+        ):
+            self.over_limit_since = time.monotonic()
+        if self.queued_bytes > self.limits.hard_limit_bytes:
+            self.evict("send buffer limit exceeded")
+            return False
+        self.check_slow()
+        return not self.closed
+
+    def check_slow(self, now: Optional[float] = None):
+        """Evict the session if it has stayed over its high watermark past the grace period"""
+        if self.closed or self.over_limit_since is None:
+            return
+        now = time.monotonic() if now is None else now
+        if now - self.over_limit_since >= self.limits.grace_seconds:
+            self.evict("slow consumer: send buffer over limit")
+
+    def evict(self, reason: str):
+        if self.closed:
+            return
+        metrics.counters["slow_consumer_evictions"] += 1
+        print(f"[Server] Evicting user '{self.user_id}': {reason} "
+              f"({self.queued_bytes} bytes, {self.queued_frames} frames queued)")
+        self._shutdown()
+        asyncio.create_task(self._close_socket(self.evict_code, reason))
+
+    def replace(self, code: int, reason: str) -> List[Tuple[str, float]]:
+        """Give way to a newer session of the same user: stop writing, close with ``code``, and
+        return the messages not yet written, as ``pending()`` does, for the successor to send"""
+        if self.closed:
+            return []
+        frames = self.pending()
+        self._shutdown()
+        asyncio.create_task(self._close_socket(code, reason))
+        return frames
+
+    async def close(self, code: int, reason: str = ""):
+        if self.closed:
+            return
+        self._shutdown()
+        await self._close_socket(code, reason)
+
+    def _shutdown(self):
+        # Release the queued frames right away so evicted memory is reclaimed
+        self.closed = True
+        if self._writer:
+            self._writer.cancel()
+        self._drop_queue()
+        self._wake()
+
+    def pending(self) -> List[Tuple[str, float]]:
+        """Queued messages not yet written, as (payload, expires_at); control frames are left out"""
+        return [(frame.payload, frame.expires_at) for frame in self._frames if frame.payload is not None]
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the next send (or shutdown); False on timeout. Several waiters share one future."""
+        if self._waiter is None or self._waiter.done():
+            self._waiter = asyncio.get_running_loop().create_future()
+        # asyncio.wait leaves the shared future alone when one waiter times out or is cancelled
+        done, _ = await asyncio.wait((self._waiter,), timeout=timeout)
+        return bool(done)
+
+    async def _close_socket(self, code: int, reason: str, timeout: float = 1.0):
+        if self.websocket is None:
+            return
+        try:
+            # A stalled peer must not hold the close open indefinitely
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), timeout=timeout)
+        except Exception:
+            pass
+
+    def _claim(self, frame: QueuedFrame) -> Optional[str]:
+        """Take a frame's payload out of the queue accounting; None if it already expired"""
+        payload = frame.payload
+        if payload is None:
+            return None
+        frame.payload = None
+        self.queued_bytes -= len(payload)
+        self.queued_frames -= 1
+        if self.over_limit_since is not None and (
+            self.queued_bytes <= self.limits.low_watermark_bytes
+            and self.queued_frames <= self.limits.low_watermark_frames
+        ):
+            self.over_limit_since = None
+        return payload
+
+    def _expire(self, frame: QueuedFrame):
+        # The frame stays in the queue as an empty shell; only its payload is released now
+        if self.closed or self._claim(frame) is None:
+            return
+        if frame.trace:
+            frame.trace.set("expired", True)
+            frame.trace.release()
+        metrics.counters["messages_expired"] += 1
+        if frame.on_expired:
+            frame.on_expired()
+
+    def _drop_queue(self):
+        for frame in itertools.chain(self._control, self._frames):
+            if frame.payload is not None and frame.trace:
+                frame.trace.set("dropped", True)
+                frame.trace.release()
+        self._control.clear()
+        self._frames.clear()
+        self.queued_bytes = 0
+        self.queued_frames = 0
+
+    async def _write_loop(self):
+        try:
+            while True:
+                if self._control:
+                    await self._write(self._control.pop(0), fragment=False)
+                elif self._frames:
+                    await self._write(self._frames.popleft(), fragment=True)
+                else:
+                    await self._wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone; the receive loop will clean up
+            self.closed = True
+            self._drop_queue()
+
+    async def _write(self, frame: QueuedFrame, fragment: bool):
+        payload = self._claim(frame)
+        if payload is None:
+            return
+        trace = frame.trace
+        if trace:
+            write_start = time.perf_counter()
+            trace.add_span("queue_wait", frame.queued_at, write_start)
+        if fragment and self.fragment_size and len(payload) > self.fragment_size:
+            await self._write_fragments(payload)
+        else:
+            await self.websocket.send_text(payload)
+        if trace:
+            trace.add_span("socket_write", write_start, time.perf_counter())
+            trace.release()
+        if frame.on_written:
+            frame.on_written()
+
+    async def _write_fragments(self, payload: str):
+        """Write one frame as pieces the client joins back together, so it cannot hold the socket"""
+        fragment_id = next(_fragment_ids)
+        size = self.fragment_size
+        for start in range(0, len(payload), size):
+            while self._control:
+                await self._write(self._control.pop(0), fragment=False)
+            await self.websocket.send_text(json.dumps({
+                "type": "fragment",
+                "fragment_id": fragment_id,
+                "final": start + size >= len(payload),
+                "data": payload[start:start + size],
+            }))
+        metrics.counters["frames_fragmented"] += 1
+
+
+class MailboxSession(Session):
+    """A session that Server-Sent Events and long-poll requests pull frames from.
+
+    Frames are queued and accounted like any other session's, so delivery
+    code cannot tell the difference. A waiting request is just a pending
+    ``take``: one future on the queue, woken by the next send.
+    """
+    __slots__ = ("waiters", "last_taken")
+
+    def __init__(self, user_id: str, limits: SendLimits, evict_code: int, expiry: Optional[TimingWheel] = None):
+        super().__init__(user_id, None, limits, evict_code, expiry)
+        self.waiters = 0
+        self.last_taken = time.monotonic()
+
+    def idle_for(self, now: Optional[float] = None) -> float:
+        """Seconds since a request last waited on this mailbox; 0 while one is waiting"""
+        if self.waiters:
+            return 0.0
+        return (time.monotonic() if now is None else now) - self.last_taken
+
+    async def take(self, max_frames: int = 100, timeout: float = 25.0) -> List[str]:
+        """Wait up to ``timeout`` for a frame, then return it with whatever else is queued"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        payloads: List[str] = []
+        self.waiters += 1
+        try:
+            # Expired frames leave empty shells behind, so keep waiting past them
+            while not payloads and not self.closed:
+                if not self._control and not self._frames:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0 or not await self._wait(remaining):
+                        return []
+                    continue
+                frames = self._control[:max_frames]
+                del self._control[:len(frames)]
+                frames += [self._frames.popleft() for _ in range(min(max_frames - len(frames), len(self._frames)))]
+                taken = time.perf_counter()
+                for frame in frames:
+                    payload = self._claim(frame)
+                    if payload is None:
+                        continue
+                    if frame.trace:
+                        frame.trace.add_span("queue_wait", frame.queued_at, taken)
+                        frame.trace.release()
+                    if frame.on_written:
+                        frame.on_written()
+                    payloads.append(payload)
+            return payloads
+        finally:
+            self.waiters -= 1
+            self.last_taken = time.monotonic()
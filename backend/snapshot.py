@@ -0,0 +1,141 @@
+"""Binary snapshots of the user registry and undelivered frames, for fast restarts.
+
+Layout (little-endian): a fixed header, then the payload it checksums.
+
+    header   magic "COHS", u16 version, u16 reserved, f64 created_at (Unix time),
+             u32 user count N, u32 frame count M, u64 payload length, u32 CRC-32 of the payload
+    payload  N raw 16-byte user IDs
+             N u32 name lengths, in code points
+             u64 byte length of the names blob, then the names blob (UTF-8, names back to back)
+             M frames: raw 16-byte user ID, f64 expires_at (Unix time, 0 = never),
+             u32 byte length, UTF-8 payload
+
+IDs and names sit in flat arrays so loading is a few bulk slices of the
+mapped file, not one parse per user.
+"""
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from dataclasses import dataclass, field
+from itertools import accumulate
+from typing import List, Tuple
+
+MAGIC = b"COHS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHdIIQI")
+FRAME = struct.Struct("<16sdI")
+ID_SIZE = 16
+
+PendingFrame = Tuple[bytes, float, str]  # (raw user id, expires_at, payload)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+@dataclass
+class Snapshot:
+    names: List[str] = field(default_factory=list)
+    ids: List[bytes] = field(default_factory=list)  # Raw 16-byte IDs, parallel to names
+    frames: List[PendingFrame] = field(default_factory=list)
+    created_at: float = 0.0
+
+
+def encode(names: List[str], ids: List[bytes], frames: List[PendingFrame], created_at: float = None) -> bytes:
+    lengths = array("I", (len(name) for name in names))
+    if sys.byteorder != "little":
+        lengths.byteswap()
+    blob = "".join(names).encode("utf-8", "surrogatepass")
+    parts = [b"".join(ids), lengths.tobytes(), struct.pack("<Q", len(blob)), blob]
+    for raw, expires_at, payload in frames:
+        data = payload.encode("utf-8", "surrogatepass")
+        parts.append(FRAME.pack(raw, expires_at, len(data)))
+        parts.append(data)
+    payload = b"".join(parts)
+    header = HEADER.pack(
+        MAGIC, VERSION, 0, time.time() if created_at is None else created_at,
+        len(names), len(frames), len(payload), zlib.crc32(payload)
+    )
+    return header + payload
+
+
+def write(path: str, names: List[str], ids: List[bytes], frames: List[PendingFrame]):
+    """Write a snapshot atomically: readers see the old file or the new one, never a partial write.
+
+    The file holds user IDs, which are bearer credentials, so it is created
+    readable by the owner only (0600) whatever the umask. Each call gets its
+    own temporary file, so overlapping writes cannot interleave in one.
+    """
+    data = encode(names, ids, frames)
+    directory, base = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{base}.", suffix=".tmp", dir=directory)  # Created 0600
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def decode(buffer) -> Snapshot:
+    # Views are released on the way out, error or not, so a mapped buffer can be closed
+    with memoryview(buffer) as view:
+        if len(view) < HEADER.size:
+            raise SnapshotError("Snapshot is truncated")
+        magic, version, _, created_at, user_count, frame_count, payload_length, checksum = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise SnapshotError("Not a snapshot file")
+        if version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version} (expected {VERSION})")
+        with view[HEADER.size:HEADER.size + payload_length] as payload:
+            if len(payload) != payload_length or zlib.crc32(payload) != checksum:
+                raise SnapshotError("Snapshot checksum mismatch")
+            return _decode_payload(payload, user_count, frame_count, created_at)
+
+
+def _decode_payload(payload: memoryview, user_count: int, frame_count: int, created_at: float) -> Snapshot:
+    ids_end = user_count * ID_SIZE
+    id_blob = payload[:ids_end].tobytes()
+    ids = [id_blob[i:i + ID_SIZE] for i in range(0, ids_end, ID_SIZE)]
+    lengths = array("I")
+    lengths.frombytes(payload[ids_end:ids_end + 4 * user_count])
+    if sys.byteorder != "little":
+        lengths.byteswap()
+    position = ids_end + 4 * user_count
+    (blob_length,) = struct.unpack_from("<Q", payload, position)
+    position += 8
+    blob = str(payload[position:position + blob_length], "utf-8", "surrogatepass")
+    position += blob_length
+    offsets = [0, *accumulate(lengths)]
+    names = [blob[offsets[i]:offsets[i + 1]] for i in range(user_count)]
+
+    frames: List[PendingFrame] = []
+    for _ in range(frame_count):
+        raw, expires_at, length = FRAME.unpack_from(payload, position)
+        position += FRAME.size
+        frames.append((raw, expires_at, str(payload[position:position + length], "utf-8", "surrogatepass")))
+        position += length
+    return Snapshot(names, ids, frames, created_at)
+
+
+def load(path: str) -> Snapshot:
+    """Map a snapshot file and decode it; raises SnapshotError if it is damaged or from another version"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise SnapshotError("Snapshot is empty")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            try:
+                return decode(mapped)
+            except struct.error as e:
+                raise SnapshotError(f"Snapshot is malformed: {e}")
@@ -0,0 +1,112 @@
+import time
+import uuid
+from typing import Any, Dict, Optional, Set
+
+import metrics
+from sessions import Session
+
+
+class Stream:
+    """One open streamed message, relayed chunk by chunk from sender to recipient.
+
+    Flow control is credit based: the sender may have at most ``window``
+    chunks queued on the recipient's connection. Credit comes back in
+    ``stream_credit`` frames as the recipient's writer puts chunks on the wire.
+    """
+    __slots__ = (
+        "message_id", "sender", "recipient", "sender_name", "window",
+        "next_seq", "in_flight", "unreported", "opened_at",
+    )
+
+    def __init__(self, sender: Session, recipient: Session, sender_name: str, window: int):
+        self.message_id = str(uuid.uuid4())
+        self.sender = sender
+        self.recipient = recipient
+        self.sender_name = sender_name
+        self.window = window
+        self.next_seq = 0
+        self.in_flight = 0
+        self.unreported = 0
+        self.opened_at = time.time()
+
+    def chunk_written(self):
+        self.in_flight -= 1
+        self.unreported += 1
+        # Return credit in batches so a long stream does not double the frame count
+        if self.unreported >= max(1, self.window // 2) or self.in_flight == 0:
+            self.sender.send_json(
+                {"type": "stream_credit", "message_id": self.message_id, "credit": self.unreported}, control=True
+            )
+            self.unreported = 0
+
+
+class StreamRelay:
+    """Open streams by message_id, and per-user indexes for cleanup and the per-user cap.
+
+    ``_by_user`` holds every stream a user sends or receives, for cleanup;
+    ``_outgoing`` holds only those they opened, so streams sent to a user
+    never use up that user's own quota.
+    """
+
+    def __init__(self, window: int = 64, max_streams_per_user: int = 16):
+        self.window = window
+        self.max_streams_per_user = max_streams_per_user
+        self.streams: Dict[str, Stream] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._outgoing: Dict[str, Set[str]] = {}
+
+    def open(self, sender: Session, recipient: Session, sender_name: str) -> Optional[Stream]:
+        """Start a stream; None if the sender already has ``max_streams_per_user`` open"""
+        if len(self._outgoing.get(sender.user_id, ())) >= self.max_streams_per_user:
+            return None
+        stream = Stream(sender, recipient, sender_name, self.window)
+        self.streams[stream.message_id] = stream
+        for user_id in (sender.user_id, recipient.user_id):
+            self._by_user.setdefault(user_id, set()).add(stream.message_id)
+        self._outgoing.setdefault(sender.user_id, set()).add(stream.message_id)
+        metrics.counters["streams_opened"] += 1
+        return stream
+
+    def relay(self, stream: Stream, data: str) -> Optional[str]:
+        """Queue one chunk for the recipient; returns an error message if the stream must be aborted"""
+        if stream.in_flight >= stream.window:
+            return "Flow control window exceeded"
+        frame = {"type": "stream_chunk", "message_id": stream.message_id, "seq": stream.next_seq, "data": data}
+        stream.in_flight += 1
+        if not stream.recipient.send_json(frame, on_written=stream.chunk_written):
+            stream.in_flight -= 1
+            return "Recipient disconnected"
+        stream.next_seq += 1
+        metrics.counters["stream_chunks"] += 1
+        return None
+
+    def close(self, stream: Stream, error: Optional[Dict[str, Any]] = None):
+        """End a stream, telling the recipient how it ended"""
+        if self.streams.pop(stream.message_id, None) is None:
+            return
+        for index, user_id in (
+            (self._by_user, stream.sender.user_id),
+            (self._by_user, stream.recipient.user_id),
+            (self._outgoing, stream.sender.user_id),
+        ):
+            ids = index.get(user_id)
+            if ids is not None:
+                ids.discard(stream.message_id)
+                if not ids:
+                    del index[user_id]
+        frame = {"type": "stream_close", "message_id": stream.message_id, "chunks": stream.next_seq}
+        if error:
+            frame["error"] = error
+            metrics.counters["streams_aborted"] += 1
+        stream.recipient.send_json(frame)
+
+    def drop_session(self, session: Session):
+        """Abort every stream the session was sending or receiving"""
+        for message_id in list(self._by_user.get(session.user_id, ())):
+            stream = self.streams.get(message_id)
+            if stream is None or session not in (stream.sender, stream.recipient):
+                continue
+            error = {"code": 503, "message": "Stream peer disconnected"}
+            if stream.recipient is session:
+                stream.sender.send_json({"type": "stream_error", "message_id": message_id, "error": error}, control=True)
+            self.close(stream, error)
@@ -0,0 +1,29 @@
+import socket
+import sys
+from pathlib import Path
+
+import pytest_asyncio
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from harness import InProcessServer
+from soak import ServerProcess
+
+
+@pytest_asyncio.fixture
+async def server():
+    """A private in-process server with empty state; no running server or ports needed"""
+    async with InProcessServer() as server:
+        yield server
+
+
+@pytest_asyncio.fixture
+async def server_process():
+    """A private server in its own process on a free port, for clients that need real sockets (ChatClient, SSE)"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = ServerProcess(port)
+    await process.start()
+    yield process
+    # Its state is thrown away, so don't wait for open long-polls to finish a graceful shutdown
+    process.stop(crash=True)
@@ -1,589 +1,493 @@
 import asyncio
 import json
+import sys
 import uuid
+from pathlib import Path
 from typing import Dict, Any
 
-import httpx
-import websockets
 import pytest
 
-# IMPORTANT: Ensure the FastAPI server from `backend/main.py` is running before executing these tests.
-# You can typically run the server using: python backend/main.py
-# And then run the tests in a separate terminal using: pytest backend/tests/robust_integration_test.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from harness import InMemoryWebSocket, InProcessServer, WebSocketClosed
+
+# These tests use the in-process `server` fixture from conftest.py and need no running server.
+# Run them with: pytest backend/tests/robust_integration_test.py
 
 # Configuration
-BASE_URL = "http://localhost:8000"
-WS_URL = "ws://localhost:8000/ws"
 WEBSOCKET_TIMEOUT = 5.0 # seconds for operations like ack
 
 # Helper Functions
-async def create_user(client: httpx.AsyncClient, name: str) -> Dict[str, Any]:
-    response = await client.post(f"{BASE_URL}/api/users/create", json={"name": name})
+async def create_user(server: InProcessServer, name: str) -> Dict[str, Any]:
+    response = await server.http.post("/api/users/create", json={"name": name})
     response.raise_for_status() # Raise an exception for bad status codes
     return response.json()
 
-async def connect_ws(user_id: str, send_auth_json: bool = True, use_header: bool = False) -> websockets.WebSocketClientProtocol:
-    headers = {}
-    if use_header and user_id:
-        headers["x-user-id"] = user_id
-    
+async def connect_ws(server: InProcessServer, user_id: str, send_auth_json: bool = True, use_header: bool = False) -> InMemoryWebSocket:
     try:
-        ws = await websockets.connect(WS_URL, extra_headers=headers if use_header else None, open_timeout=WEBSOCKET_TIMEOUT)
+        ws = await server.websocket(user_id if use_header else None, ack=False)
     except Exception as e:
-        raise AssertionError(f"Failed to connect to WebSocket at {WS_URL}: {e}")
-    
+        raise AssertionError(f"Failed to connect to WebSocket: {e}")
+
     if send_auth_json and user_id and not use_header: # Only send JSON auth if not using header auth
         await ws.send(json.dumps({"id": user_id}))
         try:
-            raw_ack = await asyncio.wait_for(ws.recv(), timeout=WEBSOCKET_TIMEOUT)
+            raw_ack = await ws.recv(timeout=WEBSOCKET_TIMEOUT)
         except asyncio.TimeoutError:
-            await ws.close(code=1001, reason="Client timeout waiting for ack")
+            await ws.close(code=1001)
             raise AssertionError(f"Timeout waiting for WebSocket ack (JSON auth) for user {user_id}")
-        except websockets.exceptions.ConnectionClosed as e:
+        except WebSocketClosed as e:
             raise AssertionError(f"WebSocket connection closed while waiting for ack (JSON auth) for user {user_id}: {e}")
-        
+
         print(f"Auth ack for {user_id} (JSON auth): {raw_ack}")
         try:
             ack_data = json.loads(raw_ack)
         except json.JSONDecodeError:
-            await ws.close(code=1003, reason="Client received malformed ack")
+            await ws.close(code=1003)
             raise AssertionError(f"Failed to decode JSON from WebSocket ack (JSON auth) for user {user_id}: {raw_ack}")
 
         if not (ack_data.get("type") == "connection_status" and ack_data.get("status") == 101):
-            await ws.close(code=1002, reason="Client received unexpected ack")
+            await ws.close(code=1002)
             raise AssertionError(f"WebSocket ack (JSON auth) for user {user_id} was not as expected: {ack_data}")
 
     elif use_header and user_id:
         try:
-            raw_ack = await asyncio.wait_for(ws.recv(), timeout=WEBSOCKET_TIMEOUT)
+            raw_ack = await ws.recv(timeout=WEBSOCKET_TIMEOUT)
         except asyncio.TimeoutError:
-            await ws.close(code=1001, reason="Client timeout waiting for ack")
+            await ws.close(code=1001)
             raise AssertionError(f"Timeout waiting for WebSocket ack (header auth) for user {user_id}")
-        except websockets.exceptions.ConnectionClosed as e:
+        except WebSocketClosed as e:
             raise AssertionError(f"WebSocket connection closed while waiting for ack (header auth) for user {user_id}: {e}")
 
         print(f"Auth ack for {user_id} (header auth): {raw_ack}")
         try:
             ack_data = json.loads(raw_ack)
         except json.JSONDecodeError:
-            await ws.close(code=1003, reason="Client received malformed ack")
+            await ws.close(code=1003)
             raise AssertionError(f"Failed to decode JSON from WebSocket ack (header auth) for user {user_id}: {raw_ack}")
 
         if not (ack_data.get("type") == "connection_status" and ack_data.get("status") == 101):
-            await ws.close(code=1002, reason="Client received unexpected ack")
+            await ws.close(code=1002)
             raise AssertionError(f"WebSocket ack (header auth) for user {user_id} was not as expected: {ack_data}")
     # If user_id is None (e.g. for testing no_auth scenarios), we don't expect an ack here.
     elif not user_id and not send_auth_json and not use_header:
         pass # No automatic ack expected for unauthenticated connections immediately after connect
-    
+
     return ws
 
 # Test Suite
 @pytest.mark.asyncio
-async def test_create_and_list_users():
-    async with httpx.AsyncClient() as client:
-        # Create user1
-        user1_name = f"testuser_{uuid.uuid4()}"
-        user1_data = await create_user(client, user1_name)
-        user1_id = user1_data["id"]
-        assert user1_data["status"] == 201
-        print(f"Created user {user1_name} with ID {user1_id}")
-
-        # Create user2
-        user2_name = f"testuser_{uuid.uuid4()}"
-        user2_data = await create_user(client, user2_name)
-        user2_id = user2_data["id"]
-        assert user2_data["status"] == 201
-        print(f"Created user {user2_name} with ID {user2_id}")
-
-        # List users and verify
-        response = await client.get(f"{BASE_URL}/api/users/list")
-        response.raise_for_status()
-        listed_users = response.json()["users"]
-        assert user1_name in listed_users
-        assert listed_users[user1_name] == user1_id
-        assert user2_name in listed_users
-        assert listed_users[user2_name] == user2_id
-        print("Listed users successfully.")
+async def test_create_and_list_users(server):
+    # Create user1
+    user1_name = f"testuser_{uuid.uuid4()}"
+    user1_data = await create_user(server, user1_name)
+    user1_id = user1_data["id"]
+    assert user1_data["status"] == 201
+    print(f"Created user {user1_name} with ID {user1_id}")
+
+    # Create user2
+    user2_name = f"testuser_{uuid.uuid4()}"
+    user2_data = await create_user(server, user2_name)
+    user2_id = user2_data["id"]
+    assert user2_data["status"] == 201
+    print(f"Created user {user2_name} with ID {user2_id}")
+
+    # List users and verify
+    response = await server.http.get("/api/users/list")
+    response.raise_for_status()
+    listed_users = response.json()["users"]
+    assert user1_name in listed_users
+    assert listed_users[user1_name] == user1_id
+    assert user2_name in listed_users
+    assert listed_users[user2_name] == user2_id
+    print("Listed users successfully.")
 
 @pytest.mark.asyncio
-async def test_create_user_already_exists():
-    async with httpx.AsyncClient() as client:
-        user_name = f"existinguser_{uuid.uuid4()}"
-        await create_user(client, user_name) # Create user first
-        
-        # Attempt to create the same user again
-        response = await client.post(f"{BASE_URL}/api/users/create", json={"name": user_name})
-        assert response.status_code == 409 # Conflict
-        assert "Username already exists" in response.json()["detail"]
-        print("Verified creating existing user fails as expected.")
+async def test_create_user_already_exists(server):
+    user_name = f"existinguser_{uuid.uuid4()}"
+    await create_user(server, user_name) # Create user first
 
-@pytest.mark.asyncio
-async def test_websocket_connect_auth_json():
-    async with httpx.AsyncClient() as client:
-        user_name = f"ws_user_json_{uuid.uuid4()}"
-        user_data = await create_user(client, user_name)
-        user_id = user_data["id"]
-
-        ws = None
-        try:
-            ws = await connect_ws(user_id, send_auth_json=True, use_header=False)
-            print(f"User {user_name} ({user_id}) connected via WebSocket with JSON auth and received ack.")
-            # Simple heartbeat check (optional, but good for testing connection liveness)
-            await ws.send(" ") # Send whitespace as heartbeat
-            heartbeat_ack = await asyncio.wait_for(ws.recv(), timeout=2)
-            assert "heartbeat" in json.loads(heartbeat_ack).get("type")
-            print(f"User {user_name} received heartbeat ack.")
-        finally:
-            if ws:
-                await ws.close()
+    # Attempt to create the same user again
+    response = await server.http.post("/api/users/create", json={"name": user_name})
+    assert response.status_code == 409 # Conflict
+    assert "Username already exists" in response.json()["detail"]
+    print("Verified creating existing user fails as expected.")
 
 @pytest.mark.asyncio
-async def test_websocket_connect_auth_header():
-    async with httpx.AsyncClient() as client:
-        user_name = f"ws_user_header_{uuid.uuid4()}"
-        user_data = await create_user(client, user_name)
-        user_id = user_data["id"]
+async def test_websocket_connect_auth_json(server):
+    user_name = f"ws_user_json_{uuid.uuid4()}"
+    user_data = await create_user(server, user_name)
+    user_id = user_data["id"]
 
-        ws = None
-        try:
-            # Server should send ack immediately upon connection with header
-            ws = await connect_ws(user_id, send_auth_json=False, use_header=True)
-            print(f"User {user_name} ({user_id}) connected via WebSocket with header auth and received ack.")
-            # Simple heartbeat check
-            await ws.send(" ") # Send whitespace as heartbeat
-            heartbeat_ack = await asyncio.wait_for(ws.recv(), timeout=2)
-            assert "heartbeat" in json.loads(heartbeat_ack).get("type")
-            print(f"User {user_name} received heartbeat ack.")
-        finally:
-            if ws:
-                await ws.close()
+    ws = None
+    try:
+        ws = await connect_ws(server, user_id, send_auth_json=True, use_header=False)
+        print(f"User {user_name} ({user_id}) connected via WebSocket with JSON auth and received ack.")
+        # Simple heartbeat check (optional, but good for testing connection liveness)
+        await ws.send(" ") # Send whitespace as heartbeat
+        heartbeat_ack = await ws.recv(timeout=2)
+        assert "heartbeat" in json.loads(heartbeat_ack).get("type")
+        print(f"User {user_name} received heartbeat ack.")
+    finally:
+        if ws:
+            await ws.close()
 
 @pytest.mark.asyncio
-async def test_websocket_connect_invalid_user_id():
-    invalid_user_id = str(uuid.uuid4()) # A non-existent user ID
+async def test_websocket_connect_auth_header(server):
+    user_name = f"ws_user_header_{uuid.uuid4()}"
+    user_data = await create_user(server, user_name)
+    user_id = user_data["id"]
+
     ws = None
     try:
-        # Attempt to connect with an invalid ID via JSON auth
-        with pytest.raises(websockets.exceptions.ConnectionClosedError) as excinfo_json:
-            ws_json = await websockets.connect(WS_URL)
-            await ws_json.send(json.dumps({"id": invalid_user_id}))
-            await ws_json.recv() # Server should close connection
-        assert excinfo_json.value.code == 1008 # Policy Violation (as per main.py logic for invalid user)
-        print(f"Connection with invalid user ID (JSON auth) correctly closed with code {excinfo_json.value.code}.")
-        if ws_json and not ws_json.closed:
-            await ws_json.close()
-
-        # Attempt to connect with an invalid ID via header auth
-        with pytest.raises(websockets.exceptions.ConnectionClosedError) as excinfo_header:
-            # The server logic might accept the connection initially then close it after checking the header
-            # Or it might close it during the handshake if it processes headers early for auth decision.
-            # Based on main.py, it accepts, then checks header, then closes if user_id from header is invalid.
-            # However, if the header is present but the user ID doesn't exist in `users`, it sends an ack then main loop might error.
-            # Let's refine this: main.py user_id check logic for header happens *before* sending ack.
-            # So, it should close with 1008 if user_id from header is not in users dict.
-            ws_header = await websockets.connect(WS_URL, extra_headers={"x-user-id": invalid_user_id})
-            # The server should close the connection, client might see it as a normal close or a specific code
-            await ws_header.recv() # This should fail as server closes it
-        assert excinfo_header.value.code == 1008 # Policy Violation
-        print(f"Connection with invalid user ID (header auth) correctly closed with code {excinfo_header.value.code}.")
-        if ws_header and not ws_header.closed:
-            await ws_header.close()
-
-    except websockets.exceptions.InvalidStatusCode as e:
-        # This can happen if the server rejects the connection during handshake due to header
-        assert e.status_code in [401, 403] # Or whatever status code ngrok/server might send for early rejection
-        print(f"Connection with invalid user ID (header auth) rejected during handshake with status {e.status_code}")
+        # Server should send ack immediately upon connection with header
+        ws = await connect_ws(server, user_id, send_auth_json=False, use_header=True)
+        print(f"User {user_name} ({user_id}) connected via WebSocket with header auth and received ack.")
+        # Simple heartbeat check
+        await ws.send(" ") # Send whitespace as heartbeat
+        heartbeat_ack = await ws.recv(timeout=2)
+        assert "heartbeat" in json.loads(heartbeat_ack).get("type")
+        print(f"User {user_name} received heartbeat ack.")
     finally:
-        # Ensure ws objects are closed if they were somehow assigned and open
-        if 'ws_json' in locals() and ws_json and not ws_json.closed:
-            await ws_json.close()
-        if 'ws_header' in locals() and ws_header and not ws_header.closed:
-            await ws_header.close()
+        if ws:
+            await ws.close()
+
+@pytest.mark.asyncio
+async def test_websocket_connect_invalid_user_id(server):
+    invalid_user_id = str(uuid.uuid4()) # A non-existent user ID
+
+    # Attempt to connect with an invalid ID via JSON auth
+    with pytest.raises(WebSocketClosed) as excinfo_json:
+        ws_json = await server.websocket(ack=False)
+        await ws_json.send(json.dumps({"id": invalid_user_id}))
+        await ws_json.recv() # Server should close connection
+    assert excinfo_json.value.code == 1008 # Policy Violation (as per main.py logic for invalid user)
+    print(f"Connection with invalid user ID (JSON auth) correctly closed with code {excinfo_json.value.code}.")
+
+    # Attempt to connect with an invalid ID via header auth
+    with pytest.raises(WebSocketClosed) as excinfo_header:
+        # main.py accepts the connection, checks the header's user ID before sending an ack,
+        # and closes with 1008 if that ID is not a registered user.
+        ws_header = await server.websocket(invalid_user_id, ack=False)
+        await ws_header.recv() # This should fail as server closes it
+    assert excinfo_header.value.code == 1008 # Policy Violation
+    print(f"Connection with invalid user ID (header auth) correctly closed with code {excinfo_header.value.code}.")
 
 
 @pytest.mark.asyncio
-async def test_websocket_connect_no_auth():
+async def test_websocket_connect_no_auth(server):
     ws = None
     try:
-        ws = await websockets.connect(WS_URL)
-        # Server waits for auth message. If not sent, it might timeout or close.
-        # Based on main.py, it waits for auth_data = await websocket.receive_json()
-        # If nothing sent, this will eventually lead to a timeout on the server side, 
-        # or client might close. For robustness, client should expect a close.
-        with pytest.raises(websockets.exceptions.ConnectionClosed) as excinfo:
+        ws = await server.websocket(ack=False)
+        # Server waits for auth message. If not sent, it closes once the auth timeout passes.
+        # For robustness, client should expect a close.
+        with pytest.raises(WebSocketClosed) as excinfo:
             # Wait for a short period to see if server closes connection
-            await asyncio.wait_for(ws.recv(), timeout=2.0) 
+            await ws.recv(timeout=2.0)
         # The server should close the connection due to lack of authentication (or timeout)
-        # The close code might be 1002 (Protocol Error) or a custom one if server implements it.
-        # main.py doesn't specify a close code for this exact scenario before auth timeout, but after timeout it would close.
-        # If `receive_json()` times out or fails, it might result in a generic close or protocol error.
-        # Let's assume server will close it (e.g. 1002, or 1001 if server is shutting down the handler)
         print(f"Connection without auth closed by server with code: {excinfo.value.code}")
         assert excinfo.value.code in [1002, 1001, 1008, 1011] # Protocol error, Going Away, Policy Violation, Internal Error
     except asyncio.TimeoutError:
         print("Client timed out waiting for server to close connection after no auth. This is also a valid outcome.")
     finally:
-        if ws and not ws.closed:
+        if ws:
             await ws.close()
 
 @pytest.mark.asyncio
-async def test_websocket_send_message_before_auth():
+async def test_websocket_send_message_before_auth(server):
     ws = None
     try:
-        ws = await websockets.connect(WS_URL)
+        ws = await server.websocket(ack=False)
         # Attempt to send data before authenticating
         await ws.send(json.dumps({"message": "hello"}))
-        
-        # Server behavior might vary: close connection, ignore message, or error.
-        # In main.py, it first tries to receive auth data (JSON or from header).
-        # If it receives a non-auth JSON first, it might fail parsing for 'id' or user_id validation.
-        # Let's see how main.py handles this: it expects auth first.
-        # `auth_data = await websocket.receive_json()` will try to parse this. If it doesn't have 'id', it will lead to closure.
-        with pytest.raises(websockets.exceptions.ConnectionClosedError) as excinfo:
+
+        # main.py expects auth first. A JSON message without 'id' fails the user ID check and closes the connection.
+        with pytest.raises(WebSocketClosed) as excinfo:
             await ws.recv() # Expect server to close the connection
         assert excinfo.value.code == 1008 # Policy Violation (or 1003/1007 if data is unparseable/invalid for auth)
         print(f"Sending message before auth correctly led to connection close with code {excinfo.value.code}.")
     finally:
-        if ws and not ws.closed:
+        if ws:
             await ws.close()
 
 @pytest.mark.asyncio
-async def test_send_message_http_successful():
-    async with httpx.AsyncClient() as client:
-        sender_name = f"sender_http_{uuid.uuid4()}"
-        recipient_name = f"recipient_http_{uuid.uuid4()}"
+async def test_send_message_http_successful(server):
+    sender_name = f"sender_http_{uuid.uuid4()}"
+    recipient_name = f"recipient_http_{uuid.uuid4()}"
 
-        sender_data = await create_user(client, sender_name)
-        sender_id = sender_data["id"]
-        recipient_data = await create_user(client, recipient_name)
-        recipient_id = recipient_data["id"]
+    sender_data = await create_user(server, sender_name)
+    sender_id = sender_data["id"]
+    recipient_data = await create_user(server, recipient_name)
+    recipient_id = recipient_data["id"]
 
-        ws_recipient = None
-        try:
-            # Connect recipient's WebSocket
-            ws_recipient = await connect_ws(recipient_id)
-            print(f"Recipient {recipient_name} connected.")
-
-            # Sender sends message via HTTP
-            message_content = f"Hello {recipient_name} from {sender_name} via HTTP!"
-            payload = {"recipient_name": recipient_name, "message": message_content}
-            headers = {"x-user-id": sender_id}
-            
-            response = await client.post(f"{BASE_URL}/api/messages/send", json=payload, headers=headers)
-            response.raise_for_status()
-            send_data = response.json()
-            print(f"Send message HTTP response: {send_data}")
-            assert send_data["status"] == 200 # MessageStatus.DELIVERED
-            assert send_data["details"] == f"Message {send_data['message_id']} delivered to {recipient_name}"
-
-            # Recipient receives message via WebSocket
-            received_msg_json = await asyncio.wait_for(ws_recipient.recv(), timeout=3)
-            received_msg = json.loads(received_msg_json)
-            print(f"Recipient {recipient_name} received on WS: {received_msg}")
-
-            assert received_msg["from"] == sender_name
-            assert received_msg["message"] == message_content
-            assert received_msg["message_id"] == send_data["message_id"]
-        finally:
-            if ws_recipient and not ws_recipient.closed:
-                await ws_recipient.close()
+    ws_recipient = None
+    try:
+        # Connect recipient's WebSocket
+        ws_recipient = await connect_ws(server, recipient_id)
+        print(f"Recipient {recipient_name} connected.")
 
-@pytest.mark.asyncio
-async def test_send_message_http_recipient_not_found():
-    async with httpx.AsyncClient() as client:
-        sender_name = f"sender_nr_{uuid.uuid4()}"
-        sender_data = await create_user(client, sender_name)
-        sender_id = sender_data["id"]
-
-        non_existent_recipient_name = f"nosuchuser_{uuid.uuid4()}"
-        payload = {"recipient_name": non_existent_recipient_name, "message": "Hello?"}
+        # Sender sends message via HTTP
+        message_content = f"Hello {recipient_name} from {sender_name} via HTTP!"
+        payload = {"recipient_name": recipient_name, "message": message_content}
         headers = {"x-user-id": sender_id}
 
-        response = await client.post(f"{BASE_URL}/api/messages/send", json=payload, headers=headers)
-        assert response.status_code == 404
-        error_details = response.json()["detail"]
-        assert error_details["code"] == 404 # MessageStatus.NOT_FOUND
-        assert f"Recipient '{non_existent_recipient_name}' not found" in error_details["message"]
-        print("Verified sending message to non-existent recipient fails correctly.")
+        response = await server.http.post("/api/messages/send", json=payload, headers=headers)
+        response.raise_for_status()
+        send_data = response.json()
+        print(f"Send message HTTP response: {send_data}")
+        assert send_data["status"] == 200 # MessageStatus.DELIVERED
+        assert send_data["details"] == f"Message {send_data['message_id']} delivered to {recipient_name}"
+
+        # Recipient receives message via WebSocket
+        received_msg_json = await ws_recipient.recv(timeout=3)
+        received_msg = json.loads(received_msg_json)
+        print(f"Recipient {recipient_name} received on WS: {received_msg}")
+
+        assert received_msg["from"] == sender_name
+        assert received_msg["message"] == message_content
+        assert received_msg["message_id"] == send_data["message_id"]
+    finally:
+        if ws_recipient:
+            await ws_recipient.close()
 
 @pytest.mark.asyncio
-async def test_send_message_http_recipient_not_connected():
-    async with httpx.AsyncClient() as client:
-        sender_name = f"sender_ndc_{uuid.uuid4()}"
-        recipient_name = f"recipient_ndc_{uuid.uuid4()}"
+async def test_send_message_http_recipient_not_found(server):
+    sender_name = f"sender_nr_{uuid.uuid4()}"
+    sender_data = await create_user(server, sender_name)
+    sender_id = sender_data["id"]
+
+    non_existent_recipient_name = f"nosuchuser_{uuid.uuid4()}"
+    payload = {"recipient_name": non_existent_recipient_name, "message": "Hello?"}
+    headers = {"x-user-id": sender_id}
+
+    response = await server.http.post("/api/messages/send", json=payload, headers=headers)
+    assert response.status_code == 404
+    error_details = response.json()["detail"]
+    assert error_details["code"] == 404 # MessageStatus.NOT_FOUND
+    assert f"Recipient '{non_existent_recipient_name}' not found" in error_details["message"]
+    print("Verified sending message to non-existent recipient fails correctly.")
 
-        sender_data = await create_user(client, sender_name)
-        sender_id = sender_data["id"]
-        await create_user(client, recipient_name) # Recipient exists but is not connected
+@pytest.mark.asyncio
+async def test_send_message_http_recipient_not_connected(server):
+    sender_name = f"sender_ndc_{uuid.uuid4()}"
+    recipient_name = f"recipient_ndc_{uuid.uuid4()}"
 
-        payload = {"recipient_name": recipient_name, "message": "Are you there?"}
-        headers = {"x-user-id": sender_id}
+    sender_data = await create_user(server, sender_name)
+    sender_id = sender_data["id"]
+    await create_user(server, recipient_name) # Recipient exists but is not connected
 
-        response = await client.post(f"{BASE_URL}/api/messages/send", json=payload, headers=headers)
-        assert response.status_code == 404 # As per main.py logic
-        error_details = response.json()["detail"]
-        assert error_details["code"] == 404 # MessageStatus.NOT_FOUND
-        assert f"Recipient '{recipient_name}' is not connected" in error_details["message"]
-        print("Verified sending message to disconnected recipient fails correctly.")
+    payload = {"recipient_name": recipient_name, "message": "Are you there?"}
+    headers = {"x-user-id": sender_id}
+
+    response = await server.http.post("/api/messages/send", json=payload, headers=headers)
+    assert response.status_code == 404 # As per main.py logic
+    error_details = response.json()["detail"]
+    assert error_details["code"] == 404 # MessageStatus.NOT_FOUND
+    assert f"Recipient '{recipient_name}' is not connected" in error_details["message"]
+    print("Verified sending message to disconnected recipient fails correctly.")
 
 @pytest.mark.asyncio
-async def test_send_message_http_unauthenticated():
-    async with httpx.AsyncClient() as client:
-        recipient_name = f"recipient_unauth_{uuid.uuid4()}"
-        await create_user(client, recipient_name) # Recipient needs to exist for other checks
-        # We also need the recipient to be connected for the message to be delivered if auth passed
-        # However, this test focuses on the auth failure for the *sender*
-
-        payload = {"recipient_name": recipient_name, "message": "Secret message"}
-        # No x-user-id header
-        response = await client.post(f"{BASE_URL}/api/messages/send", json=payload)
-        assert response.status_code == 401
-        error_details = response.json()["detail"]
-        assert error_details["code"] == 401 # MessageStatus.UNAUTHORIZED
-        assert "Authentication required" in error_details["message"]
-        print("Verified sending message unauthenticated (no header) fails correctly.")
+async def test_send_message_http_unauthenticated(server):
+    recipient_name = f"recipient_unauth_{uuid.uuid4()}"
+    await create_user(server, recipient_name) # Recipient needs to exist for other checks
+    # This test focuses on the auth failure for the *sender*
+
+    payload = {"recipient_name": recipient_name, "message": "Secret message"}
+    # No x-user-id header
+    response = await server.http.post("/api/messages/send", json=payload)
+    assert response.status_code == 401
+    error_details = response.json()["detail"]
+    assert error_details["code"] == 401 # MessageStatus.UNAUTHORIZED
+    assert "Authentication required" in error_details["message"]
+    print("Verified sending message unauthenticated (no header) fails correctly.")
 
 @pytest.mark.asyncio
-async def test_send_message_http_invalid_sender_id():
-    async with httpx.AsyncClient() as client:
-        recipient_name = f"recipient_inv_sender_{uuid.uuid4()}"
-        await create_user(client, recipient_name) # Recipient exists
-
-        invalid_sender_id = str(uuid.uuid4())
-        payload = {"recipient_name": recipient_name, "message": "Message from a ghost"}
-        headers = {"x-user-id": invalid_sender_id}
-
-        response = await client.post(f"{BASE_URL}/api/messages/send", json=payload, headers=headers)
-        assert response.status_code == 401
-        error_details = response.json()["detail"]
-        assert error_details["code"] == 401 # MessageStatus.UNAUTHORIZED
-        assert "Invalid user ID" in error_details["message"]
-        print("Verified sending message with invalid sender ID fails correctly.")
+async def test_send_message_http_invalid_sender_id(server):
+    recipient_name = f"recipient_inv_sender_{uuid.uuid4()}"
+    await create_user(server, recipient_name) # Recipient exists
+
+    invalid_sender_id = str(uuid.uuid4())
+    payload = {"recipient_name": recipient_name, "message": "Message from a ghost"}
+    headers = {"x-user-id": invalid_sender_id}
+
+    response = await server.http.post("/api/messages/send", json=payload, headers=headers)
+    assert response.status_code == 401
+    error_details = response.json()["detail"]
+    assert error_details["code"] == 401 # MessageStatus.UNAUTHORIZED
+    assert "Invalid user ID" in error_details["message"]
+    print("Verified sending message with invalid sender ID fails correctly.")
 
 @pytest.mark.asyncio
-async def test_send_message_http_to_self():
-    async with httpx.AsyncClient() as client:
-        user_name = f"self_sender_{uuid.uuid4()}"
-        user_data = await create_user(client, user_name)
-        user_id = user_data["id"]
+async def test_send_message_http_to_self(server):
+    user_name = f"self_sender_{uuid.uuid4()}"
+    user_data = await create_user(server, user_name)
+    user_id = user_data["id"]
 
-        ws_user = None
-        try:
-            ws_user = await connect_ws(user_id)
-            print(f"User {user_name} connected for self-messaging test.")
-
-            message_content = f"Hello me, {user_name}!"
-            payload = {"recipient_name": user_name, "message": message_content}
-            headers = {"x-user-id": user_id}
-
-            response = await client.post(f"{BASE_URL}/api/messages/send", json=payload, headers=headers)
-            response.raise_for_status()
-            send_data = response.json()
-            assert send_data["status"] == 200
-
-            received_msg_json = await asyncio.wait_for(ws_user.recv(), timeout=3)
-            received_msg = json.loads(received_msg_json)
-            print(f"User {user_name} received self-message: {received_msg}")
-
-            assert received_msg["from"] == user_name
-            assert received_msg["message"] == message_content
-            assert received_msg["message_id"] == send_data["message_id"]
-            print("Verified sending message to self successfully.")
-        finally:
-            if ws_user and not ws_user.closed:
-                await ws_user.close()
+    ws_user = None
+    try:
+        ws_user = await connect_ws(server, user_id)
+        print(f"User {user_name} connected for self-messaging test.")
+
+        message_content = f"Hello me, {user_name}!"
+        payload = {"recipient_name": user_name, "message": message_content}
+        headers = {"x-user-id": user_id}
+
+        response = await server.http.post("/api/messages/send", json=payload, headers=headers)
+        response.raise_for_status()
+        send_data = response.json()
+        assert send_data["status"] == 200
+
+        received_msg_json = await ws_user.recv(timeout=3)
+        received_msg = json.loads(received_msg_json)
+        print(f"User {user_name} received self-message: {received_msg}")
+
+        assert received_msg["from"] == user_name
+        assert received_msg["message"] == message_content
+        assert received_msg["message_id"] == send_data["message_id"]
+        print("Verified sending message to self successfully.")
+    finally:
+        if ws_user:
+            await ws_user.close()
 
 @pytest.mark.asyncio
-async def test_websocket_duplicate_auth_after_header_auth():
-    async with httpx.AsyncClient() as client:
-        user_name = f"ws_dup_auth_{uuid.uuid4()}"
-        user_data = await create_user(client, user_name)
-        user_id = user_data["id"]
+async def test_websocket_duplicate_auth_after_header_auth(server):
+    user_name = f"ws_dup_auth_{uuid.uuid4()}"
+    user_data = await create_user(server, user_name)
+    user_id = user_data["id"]
 
-        ws = None
-        try:
-            # Connect with header auth, this also consumes the initial ack
-            ws = await connect_ws(user_id, send_auth_json=False, use_header=True)
-            print(f"User {user_name} ({user_id}) connected via WebSocket with header auth.")
-
-            # Send a duplicate JSON auth message
-            await ws.send(json.dumps({"id": user_id}))
-            print(f"Sent duplicate JSON auth for {user_name}.")
-
-            # The server should ignore this. We can test by sending a heartbeat 
-            # and ensuring the connection is still alive and responsive.
-            # Or by checking server logs if they indicate "Duplicate auth message received and ignored"
-            await ws.send(" ") # Send whitespace as heartbeat
-            heartbeat_ack_json = await asyncio.wait_for(ws.recv(), timeout=2)
-            heartbeat_ack = json.loads(heartbeat_ack_json)
-            assert heartbeat_ack.get("type") == "heartbeat"
-            assert heartbeat_ack.get("status") == "ok"
-            print(f"User {user_name} received heartbeat ack after sending duplicate auth. Connection stable.")
-
-        finally:
-            if ws and not ws.closed:
-                await ws.close()
+    ws = None
+    try:
+        # Connect with header auth, this also consumes the initial ack
+        ws = await connect_ws(server, user_id, send_auth_json=False, use_header=True)
+        print(f"User {user_name} ({user_id}) connected via WebSocket with header auth.")
+
+        # Send a duplicate JSON auth message
+        await ws.send(json.dumps({"id": user_id}))
+        print(f"Sent duplicate JSON auth for {user_name}.")
+
+        # The server should ignore this. We can test by sending a heartbeat
+        # and ensuring the connection is still alive and responsive.
+        await ws.send(" ") # Send whitespace as heartbeat
+        heartbeat_ack_json = await ws.recv(timeout=2)
+        heartbeat_ack = json.loads(heartbeat_ack_json)
+        assert heartbeat_ack.get("type") == "heartbeat"
+        assert heartbeat_ack.get("status") == "ok"
+        print(f"User {user_name} received heartbeat ack after sending duplicate auth. Connection stable.")
+
+    finally:
+        if ws:
+            await ws.close()
 
 @pytest.mark.asyncio
-async def test_simultaneous_connections_and_messaging():
-    async with httpx.AsyncClient() as client:
-        user1_name = f"sim_user1_{uuid.uuid4()}"
-        user2_name = f"sim_user2_{uuid.uuid4()}"
-
-        user1_data = await create_user(client, user1_name)
-        user1_id = user1_data["id"]
-        user2_data = await create_user(client, user2_name)
-        user2_id = user2_data["id"]
-
-        ws1 = None
-        ws2 = None
-        try:
-            # Connect both users
-            ws1 = await connect_ws(user1_id)
-            print(f"User {user1_name} connected.")
-            ws2 = await connect_ws(user2_id)
-            print(f"User {user2_name} connected.")
-
-            # User1 sends message to User2 via HTTP
-            msg1_to_2_content = f"Hello {user2_name} from {user1_name}!"
-            payload1 = {"recipient_name": user2_name, "message": msg1_to_2_content}
-            headers1 = {"x-user-id": user1_id}
-            res1 = await client.post(f"{BASE_URL}/api/messages/send", json=payload1, headers=headers1)
-            res1.raise_for_status()
-            msg1_id = res1.json()["message_id"]
-
-            # User2 receives message
-            recv_msg_user2_json = await asyncio.wait_for(ws2.recv(), timeout=3)
-            recv_msg_user2 = json.loads(recv_msg_user2_json)
-            assert recv_msg_user2["from"] == user1_name
-            assert recv_msg_user2["message"] == msg1_to_2_content
-            assert recv_msg_user2["message_id"] == msg1_id
-            print(f"{user2_name} received message from {user1_name}.")
-
-            # User2 sends message to User1 via HTTP
-            msg2_to_1_content = f"Hi {user1_name} from {user2_name}!"
-            payload2 = {"recipient_name": user1_name, "message": msg2_to_1_content}
-            headers2 = {"x-user-id": user2_id}
-            res2 = await client.post(f"{BASE_URL}/api/messages/send", json=payload2, headers=headers2)
-            res2.raise_for_status()
-            msg2_id = res2.json()["message_id"]
-
-            # User1 receives message
-            recv_msg_user1_json = await asyncio.wait_for(ws1.recv(), timeout=3)
-            recv_msg_user1 = json.loads(recv_msg_user1_json)
-            assert recv_msg_user1["from"] == user2_name
-            assert recv_msg_user1["message"] == msg2_to_1_content
-            assert recv_msg_user1["message_id"] == msg2_id
-            print(f"{user1_name} received message from {user2_name}.")
-
-        finally:
-            if ws1 and not ws1.closed:
-                await ws1.close()
-            if ws2 and not ws2.closed:
-                await ws2.close()
+async def test_simultaneous_connections_and_messaging(server):
+    user1_name = f"sim_user1_{uuid.uuid4()}"
+    user2_name = f"sim_user2_{uuid.uuid4()}"
+
+    user1_data = await create_user(server, user1_name)
+    user1_id = user1_data["id"]
+    user2_data = await create_user(server, user2_name)
+    user2_id = user2_data["id"]
+
+    ws1 = None
+    ws2 = None
+    try:
+        # Connect both users
+        ws1 = await connect_ws(server, user1_id)
+        print(f"User {user1_name} connected.")
+        ws2 = await connect_ws(server, user2_id)
+        print(f"User {user2_name} connected.")
+
+        # User1 sends message to User2 via HTTP
+        msg1_to_2_content = f"Hello {user2_name} from {user1_name}!"
+        payload1 = {"recipient_name": user2_name, "message": msg1_to_2_content}
+        headers1 = {"x-user-id": user1_id}
+        res1 = await server.http.post("/api/messages/send", json=payload1, headers=headers1)
+        res1.raise_for_status()
+        msg1_id = res1.json()["message_id"]
+
+        # User2 receives message
+        recv_msg_user2_json = await ws2.recv(timeout=3)
+        recv_msg_user2 = json.loads(recv_msg_user2_json)
+        assert recv_msg_user2["from"] == user1_name
+        assert recv_msg_user2["message"] == msg1_to_2_content
+        assert recv_msg_user2["message_id"] == msg1_id
+        print(f"{user2_name} received message from {user1_name}.")
+
+        # User2 sends message to User1 via HTTP
+        msg2_to_1_content = f"Hi {user1_name} from {user2_name}!"
+        payload2 = {"recipient_name": user1_name, "message": msg2_to_1_content}
+        headers2 = {"x-user-id": user2_id}
+        res2 = await server.http.post("/api/messages/send", json=payload2, headers=headers2)
+        res2.raise_for_status()
+        msg2_id = res2.json()["message_id"]
+
+        # User1 receives message
+        recv_msg_user1_json = await ws1.recv(timeout=3)
+        recv_msg_user1 = json.loads(recv_msg_user1_json)
+        assert recv_msg_user1["from"] == user2_name
+        assert recv_msg_user1["message"] == msg2_to_1_content
+        assert recv_msg_user1["message_id"] == msg2_id
+        print(f"{user1_name} received message from {user2_name}.")
+
+    finally:
+        if ws1:
+            await ws1.close()
+        if ws2:
+            await ws2.close()
 
 @pytest.mark.asyncio
-async def test_websocket_heartbeat():
-    async with httpx.AsyncClient() as client:
-        user_name = f"heartbeat_user_{uuid.uuid4()}"
-        user_data = await create_user(client, user_name)
-        user_id = user_data["id"]
-        ws = None
-        try:
-            ws = await connect_ws(user_id)
-            print(f"User {user_name} connected for heartbeat test.")
-            
-            # Send heartbeat (empty or whitespace message)
-            await ws.send(" ") 
-            response_json = await asyncio.wait_for(ws.recv(), timeout=2)
-            response = json.loads(response_json)
-            
-            assert response.get("type") == "heartbeat"
-            assert response.get("status") == "ok"
-            print("Heartbeat acknowledged by server.")
-        finally:
-            if ws and not ws.closed:
-                await ws.close()
+async def test_websocket_heartbeat(server):
+    user_name = f"heartbeat_user_{uuid.uuid4()}"
+    user_data = await create_user(server, user_name)
+    user_id = user_data["id"]
+    ws = None
+    try:
+        ws = await connect_ws(server, user_id)
+        print(f"User {user_name} connected for heartbeat test.")
+
+        # Send heartbeat (empty or whitespace message)
+        await ws.send(" ")
+        response_json = await ws.recv(timeout=2)
+        response = json.loads(response_json)
+
+        assert response.get("type") == "heartbeat"
+        assert response.get("status") == "ok"
+        print("Heartbeat acknowledged by server.")
+    finally:
+        if ws:
+            await ws.close()
 
 @pytest.mark.asyncio
-async def test_websocket_malformed_auth_json():
+async def test_websocket_malformed_auth_json(server):
     ws = None
     try:
-        ws = await websockets.connect(WS_URL)
+        ws = await server.websocket(ack=False)
         # Send malformed JSON (e.g., missing 'id' field or not JSON at all)
         await ws.send(json.dumps({"user_identity": "some_user"})) # Missing 'id'
-        
-        with pytest.raises(websockets.exceptions.ConnectionClosedError) as excinfo:
+
+        with pytest.raises(WebSocketClosed) as excinfo:
             await ws.recv() # Server should close due to invalid auth data
-        
+
         # Based on main.py, if `user_id = auth_data.get("id")` is None, it closes with 1008
         assert excinfo.value.code == 1008 # Policy Violation
         print(f"Sending malformed auth JSON correctly led to connection close with code {excinfo.value.code}.")
     finally:
-        if ws and not ws.closed:
+        if ws:
             await ws.close()
-    
+
     # Test sending non-JSON data for auth
     ws_non_json = None
     try:
-        ws_non_json = await websockets.connect(WS_URL)
+        ws_non_json = await server.websocket(ack=False)
         await ws_non_json.send("this is not json")
-        with pytest.raises(websockets.exceptions.ConnectionClosedError) as excinfo_non_json:
+        with pytest.raises(WebSocketClosed) as excinfo_non_json:
             await ws_non_json.recv()
-        # main.py `auth_data = await websocket.receive_json()` would raise error, leading to exception handler
-        # The generic exception handler in websocket_endpoint might not set a specific code, 
-        # or websockets library might use a generic code if server crashes handler before close frame.
-        # Often 1002 (Protocol Error) or 1011 (Internal Error) if server fails to parse and doesn't send specific close code.
-        # Given main.py's structure, a parsing error for receive_json() will go to the broad `except Exception`
-        # which doesn't explicitly close the websocket with a code before `del connections[user_id]`
-        # The `finally` block in `websocket_endpoint` has `del connections[user_id]` which may not be reached if user_id is not set.
-        # Python websockets library might default to 1006 (Abnormal Closure) if server drops connection without proper close frame.
-        # Let's assume a general error code or one that indicates bad data.
-        # The server actually prints "[Server] Received non-JSON message during auth: this is not json"
-        # and then tries to get user_id, which is None. Then `if not user_id or ...` closes with 1008.
+        # The server prints "[Server] Received non-JSON message during auth: this is not json",
+        # finds no user ID and closes with 1008 like any other invalid auth message.
         assert excinfo_non_json.value.code == 1008 # Policy Violation after failing to get user_id
         print(f"Sending non-JSON auth data correctly led to connection close with code {excinfo_non_json.value.code}.")
     finally:
-        if ws_non_json and not ws_non_json.closed:
+        if ws_non_json:
             await ws_non_json.close()
 
-# Note: Testing abrupt disconnects from the client side and verifying server cleanup 
-# (e.g., removal from `connections` dict) is harder without direct server-side state inspection 
-# or specific server logs for these tests. We trust `main.py`'s `finally` block in `websocket_endpoint` handles this.
-
-async def main_manual_run():
-    # This function is for basic manual checking and is NOT a substitute for pytest.
-    # Pytest provides proper test discovery, execution, and reporting.
-    # Ensure your server from `main.py` is running before trying this.
-    print("Attempting a limited manual run of some test functions...")
-    print("This is not comprehensive. For full testing, use: pytest tests/robust_integration_test.py")
-    
-    # Example: You could selectively call some test functions here for quick checks.
-    # However, it's often better to run specific tests via pytest command-line options.
-    # e.g., `pytest tests/robust_integration_test.py -k test_websocket_connect_auth_json`
-    
-    # For this example, we'll just print a message.
-    # To actually run tests here, you'd need to:
-    # 1. Create an httpx.AsyncClient()
-    # 2. Call test functions: e.g., await test_create_and_list_users(client_here) (if tests accept client as param)
-    #    Or structure tests to be callable without direct pytest fixtures if you want to run them here.
-    #    The current pytest structure with `async with httpx.AsyncClient() as client:` inside each test
-    #    is standard for pytest but makes them less straightforward to call directly in a simple loop.
-
-    print("Manual run placeholder finished. Please use pytest for actual testing.")
-
-if __name__ == "__main__":
-    print("### Running robust_integration_test.py directly ###")
-    print("This script is intended to be run with pytest: `pytest tests/robust_integration_test.py`")
-    print("Make sure the server from `backend/main.py` is running on localhost:8000.")
-    print("The `main_manual_run()` function below is for extremely limited, manual checks only.")
-    print("It does NOT execute the full test suite or provide proper results.")
-    
-    # To perform a very limited manual check (not recommended for CI/thorough testing):
-    # asyncio.run(main_manual_run())
-    print("\nExiting. Use pytest to run the tests.")
-
-    # Note: The original asyncio.run(main()) is removed to prevent accidental execution 
-    # of a potentially incomplete or misleading test sequence when run directly.
-    # The primary execution method should be `pytest`. 
\ No newline at end of file
+# Note: server-side cleanup after abrupt client disconnects (removal from `connections`) is covered
+# by the in-process suites, which can inspect `server.main` directly.
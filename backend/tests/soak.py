@@ -0,0 +1,299 @@
+"""Chaos and soak harness for the chat server.
+
+Runs many agents against a server it starts itself. It randomly kills and
+reconnects their sockets and restarts the server, then checks every accepted
+``message_id`` against what was received:
+
+    python tests/soak.py --agents 50 --duration 600 --rate 2 --kill-rate 0.02 --restart-every 120
+
+Reports loss (accepted but never received), duplication, per-sender
+reordering and delivery latency percentiles. A message is "accepted" once
+/api/messages/send answered 200. Sends the server rejected, for example
+because the recipient was offline, are counted separately and not as loss.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+class ServerProcess:
+    """The server under test, restartable with SIGKILL to simulate a crash"""
+
+    def __init__(self, port: int, env: Optional[Dict[str, str]] = None):
+        self.port = port
+        self.env = dict(os.environ, **(env or {}))
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/ws"
+
+    async def start(self, timeout: float = 15.0):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port)],
+            cwd=BACKEND_DIR, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while True:
+                try:
+                    (await client.get(f"{self.base_url}/api/users/list")).raise_for_status()
+                    return
+                except httpx.HTTPError:
+                    if time.monotonic() > deadline:
+                        raise
+                    await asyncio.sleep(0.05)
+
+    def stop(self, crash: bool = False):
+        if self.process:
+            self.process.kill() if crash else self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    async def restart(self):
+        self.stop(crash=True)
+        await self.start()
+
+
+@dataclass
+class SoakReport:
+    duration: float = 0.0
+    attempted: int = 0
+    accepted: int = 0
+    rejected: Counter = field(default_factory=Counter)
+    received: int = 0
+    lost: int = 0
+    duplicated: int = 0
+    reordered: int = 0
+    socket_kills: int = 0
+    server_restarts: int = 0
+    reconnects: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    def as_dict(self) -> Dict:
+        return {
+            "duration_s": round(self.duration, 1),
+            "attempted": self.attempted,
+            "accepted": self.accepted,
+            "rejected": dict(self.rejected),
+            "received": self.received,
+            "lost": self.lost,
+            "loss_rate": round(self.lost / self.accepted, 6) if self.accepted else 0.0,
+            "duplicated": self.duplicated,
+            "reordered": self.reordered,
+            "socket_kills": self.socket_kills,
+            "server_restarts": self.server_restarts,
+            "reconnects": self.reconnects,
+            "latency_ms": {
+                "p50": round(self.percentile(0.5), 2),
+                "p99": round(self.percentile(0.99), 2),
+                "p999": round(self.percentile(0.999), 2),
+                "max": round(self.percentile(1.0), 2),
+            },
+        }
+
+
+class SoakAgent:
+    """One agent: a socket reader that reconnects and re-registers, plus a sender"""
+
+    def __init__(self, harness: "SoakHarness", name: str):
+        self.harness = harness
+        self.name = name
+        self.user_id: Optional[str] = None
+        self.ws = None
+        self.seq = 0
+
+    async def register(self):
+        response = await self.harness.http.post("/api/users/create", json={"name": self.name})
+        if response.status_code == 201:
+            self.user_id = response.json()["id"]
+
+    async def run_socket(self):
+        ws_url = self.harness.server.ws_url
+        while not self.harness.stopping:
+            try:
+                if self.user_id is None:
+                    await self.register()
+                    if self.user_id is None:
+                        await asyncio.sleep(0.2)
+                        continue
+                self.ws = await websockets.connect(ws_url, extra_headers={"x-user-id": self.user_id}, max_size=None)
+                await self.ws.recv()  # connection_status ack
+                self.harness.report.reconnects += 1
+                async for raw in self.ws:
+                    self.harness.on_frame(self.name, raw)
+            except websockets.exceptions.ConnectionClosed as e:
+                if e.rcvd is not None and e.rcvd.code == 1008:
+                    # The server lost our registration (it restarted); register again
+                    self.user_id = None
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+                await asyncio.sleep(0.1)
+            finally:
+                self.ws = None
+
+    async def run_sender(self, peers: List[str], rate: float):
+        while not self.harness.sending_stopped:
+            await asyncio.sleep(random.expovariate(rate))
+            if self.user_id is None or self.harness.sending_stopped:
+                continue
+            recipient = random.choice(peers)
+            self.seq += 1
+            await self.harness.send(self, recipient, self.seq)
+
+    async def kill_socket(self):
+        if self.ws is not None:
+            self.harness.report.socket_kills += 1
+            self.ws.transport.abort()
+
+
+class SoakHarness:
+    def __init__(self, server: ServerProcess, agents: int, rate: float, kill_rate: float, restart_every: float):
+        self.server = server
+        self.rate = rate
+        self.kill_rate = kill_rate
+        self.restart_every = restart_every
+        self.agents = [SoakAgent(self, f"soak_{i}_{random.getrandbits(32):08x}") for i in range(agents)]
+        self.report = SoakReport()
+        self.http: Optional[httpx.AsyncClient] = None
+        self.accepted: Dict[str, Tuple[str, str, int]] = {}  # message_id -> (sender, recipient, seq)
+        self.receipts: Counter = Counter()
+        self.last_seq: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.stopping = False
+        self.sending_stopped = False
+
+    async def send(self, agent: SoakAgent, recipient: str, seq: int):
+        body = json.dumps({"sender": agent.name, "seq": seq, "sent_at": time.perf_counter()})
+        self.report.attempted += 1
+        try:
+            response = await self.http.post(
+                "/api/messages/send",
+                json={"recipient_name": recipient, "message": body},
+                headers={"x-user-id": agent.user_id},
+            )
+        except httpx.HTTPError as e:
+            self.report.rejected[type(e).__name__] += 1
+            return
+        if response.status_code == 200:
+            self.report.accepted += 1
+            self.accepted[response.json()["message_id"]] = (agent.name, recipient, seq)
+        else:
+            self.report.rejected[str(response.status_code)] += 1
+
+    def on_frame(self, recipient: str, raw: str):
+        frame = json.loads(raw)
+        if "message_id" not in frame or frame.get("type"):
+            return
+        received_at = time.perf_counter()
+        body = json.loads(frame["message"])
+        self.receipts[frame["message_id"]] += 1
+        self.report.received += 1
+        self.report.latencies.append(received_at - body["sent_at"])
+        pair = (body["sender"], recipient)
+        if body["seq"] < self.last_seq[pair]:
+            self.report.reordered += 1
+        else:
+            self.last_seq[pair] = body["seq"]
+
+    async def chaos(self):
+        next_restart = time.monotonic() + self.restart_every if self.restart_every else None
+        while not self.sending_stopped:
+            await asyncio.sleep(0.1)
+            for agent in self.agents:
+                if random.random() < self.kill_rate * 0.1:
+                    await agent.kill_socket()
+            if next_restart and time.monotonic() >= next_restart:
+                self.report.server_restarts += 1
+                await self.server.restart()
+                next_restart = time.monotonic() + self.restart_every
+
+    async def run(self, duration: float, drain: float = 2.0) -> SoakReport:
+        started = time.monotonic()
+        limits = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+        async with httpx.AsyncClient(base_url=self.server.base_url, limits=limits, timeout=10) as self.http:
+            names = [agent.name for agent in self.agents]
+            readers = [asyncio.create_task(agent.run_socket()) for agent in self.agents]
+            await asyncio.sleep(0.5)  # Let everyone register and connect
+            senders = [
+                asyncio.create_task(agent.run_sender([n for n in names if n != agent.name], self.rate))
+                for agent in self.agents
+            ]
+            chaos = asyncio.create_task(self.chaos())
+            await asyncio.sleep(duration)
+            self.sending_stopped = True
+            await asyncio.gather(*senders, chaos, return_exceptions=True)
+            await asyncio.sleep(drain)  # Let in-flight frames arrive
+            self.stopping = True
+            for agent in self.agents:
+                if agent.ws is not None:
+                    await agent.ws.close()
+            for task in readers:
+                task.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+
+        report = self.report
+        report.duration = time.monotonic() - started
+        report.lost = sum(1 for message_id in self.accepted if message_id not in self.receipts)
+        report.duplicated = sum(count - 1 for count in self.receipts.values() if count > 1)
+        return report
+
+
+async def run_soak(
+    agents: int = 20,
+    duration: float = 30.0,
+    rate: float = 5.0,
+    kill_rate: float = 0.0,
+    restart_every: float = 0.0,
+    port: int = 8131,
+) -> SoakReport:
+    """Start a server, soak it, stop it and return the report"""
+    server = ServerProcess(port)
+    await server.start()
+    try:
+        harness = SoakHarness(server, agents, rate, kill_rate, restart_every)
+        return await harness.run(duration)
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of sending")
+    parser.add_argument("--rate", type=float, default=5.0, help="messages per second per agent")
+    parser.add_argument("--kill-rate", type=float, default=0.02, help="socket kills per second per agent")
+    parser.add_argument("--restart-every", type=float, default=0.0, help="seconds between server crashes (0 = never)")
+    parser.add_argument("--port", type=int, default=8131)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    report = asyncio.run(run_soak(args.agents, args.duration, args.rate, args.kill_rate, args.restart_every, args.port))
+    print(json.dumps(report.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from admission import AdmissionControl, AdmissionLimits
+from harness import InProcessServer, WebSocketClosed
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_connection_cap_frees_slots_on_release():
+    control = AdmissionControl(AdmissionLimits(max_connections=2, retry_after=1.0))
+    assert control.admit() is None and control.admit() is None
+    rejection = control.admit()
+    assert rejection.reason == "capacity" and 1.0 <= rejection.retry_after <= 2.0
+    control.release()
+    assert control.admit() is None and control.open == 2
+
+
+def test_accept_rate_refills_over_time():
+    clock = FakeClock()
+    control = AdmissionControl(AdmissionLimits(accept_rate=10, accept_burst=2), clock=clock)
+    assert control.admit() is None and control.admit() is None
+    rejection = control.admit()
+    # One token refills in 0.1s; the hint is jittered up to twice that
+    assert rejection.reason == "rate" and 0.1 <= rejection.retry_after <= 0.2
+    clock.now += 0.1
+    assert control.admit() is None
+    assert control.admit().reason == "rate"
+
+
+async def expect_close(ws) -> WebSocketClosed:
+    with pytest.raises(WebSocketClosed) as excinfo:
+        await ws.recv()
+    return excinfo.value
+
+
+@pytest.mark.asyncio
+async def test_over_limit_sockets_are_told_to_retry_later():
+    async with InProcessServer({"COHORA_MAX_CONNECTIONS": "2"}) as server:
+        alice = await server.create_user("alice")
+        bob = await server.create_user("bob")
+        await server.websocket(alice)
+        await server.websocket(bob)
+        closed = await expect_close(await server.websocket(bob, ack=False))
+        assert closed.code == 1013 and closed.reason.startswith("capacity; retry_after=")
+
+        metrics = (await server.http.get("/api/metrics")).json()
+        assert metrics["counters"]["ws_rejected_capacity"] == 1
+        assert metrics["gauges"]["sockets_open"] == 2 and metrics["gauges"]["sockets_authenticating"] == 0
+
+
+class DroppedHandshake:
+    """Scope for a client that disconnects before the server's accept goes out"""
+
+    async def receive(self):
+        return {"type": "websocket.connect"}
+
+    async def send(self, message):
+        raise OSError("client went away")
+
+
+@pytest.mark.asyncio
+async def test_dropped_handshake_frees_its_connection_slot(server):
+    scope = {"type": "websocket", "path": "/ws", "headers": [], "query_string": b"", "subprotocols": []}
+    client = DroppedHandshake()
+    await server.app(scope, client.receive, client.send)
+    assert server.main.admission.open == 0
+
+
+@pytest.mark.asyncio
+async def test_unauthenticated_socket_is_closed_at_the_deadline():
+    async with InProcessServer({"COHORA_AUTH_TIMEOUT": "0.1"}) as server:
+        ws = await server.websocket(ack=False)
+        closed = await expect_close(ws)
+        assert closed.code == 4001 and closed.reason == "authentication timed out"
+        metrics = (await server.http.get("/api/metrics")).json()
+        assert metrics["counters"]["ws_auth_timeouts"] == 1
+        assert metrics["gauges"]["sockets_open"] == 0
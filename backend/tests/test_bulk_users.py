@@ -0,0 +1,63 @@
+import json
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# These tests use the in-process `server` fixture from conftest.py and need no running server.
+
+
+def parse_results(response: httpx.Response):
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_reports_each_name(server):
+    prefix = f"bulk_{uuid.uuid4().hex[:8]}"
+    taken = (await server.http.post("/api/users/create", json={"name": f"{prefix}_taken"})).json()["id"]
+    names = [f"{prefix}_{i}" for i in range(2500)] + [f"{prefix}_taken", f"{prefix}_0", 42]
+    results = parse_results(await server.http.post("/api/users/create_batch", json={"names": names}))
+
+    assert len(results) == len(names)
+    assert all(r["status"] == 201 and r["name"] == n for r, n in zip(results[:2500], names))
+    assert [r["status"] for r in results[2500:]] == [409, 409, 400]
+    assert results[2500]["id"] is None
+
+    listed = (await server.http.get("/api/users/list")).json()["users"]
+    assert listed[f"{prefix}_taken"] == taken
+    assert all(listed[r["name"]] == r["id"] for r in results[:2500])
+
+    response = await server.http.post("/api/users/create_batch", json={"users": names})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_from_ndjson_stream(server):
+    prefix = f"bulk_nd_{uuid.uuid4().hex[:8]}"
+
+    async def body():
+        # Split lines across chunks to check the server reassembles them
+        yield f'"{prefix}_a"\n{{"name": "{prefix}'.encode()
+        yield f'_b"}}\nnot json\n\n"{prefix}_a"'.encode()
+
+    response = await server.http.post(
+        "/api/users/create_batch", content=body(), headers={"content-type": "application/x-ndjson"}
+    )
+    results = parse_results(response)
+    assert [(r["name"], r["status"]) for r in results] == [
+        (f"{prefix}_a", 201), (f"{prefix}_b", 201), (None, 400), (f"{prefix}_a", 409)
+    ]
+    # The returned IDs authenticate: the send gets as far as the (offline) recipient
+    response = await server.http.post(
+        "/api/messages/send",
+        json={"recipient_name": f"{prefix}_b", "message": "hi"},
+        headers={"x-user-id": results[0]["id"]},
+    )
+    assert response.status_code == 404
+    assert "not connected" in response.json()["detail"]["message"]
@@ -0,0 +1,88 @@
+import asyncio
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from chat_client import ChatClient
+
+# ChatClient needs real sockets, so these tests start their own server process (`server_process` in conftest.py).
+
+
+@pytest.mark.asyncio
+async def test_client_concurrent_sends_dispatch_to_reader(server_process):
+    base_url, ws_url = server_process.base_url, server_process.ws_url
+    async with ChatClient(base_url, ws_url) as sender, ChatClient(base_url, ws_url) as receiver:
+        assert await sender.register(f"sdk_sender_{uuid.uuid4()}")
+        receiver_name = f"sdk_receiver_{uuid.uuid4()}"
+        assert await receiver.register(receiver_name)
+
+        received = asyncio.Queue()
+        receiver.on("message", received.put_nowait)
+        await receiver.start()
+
+        results = await sender.send_many([(receiver_name, f"msg {i}") for i in range(20)])
+        assert all(r and r["status"] == 200 for r in results)
+
+        messages = [await asyncio.wait_for(received.get(), timeout=3) for _ in range(20)]
+        assert sorted(m["message"] for m in messages) == sorted(f"msg {i}" for i in range(20))
+        assert {m["message_id"] for m in messages} == {r["message_id"] for r in results}
+
+
+@pytest.mark.asyncio
+async def test_client_heartbeat_reply_consumed_by_reader(server_process):
+    base_url, ws_url = server_process.base_url, server_process.ws_url
+    async with ChatClient(base_url, ws_url, heartbeat_interval=0.1, heartbeat_timeout=2) as client:
+        assert await client.register(f"sdk_heartbeat_{uuid.uuid4()}")
+        beats = asyncio.Queue()
+        client.on("heartbeat", beats.put_nowait)
+        await client.start()
+
+        frame = await asyncio.wait_for(beats.get(), timeout=3)
+        assert frame["status"] == "ok"
+        assert client.connected
+
+
+@pytest.mark.asyncio
+async def test_outbox_coalesces_sends_into_batches(server_process):
+    base_url, ws_url = server_process.base_url, server_process.ws_url
+    async with ChatClient(base_url, ws_url) as sender, ChatClient(base_url, ws_url) as receiver:
+        assert await sender.register(f"outbox_sender_{uuid.uuid4()}")
+        receiver_name = f"outbox_receiver_{uuid.uuid4()}"
+        assert await receiver.register(receiver_name)
+        received = asyncio.Queue()
+        receiver.on("message", received.put_nowait)
+        await receiver.start()
+
+        batches = []
+        send_batch = sender.send_batch
+
+        async def counting_send_batch(messages):
+            batches.append(len(messages))
+            return await send_batch(messages)
+
+        sender.send_batch = counting_send_batch
+        async with sender.outbox(linger=0.05, max_batch=10, max_pending=5) as outbox:
+            futures = [await outbox.send(receiver_name, f"queued {i}") for i in range(25)]
+            results = await asyncio.gather(*futures)
+
+        assert all(r["status"] == 200 for r in results)
+        assert sum(batches) == 25 and len(batches) < 25
+        assert max(batches) <= 10
+        messages = [await asyncio.wait_for(received.get(), timeout=3) for _ in range(25)]
+        assert [m["message"] for m in messages] == [f"queued {i}" for i in range(25)]
+
+
+@pytest.mark.asyncio
+async def test_send_batch_reports_per_item_status(server_process):
+    base_url, ws_url = server_process.base_url, server_process.ws_url
+    async with ChatClient(base_url, ws_url) as client:
+        name = f"batch_user_{uuid.uuid4()}"
+        assert await client.register(name)
+        await client.start()
+        results = await client.send_batch([(name, "to self"), (f"nosuchuser_{uuid.uuid4()}", "lost")])
+        assert results[0]["status"] == 200
+        assert results[1]["status"] == 404
+        assert results[1]["message_id"] is None
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+import httpx
+import pytest
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+from cluster import OWNER_HEADER, Cluster, HashRing
+from harness import InProcessServer
+
+# This suite starts its own three-node cluster on localhost
+NODES = {"a": "http://127.0.0.1:8101", "b": "http://127.0.0.1:8102", "c": "http://127.0.0.1:8103"}
+
+
+def test_hash_ring_balances_and_moves_few_keys():
+    keys = [str(uuid.uuid4()) for _ in range(10_000)]
+    ring = HashRing(["a", "b", "c"])
+    owners = {key: ring.owner(key) for key in keys}
+    counts = Counter(owners.values())
+    assert min(counts.values()) > 2500
+
+    # Adding a node only moves keys onto the new node
+    grown = HashRing(["a", "b", "c", "d"])
+    moved = [key for key in keys if grown.owner(key) != owners[key]]
+    assert all(grown.owner(key) == "d" for key in moved)
+    assert len(moved) < 4000
+
+
+@pytest.fixture(scope="module")
+def cluster_nodes():
+    spec = ",".join(f"{node}={url}" for node, url in NODES.items())
+    processes = []
+    for node, url in NODES.items():
+        env = dict(os.environ, COHORA_NODE_ID=node, COHORA_CLUSTER_NODES=spec, COHORA_CLUSTER_SECRET="test-secret")
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", url.rsplit(":", 1)[1]],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+    deadline = time.time() + 15
+    for url in NODES.values():
+        while True:
+            try:
+                httpx.get(f"{url}/api/users/list").raise_for_status()
+                break
+            except httpx.HTTPError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+    yield NODES
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+@pytest.mark.asyncio
+async def test_cluster_routes_sends_to_owner_node(cluster_nodes):
+    ring = HashRing(sorted(cluster_nodes))
+    async with httpx.AsyncClient() as client:
+        # Register through one node; the registry is replicated everywhere
+        alice = f"cluster_alice_{uuid.uuid4()}"
+        bob = f"cluster_bob_{uuid.uuid4()}"
+        alice_id = (await client.post(f"{cluster_nodes['a']}/api/users/create", json={"name": alice})).json()["id"]
+        bob_id = (await client.post(f"{cluster_nodes['a']}/api/users/create", json={"name": bob})).json()["id"]
+        for url in cluster_nodes.values():
+            listed = (await client.get(f"{url}/api/users/list")).json()["users"]
+            assert listed[alice] == alice_id and listed[bob] == bob_id
+        response = await client.post(f"{cluster_nodes['c']}/api/users/create", json={"name": bob})
+        assert response.status_code == 409
+
+        owner = ring.owner(bob_id)
+        other = next(node for node in cluster_nodes if node != owner)
+
+        # Connecting to the wrong node is refused with a redirect to the owner
+        ws_url = cluster_nodes[other].replace("http", "ws") + "/ws"
+        ws = await websockets.connect(ws_url, extra_headers={"x-user-id": bob_id})
+        with pytest.raises(websockets.exceptions.ConnectionClosed) as excinfo:
+            await asyncio.wait_for(ws.recv(), timeout=3)
+        assert excinfo.value.code == 4004
+        assert excinfo.value.reason == cluster_nodes[owner]
+
+        ws = await websockets.connect(cluster_nodes[owner].replace("http", "ws") + "/ws", extra_headers={"x-user-id": bob_id})
+        try:
+            assert json.loads(await asyncio.wait_for(ws.recv(), timeout=3))["type"] == "connection_status"
+
+            # A send through a non-owner node is forwarded and carries an owner hint
+            response = await client.post(
+                f"{cluster_nodes[other]}/api/messages/send",
+                json={"recipient_name": bob, "message": "via another node"},
+                headers={"x-user-id": alice_id},
+            )
+            assert response.status_code == 200
+            assert response.headers[OWNER_HEADER] == cluster_nodes[owner]
+            received = json.loads(await asyncio.wait_for(ws.recv(), timeout=3))
+            assert received["message"] == "via another node"
+            assert received["from"] == alice
+            assert received["message_id"] == response.json()["message_id"]
+
+            response = await client.post(
+                f"{cluster_nodes[owner]}/api/messages/send",
+                json={"recipient_name": bob, "message": "direct"},
+                headers={"x-user-id": alice_id},
+            )
+            assert response.status_code == 200
+            assert OWNER_HEADER not in response.headers
+        finally:
+            await ws.close()
+
+        # Internal endpoints reject callers without the cluster secret
+        response = await client.post(
+            f"{cluster_nodes['a']}/internal/users/replicate",
+            json={"name": "intruder", "id": "x"},
+            headers={"x-cohora-node": "b"},
+        )
+        assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_cluster_bulk_create_spans_owner_nodes(cluster_nodes):
+    ring = HashRing(sorted(cluster_nodes))
+    names = [f"cluster_bulk_{i}_{uuid.uuid4().hex[:6]}" for i in range(60)]
+    assert len({ring.owner(name) for name in names}) == len(cluster_nodes)
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{cluster_nodes['b']}/api/users/create_batch", json={"names": names + names[:1]})
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["name"] for r in results] == names + names[:1]
+        assert all(r["status"] == 201 for r in results[:-1]) and results[-1]["status"] == 409
+        for url in cluster_nodes.values():
+            listed = (await client.get(f"{url}/api/users/list")).json()["users"]
+            assert all(listed[r["name"]] == r["id"] for r in results[:-1])
+
+
+@pytest.mark.asyncio
+async def test_history_and_search_are_served_by_the_callers_owner(cluster_nodes):
+    ring = HashRing(sorted(cluster_nodes))
+    async with httpx.AsyncClient() as client:
+        users = {}
+        while len({ring.owner(user_id) for user_id in users.values()}) < 2:
+            name = f"cluster_hist_{uuid.uuid4().hex[:8]}"
+            users[name] = (await client.post(f"{cluster_nodes['a']}/api/users/create", json={"name": name})).json()["id"]
+        alice, bob = next((a, b) for a in users for b in users if ring.owner(users[a]) != ring.owner(users[b]))
+        bob_owner = cluster_nodes[ring.owner(users[bob])]
+        ws = await websockets.connect(bob_owner.replace("http", "ws") + "/ws", extra_headers={"x-user-id": users[bob]})
+        try:
+            await asyncio.wait_for(ws.recv(), timeout=3)
+            word = f"walrus{uuid.uuid4().hex}"
+            sent = await client.post(f"{bob_owner}/api/messages/send", json={"recipient_name": bob, "message": word},
+                                     headers={"x-user-id": users[alice]})
+            assert sent.status_code == 200
+        finally:
+            await ws.close()
+
+        alice_owner = ring.owner(users[alice])
+        elsewhere = next(node for node in cluster_nodes if node != alice_owner)
+        headers = {"x-user-id": users[alice]}
+        response = await client.get(f"{cluster_nodes[elsewhere]}/api/messages/history", params={"with_user": bob},
+                                    headers=headers)
+        assert response.status_code == 307 and response.headers[OWNER_HEADER] == cluster_nodes[alice_owner]
+
+        # The sender's owner got a copy of the message bob's owner delivered
+        await asyncio.sleep(0.2)
+        async with httpx.AsyncClient(follow_redirects=True) as following:
+            history = await following.get(f"{cluster_nodes[elsewhere]}/api/messages/history",
+                                          params={"with_user": bob}, headers=headers)
+            assert [m["message_id"] for m in history.json()["messages"]] == [sent.json()["message_id"]]
+            search = await following.get(f"{cluster_nodes[elsewhere]}/api/messages/search", params={"q": word},
+                                         headers=headers)
+            assert [r["with_user"] for r in search.json()["results"]] == [bob]
+
+
+def test_cluster_mode_requires_a_secret():
+    with pytest.raises(ValueError):
+        Cluster("a", {"a": "http://127.0.0.1:1"}, "")
+
+
+@pytest.mark.asyncio
+async def test_replication_needs_the_secret_and_never_rebinds():
+    # b is unreachable, so every replication to it fails
+    env = {"COHORA_NODE_ID": "a", "COHORA_CLUSTER_NODES": "a=http://127.0.0.1:1,b=http://127.0.0.1:2",
+           "COHORA_CLUSTER_SECRET": "test-secret"}
+    async with InProcessServer(env) as server:
+        name = next(f"local_{i}" for i in range(1000) if server.main.cluster.is_local(f"local_{i}"))
+        original_id = await server.create_user(name)
+        metrics = (await server.http.get("/api/metrics")).json()["counters"]
+        assert metrics["cluster_broadcast_failures"] == 1
+
+        rebind = {"users": {name: str(uuid.uuid4())}}
+        for headers in ({"x-cohora-node": "b"}, {"x-cohora-node": "b", "x-cohora-cluster-secret": "wrong"}):
+            response = await server.http.post("/internal/users/replicate_batch", json=rebind, headers=headers)
+            assert response.status_code == 403
+        peer = {"x-cohora-node": "b", "x-cohora-cluster-secret": "test-secret"}
+        assert (await server.http.post("/internal/users/replicate_batch", json=rebind, headers=peer)).status_code == 204
+        response = await server.http.post("/internal/users/replicate", json={"name": "thief", "id": original_id}, headers=peer)
+        assert response.status_code == 204
+
+        users = (await server.http.get("/api/users/list")).json()["users"]
+        assert users[name] == original_id and "thief" not in users
+        assert (await server.http.get("/api/metrics")).json()["counters"]["replication_conflicts"] == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_reports_peer_errors_of_any_shape():
+    env = {"COHORA_NODE_ID": "a", "COHORA_CLUSTER_NODES": "a=http://127.0.0.1:1,b=http://127.0.0.1:2",
+           "COHORA_CLUSTER_SECRET": "test-secret"}
+    async with InProcessServer(env) as server:
+        cluster = server.main.cluster
+        local = (f"peer_err_{i}" for i in range(10_000) if cluster.is_local(f"peer_err_{i}"))
+        sender_id = await server.create_user(next(local))
+        while True:
+            name = next(local)
+            if not cluster.is_local(await server.create_user(name)):
+                break  # Delivered by b, so sends to it are forwarded
+
+        replies = iter([
+            httpx.Response(500, text="upstream proxy error"),
+            httpx.Response(422, json={"detail": [{"loc": ["body"], "msg": "field required"}]}),
+        ])
+        await cluster.link("b").aclose()
+        cluster._links["b"] = httpx.AsyncClient(base_url=cluster.url("b"), transport=httpx.MockTransport(lambda _: next(replies)))
+        response = await server.http.post("/api/messages/send_batch", headers={"x-user-id": sender_id}, json={
+            "messages": [{"recipient_name": name, "message": "one"}, {"recipient_name": name, "message": "two"}]
+        })
+        assert response.status_code == 200
+        proxy_error, validation_error = response.json()["results"]
+        assert proxy_error["status"] == 500 and proxy_error["details"] == "upstream proxy error"
+        assert validation_error["status"] == 422 and "field required" in validation_error["details"]
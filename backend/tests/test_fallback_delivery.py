@@ -0,0 +1,92 @@
+import asyncio
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from chat_client import ChatClient
+from sessions import MailboxSession, SendLimits
+
+# Long-poll runs against the in-process `server` fixture; SSE needs real sockets, so the client test
+# starts its own server process (`server_process` in conftest.py).
+
+
+@pytest.mark.asyncio
+async def test_mailbox_take_is_woken_by_send_and_by_close():
+    mailbox = MailboxSession("u1", SendLimits(), 1013)
+    assert await mailbox.take(timeout=0.01) == []
+
+    started = time.perf_counter()
+    waiter = asyncio.create_task(mailbox.take(timeout=5))
+    await asyncio.sleep(0.05)
+    assert mailbox.idle_for() == 0.0
+    mailbox.send("a")
+    assert await waiter == ["a"]
+    assert time.perf_counter() - started < 1
+
+    for frame in "bcd":
+        mailbox.send(frame)
+    assert await mailbox.take(max_frames=2) == ["b", "c"]
+    assert await mailbox.take() == ["d"]
+    assert mailbox.queued_bytes == 0 and mailbox.queued_frames == 0
+
+    waiter = asyncio.create_task(mailbox.take(timeout=5))
+    await asyncio.sleep(0.01)
+    await mailbox.close(1000)
+    assert await asyncio.wait_for(waiter, timeout=1) == []
+    assert not mailbox.send("late")
+
+
+@pytest.mark.asyncio
+async def test_long_poll_receives_messages(server):
+    sender_id = await server.create_user("poll_sender")
+    recipient_id = await server.create_user("poll_recipient")
+
+    response = await server.http.get("/api/messages/poll", headers={"x-user-id": recipient_id})
+    (ack,) = response.json()["frames"]
+    assert ack["type"] == "connection_status"
+
+    poll = asyncio.create_task(server.http.get(
+        "/api/messages/poll", params={"timeout": 5}, headers={"x-user-id": recipient_id}
+    ))
+    await asyncio.sleep(0.1)
+    sent = await server.http.post(
+        "/api/messages/send",
+        json={"recipient_name": "poll_recipient", "message": "via poll"},
+        headers={"x-user-id": sender_id},
+    )
+    assert sent.status_code == 200
+    (frame,) = (await poll).json()["frames"]
+    assert frame["message"] == "via poll" and frame["from"] == "poll_sender"
+    assert frame["message_id"] == sent.json()["message_id"]
+
+    response = await server.http.post("/api/messages/subscribe_token", headers={"x-user-id": recipient_id})
+    token = response.json()["token"]
+    response = await server.http.get("/api/messages/poll", params={"timeout": 0.1, "token": token})
+    assert response.json()["frames"] == []
+    response = await server.http.get("/api/messages/poll", params={"token": "nobody"})
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_client_receives_over_sse_and_poll_transports(server_process):
+    base_url, ws_url = server_process.base_url, server_process.ws_url
+    for transport in ("sse", "poll"):
+        async with ChatClient(base_url, ws_url) as sender, ChatClient(base_url, ws_url) as receiver:
+            assert await sender.register(f"{transport}_sender_{uuid.uuid4()}")
+            receiver_name = f"{transport}_receiver_{uuid.uuid4()}"
+            assert await receiver.register(receiver_name)
+            received = asyncio.Queue()
+            receiver.on("message", received.put_nowait)
+            statuses = asyncio.Queue()
+            receiver.on("connection_status", statuses.put_nowait)
+            await receiver.start(transport)
+            await asyncio.wait_for(statuses.get(), timeout=3)
+
+            results = await sender.send_many([(receiver_name, f"{transport} {i}") for i in range(10)])
+            assert all(r and r["status"] == 200 for r in results)
+            messages = [await asyncio.wait_for(received.get(), timeout=3) for _ in range(10)]
+            assert sorted(m["message"] for m in messages) == sorted(f"{transport} {i}" for i in range(10))
@@ -0,0 +1,78 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from history import HistoryStore
+
+
+def test_history_pages_backwards_with_cursor():
+    store = HistoryStore()
+    key = store.direct_key("bob", "alice")
+    assert key == store.direct_key("alice", "bob")
+    for i in range(25):
+        store.append(key, f"id{i}", "alice", f"msg {i}", timestamp=float(i))
+    store.append(store.direct_key("alice", "carol"), "other", "alice", "elsewhere")
+
+    page = store.page(key, limit=10)
+    assert [e.message for e in page.entries] == [f"msg {i}" for i in range(15, 25)]
+    page = store.page(key, limit=10, before=page.next_cursor)
+    assert [e.message for e in page.entries] == [f"msg {i}" for i in range(5, 15)]
+    page = store.page(key, limit=10, before=page.next_cursor)
+    assert [e.message for e in page.entries] == [f"msg {i}" for i in range(5)]
+    assert page.next_cursor is None
+    assert len(store) == 26
+
+
+def test_history_time_range_and_clock_skew():
+    store = HistoryStore()
+    key = store.room_key("deploys")
+    for i in range(10):
+        store.append(key, f"id{i}", "alice", f"msg {i}", timestamp=float(i))
+    page = store.page(key, since=3.0, until=6.0)
+    assert [e.message for e in page.entries] == ["msg 3", "msg 4", "msg 5", "msg 6"]
+    page = store.page(key, limit=2, since=3.0, until=6.0)
+    assert [e.message for e in page.entries] == ["msg 5", "msg 6"]
+    assert page.next_cursor is not None
+
+    # A timestamp earlier than the last one is clamped so the index stays sorted
+    entry = store.append(key, "late", "alice", "late", timestamp=1.0)
+    assert entry.timestamp == 9.0
+    assert store.page(HistoryStore.room_key("missing")).entries == []
+
+
+@pytest.mark.asyncio
+async def test_history_endpoint_returns_delivered_messages(server):
+    # In-process `server` fixture from conftest.py
+    alice_id = await server.create_user("alice")
+    bob_id = await server.create_user("bob")
+    await server.websocket(bob_id)
+    for i in range(5):
+        response = await server.http.post(
+            "/api/messages/send",
+            json={"recipient_name": "bob", "message": f"note {i}"},
+            headers={"x-user-id": alice_id},
+        )
+        assert response.status_code == 200
+
+    response = await server.http.get(
+        "/api/messages/history",
+        params={"with_user": "alice", "limit": 3},
+        headers={"x-user-id": bob_id},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [m["message"] for m in data["messages"]] == ["note 2", "note 3", "note 4"]
+    assert all(m["from_user"] == "alice" for m in data["messages"])
+
+    response = await server.http.get(
+        "/api/messages/history",
+        params={"with_user": "alice", "before": data["next_cursor"]},
+        headers={"x-user-id": bob_id},
+    )
+    assert [m["message"] for m in response.json()["messages"]] == ["note 0", "note 1"]
+    assert response.json()["next_cursor"] is None
+
+    response = await server.http.get("/api/messages/history", headers={"x-user-id": bob_id})
+    assert response.status_code == 400
@@ -0,0 +1,79 @@
+import asyncio
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from dedup import IdempotencyCache
+
+
+def test_cache_is_bounded_by_size_and_age():
+    cache = IdempotencyCache(max_entries=2, ttl=10)
+    cache.put("a", 1, now=0)
+    cache.put("b", 2, now=1)
+    assert cache.get("a", now=2) == 1  # Now most recently used
+    cache.put("c", 3, now=3)
+    assert cache.get("b", now=3) is None
+    assert cache.get("a", now=3) == 1
+    assert cache.get("a", now=11) is None  # Expired 10 s after it was stored
+    cache.put("d", 4, now=14)  # Evicts the expired "c" as well
+    assert len(cache) == 1 and cache.get("d", now=14) == 4
+
+
+@pytest.mark.asyncio
+async def test_repeated_key_returns_original_response_without_redelivery(server):
+    # In-process `server` fixture from conftest.py
+    sender_id = await server.create_user("idem_sender")
+    other_sender_id = await server.create_user("idem_other")
+    recipient_id = await server.create_user("idem_recipient")
+    ws = await server.websocket(recipient_id)
+    key = uuid.uuid4().hex
+    send = {"recipient_name": "idem_recipient", "message": "exactly once"}
+
+    first = await server.http.post("/api/messages/send", json=send,
+                                   headers={"x-user-id": sender_id, "Idempotency-Key": key})
+    repeat = await server.http.post("/api/messages/send", json=send,
+                                    headers={"x-user-id": sender_id, "Idempotency-Key": key})
+    assert first.status_code == repeat.status_code == 200
+    assert repeat.json() == first.json()
+    assert repeat.headers["idempotent-replayed"] == "true"
+
+    # Keys are scoped to the sender
+    other = await server.http.post("/api/messages/send", json=send,
+                                   headers={"x-user-id": other_sender_id, "Idempotency-Key": key})
+    assert other.json()["message_id"] != first.json()["message_id"]
+
+    # Batch items carry their own keys, checked against the same cache
+    batch = await server.http.post("/api/messages/send_batch", headers={"x-user-id": sender_id}, json={
+        "messages": [dict(send, idempotency_key=key), dict(send, idempotency_key="fresh-" + key)]
+    })
+    replayed, fresh = batch.json()["results"]
+    assert replayed["message_id"] == first.json()["message_id"]
+    assert fresh["status"] == 200 and fresh["message_id"] != replayed["message_id"]
+
+    frames = []
+    while True:
+        try:
+            frames.append(await ws.recv_json(timeout=0.3))
+        except asyncio.TimeoutError:
+            break
+    assert len(frames) == 3
+    assert [f["message_id"] for f in frames].count(first.json()["message_id"]) == 1
+    await ws.close()
+
+    # The original answer is replayed even after the recipient went offline
+    await asyncio.sleep(0.1)
+    repeat = await server.http.post("/api/messages/send", json=send,
+                                    headers={"x-user-id": sender_id, "Idempotency-Key": key})
+    assert repeat.status_code == 200 and repeat.json() == first.json()
+
+    # The same key on a different message is refused, not answered with the first message's response
+    changed = await server.http.post("/api/messages/send", json=dict(send, message="something else"),
+                                     headers={"x-user-id": sender_id, "Idempotency-Key": key})
+    assert changed.status_code == 422 and changed.json()["detail"]["code"] == 422
+
+    too_long = await server.http.post("/api/messages/send", json=send,
+                                      headers={"x-user-id": sender_id, "Idempotency-Key": "k" * 256})
+    assert too_long.status_code == 400
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from harness import InProcessServer, WebSocketClosed
+
+# These tests use the in-process `server` fixture from conftest.py and need no running server.
+
+
+@pytest.mark.asyncio
+async def test_each_server_starts_empty(server):
+    await server.create_user("alice")
+    assert list((await server.http.get("/api/users/list")).json()["users"]) == ["alice"]
+    async with InProcessServer() as other:
+        assert (await other.http.get("/api/users/list")).json()["users"] == {}
+        assert (await other.http.post("/api/users/create", json={"name": "alice"})).status_code == 201
+
+
+@pytest.mark.asyncio
+async def test_message_reaches_in_memory_websocket(server):
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    ws = await server.websocket(bob)
+    response = await server.http.post(
+        "/api/messages/send", json={"recipient_name": "bob", "message": "hi"}, headers={"x-user-id": alice}
+    )
+    assert response.status_code == 200
+    frame = await ws.recv_json()
+    assert frame["from"] == "alice" and frame["message"] == "hi"
+    assert frame["message_id"] == response.json()["message_id"]
+
+    await ws.send("")
+    assert (await ws.recv_json())["type"] == "heartbeat"
+
+
+@pytest.mark.asyncio
+async def test_websocket_close_codes(server):
+    with pytest.raises(WebSocketClosed) as excinfo:
+        ws = await server.websocket("not-a-user", ack=False)
+        await ws.recv()
+    assert excinfo.value.code == 1008
+
+    bob = await server.create_user("bob")
+    ws = await server.websocket(bob)
+    assert (await server.http.delete("/api/users/bob", headers={"x-user-id": bob})).status_code == 204
+    with pytest.raises(WebSocketClosed) as excinfo:
+        await ws.recv()
+    assert excinfo.value.code == 4003
+
+
+@pytest.mark.asyncio
+async def test_long_poll_and_metrics_in_process(server):
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    poll = asyncio.create_task(server.http.get("/api/messages/poll?timeout=5", headers={"x-user-id": bob}))
+    await asyncio.sleep(0.05)
+    frames = (await poll).json()["frames"]  # The connection_status frame
+    assert frames[0]["type"] == "connection_status"
+
+    poll = asyncio.create_task(server.http.get("/api/messages/poll?timeout=5", headers={"x-user-id": bob}))
+    await asyncio.sleep(0.05)
+    await server.http.post("/api/messages/send", json={"recipient_name": "bob", "message": "queued"},
+                           headers={"x-user-id": alice})
+    assert [f["message"] for f in (await poll).json()["frames"]] == ["queued"]
+    assert (await server.http.get("/api/metrics")).json()["gauges"]["connections"] == 1
+
+
+@pytest.mark.asyncio
+async def test_replaced_websocket_is_closed_and_token_subscribes(server):
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    ws = await server.websocket(bob)
+
+    token = (await server.http.post("/api/messages/subscribe_token", headers={"x-user-id": bob})).json()["token"]
+    frames = (await server.http.get("/api/messages/poll", params={"timeout": 0, "token": token})).json()["frames"]
+    assert frames[0]["type"] == "connection_status"
+    with pytest.raises(WebSocketClosed) as excinfo:
+        await ws.recv()
+    assert excinfo.value.code == 4005  # Not left open and silently starved
+
+    await server.http.post("/api/messages/send", json={"recipient_name": "bob", "message": "hi"},
+                           headers={"x-user-id": alice})
+    (frame,) = (await server.http.get("/api/messages/poll", params={"token": token})).json()["frames"]
+    assert frame["message"] == "hi"
+    assert (await server.http.get("/api/messages/poll", params={"user_id": bob})).status_code == 401
+    assert (await server.http.get("/api/messages/poll", params={"token": "forged"})).status_code == 401
+
+
+def test_access_log_hides_subscribe_credentials(server):
+    record = logging.LogRecord("uvicorn.access", logging.INFO, "", 0, '%s - "%s %s HTTP/%s" %d',
+                               ("127.0.0.1:5000", "GET", "/api/messages/events?token=n1.secret&x=1", "1.1", 200), None)
+    server.main.RedactCredentials().filter(record)
+    assert "secret" not in record.getMessage() and "&x=1" in record.getMessage()
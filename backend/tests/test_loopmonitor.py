@@ -0,0 +1,46 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import metrics
+from loopmonitor import LoopMonitor
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_monitor_captures_stack_of_blocking_call():
+    before = metrics.counters["loop_slow_callbacks"]
+    monitor = LoopMonitor(interval=0.02, slow_threshold=0.1)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.1)
+        block_the_loop(0.3)
+        await asyncio.sleep(0.1)
+    finally:
+        monitor.stop()
+
+    (stall,) = monitor.recent_slow_callbacks()
+    assert any("block_the_loop" in line for line in stall["stack"])
+    assert stall["blocked_ms"] >= 250
+    assert monitor.lag_stats()["max_ms"] >= 250
+    assert metrics.counters["loop_slow_callbacks"] == before + 1
+
+
+@pytest.mark.asyncio
+async def test_monitor_quiet_loop_has_no_stalls():
+    monitor = LoopMonitor(interval=0.01, slow_threshold=0.1)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.2)
+    finally:
+        monitor.stop()
+    assert monitor.recent_slow_callbacks() == []
+    stats = monitor.lag_stats()
+    assert stats["p50_ms"] < 50
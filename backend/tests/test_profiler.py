@@ -0,0 +1,93 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from harness import InProcessServer
+from profiler import IDLE, EndpointLabels, SamplingProfiler
+
+DEBUG_TOKEN = "profile-test-token"
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_profiler_attributes_samples_to_labeled_frame():
+    labels = EndpointLabels({"/busy": "busy_endpoint"})
+    runner = labels.runners["/busy"]
+    assert runner.__code__.co_name == "endpoint[busy_endpoint]"
+
+    async def app(scope, receive, send):
+        busy(0.3)
+
+    worker = threading.Thread(target=lambda: asyncio.run(runner(app, {}, None, None)))
+    worker.start()
+    profiler = SamplingProfiler(worker.ident, labels.codes, interval=0.002)
+    profiler.run(0.2)
+    worker.join()
+
+    assert profiler.samples > 10
+    assert profiler.endpoints["busy_endpoint"] >= profiler.samples * 0.8
+    assert "endpoint[busy_endpoint]" in profiler.collapsed()
+    assert "test_profiler.py:busy" in profiler.collapsed()
+    summary = profiler.summary()
+    assert summary["endpoints"]["busy_endpoint"]["time_ms"] > 0
+    assert IDLE not in summary["endpoints"]
+
+
+def test_samples_in_c_level_loop_wait_count_as_idle():
+    # uvloop polls in C, so asyncio's Runner.run is the innermost Python frame while it waits
+    namespace = {"time": time}
+    exec(compile("def run(seconds):\n    time.sleep(seconds)\n", "/lib/asyncio/runners.py", "exec"), namespace)
+
+    def handler():
+        namespace["run"](0.3)
+
+    worker = threading.Thread(target=handler)
+    worker.start()
+    profiler = SamplingProfiler(worker.ident, {handler.__code__: "stale_label"}, interval=0.002)
+    profiler.run(0.1)
+    worker.join()
+    assert profiler.samples > 10 and profiler.endpoints[IDLE] == profiler.samples
+
+    profiler = SamplingProfiler(worker.ident)  # The thread is gone: no Python frame at all
+    profiler._sample()
+    assert profiler.endpoints == {IDLE: 1}
+
+
+@pytest.mark.asyncio
+async def test_profile_endpoint_reports_list_users_cpu():
+    async with InProcessServer({"COHORA_DEBUG_TOKEN": DEBUG_TOKEN}) as server:
+        client = server.http
+        await client.post("/api/users/create_batch", json={"names": [f"profiled_{i}" for i in range(20_000)]})
+        assert (await client.get("/debug/profile", params={"seconds": 0.1})).status_code == 403
+        headers = {"x-debug-token": DEBUG_TOKEN}
+
+        async def load():
+            while True:
+                await client.get("/api/users/list")
+                await asyncio.sleep(0)
+
+        load_task = asyncio.create_task(load())
+        try:
+            response = await client.get("/debug/profile", params={"seconds": 1, "interval_ms": 2}, headers=headers)
+        finally:
+            load_task.cancel()
+            await asyncio.gather(load_task, return_exceptions=True)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["samples"] > 50
+        assert data["endpoints"]["list_users"]["samples"] > 0
+        assert "endpoint[list_users]" in data["collapsed"]
+
+        response = await client.get("/debug/profile", params={"seconds": 0.2, "format": "collapsed"}, headers=headers)
+        assert response.headers["content-type"].startswith("text/plain")
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in response.text.splitlines())
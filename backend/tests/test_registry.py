@@ -0,0 +1,70 @@
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from registry import UserRegistry, format_id, parse_id
+
+
+def test_ids_round_trip_through_raw_bytes():
+    user_id = str(uuid.uuid4())
+    raw = parse_id(user_id)
+    assert raw == uuid.UUID(user_id).bytes
+    assert format_id(raw) == user_id
+
+
+@pytest.mark.parametrize("user_id", [
+    None, "", "alice", str(uuid.uuid4()).upper(), str(uuid.uuid4()).replace("-", ""),
+    "0123456789abcdef0123456789abcdef----", "g" * 8 + "-0000-0000-0000-" + "0" * 12,
+])
+def test_non_canonical_ids_are_rejected(user_id):
+    assert parse_id(user_id) is None
+    assert UserRegistry().name_of(user_id) is None
+
+
+def test_registry_maps_names_and_ids_both_ways():
+    registry = UserRegistry()
+    alice, bob = str(uuid.uuid4()), str(uuid.uuid4())
+    registry.add("alice", alice)
+    registry.setdefault("bob", bob)
+    registry.setdefault("bob", str(uuid.uuid4()))  # Already registered: ignored
+    registry.setdefault("mallory", alice)  # ID already taken: ignored
+
+    assert len(registry) == 2 and "alice" in registry and "mallory" not in registry
+    assert registry.id_of("bob") == bob
+    assert registry.name_of(alice) == "alice"
+    assert registry.id_of("carol") is None
+    assert dict(registry.items()) == {"alice": alice, "bob": bob}
+    with pytest.raises(ValueError):
+        registry.add("carol", "not-an-id")
+    for name, user_id in (("alice", str(uuid.uuid4())), ("carol", alice)):
+        with pytest.raises(ValueError):
+            registry.add(name, user_id)  # Never rebinds: the old ID would still resolve
+    assert registry.name_of(alice) == "alice" and len(registry) == 2
+
+
+def test_add_new_skips_taken_names_in_one_pass():
+    registry = UserRegistry()
+    registry.add("alice", str(uuid.uuid4()))
+    ids = registry.add_new(["bob", "alice", "carol", "bob"])
+    assert ids[1] is None and ids[3] is None
+    assert registry.id_of("bob") == ids[0] and registry.name_of(ids[2]) == "carol"
+    assert len(registry) == 3
+
+
+def test_idle_users_come_out_least_recently_seen_first():
+    registry = UserRegistry(track_seen=True)
+    ids = registry.add_new(["a", "b", "c"])
+    now = 1e9  # Later than every insertion time
+    registry.touch(ids[0], now)
+    assert registry.idle_since(now, 10) == ids[1:]
+    assert registry.idle_since(now, 1) == ids[1:2]
+    assert registry.idle_since(now + 1, 10) == [ids[1], ids[2], ids[0]]
+
+    assert registry.remove(ids[1]) == "b" and registry.remove(ids[1]) is None
+    assert "b" not in registry and registry.idle_since(now + 1, 10) == [ids[2], ids[0]]
+    registry.untrack(ids[2])
+    assert registry.idle_since(now + 1, 10) == [ids[0]] and "c" in registry
+    assert UserRegistry().idle_since(now, 10) == []
@@ -0,0 +1,84 @@
+import pytest
+
+# These tests use the in-process `server` fixture from conftest.py and need no running server.
+
+
+@pytest.mark.asyncio
+async def test_room_message_fans_out_to_online_members(server):
+    names = [f"room_member_{i}" for i in range(4)]
+    ids = [await server.create_user(name) for name in names]
+
+    response = await server.http.post("/api/rooms/create", json={"name": "general"}, headers={"x-user-id": ids[0]})
+    assert response.status_code == 201
+    for user_id in ids[1:]:
+        response = await server.http.post("/api/rooms/general/join", headers={"x-user-id": user_id})
+        assert response.status_code == 200
+    assert sorted(response.json()["members"]) == sorted(names)
+
+    # The last member stays offline
+    sockets = [await server.websocket(user_id) for user_id in ids[:3]]
+    response = await server.http.post(
+        "/api/rooms/general/send",
+        json={"message": "hello room"},
+        headers={"x-user-id": ids[0]},
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["delivered"] == 2
+    assert data["offline"] == 1
+
+    for ws in sockets[1:]:
+        received = await ws.recv_json(timeout=3)
+        assert received["from"] == names[0]
+        assert received["room"] == "general"
+        assert received["message"] == "hello room"
+        assert received["message_id"] == data["message_id"]
+
+
+@pytest.mark.asyncio
+async def test_room_membership_errors(server):
+    owner_id = await server.create_user("room_owner")
+    outsider_id = await server.create_user("room_outsider")
+
+    response = await server.http.post("/api/rooms/create", json={"name": "general"}, headers={"x-user-id": owner_id})
+    assert response.status_code == 201
+    response = await server.http.post("/api/rooms/create", json={"name": "general"}, headers={"x-user-id": owner_id})
+    assert response.status_code == 409
+
+    response = await server.http.post("/api/rooms/general/send", json={"message": "hi"}, headers={"x-user-id": outsider_id})
+    assert response.status_code == 403
+
+    response = await server.http.post("/api/rooms/no_such_room/join", headers={"x-user-id": outsider_id})
+    assert response.status_code == 404
+
+    await server.http.post("/api/rooms/general/join", headers={"x-user-id": outsider_id})
+    response = await server.http.post("/api/rooms/general/leave", headers={"x-user-id": outsider_id})
+    assert response.status_code == 200
+    response = await server.http.post("/api/rooms/general/send", json={"message": "hi"}, headers={"x-user-id": outsider_id})
+    assert response.status_code == 403
+
+    response = await server.http.post("/api/rooms/general/join")
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_empty_rooms_are_deleted_with_their_history(server):
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    await server.http.post("/api/rooms/create", json={"name": "general"}, headers={"x-user-id": alice})
+    await server.http.post("/api/rooms/general/send", json={"message": "secret plans"}, headers={"x-user-id": alice})
+    response = await server.http.post("/api/rooms/general/leave", headers={"x-user-id": alice})
+    assert response.json()["members"] == []
+    assert "general" not in server.main.rooms
+    assert (await server.http.post("/api/rooms/general/join", headers={"x-user-id": bob})).status_code == 404
+
+    # Whoever takes the name next starts with an empty history
+    await server.http.post("/api/rooms/create", json={"name": "general"}, headers={"x-user-id": bob})
+    history = await server.http.get("/api/messages/history", params={"room": "general"}, headers={"x-user-id": bob})
+    assert history.json()["messages"] == []
+    search = await server.http.get("/api/messages/search", params={"q": "secret"}, headers={"x-user-id": bob})
+    assert search.json()["results"] == []
+
+    # A room emptied by its last member being deleted goes too
+    assert (await server.http.delete("/api/users/bob", headers={"x-user-id": bob})).status_code == 204
+    assert server.main.rooms == {}
@@ -0,0 +1,129 @@
+import asyncio
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from chat_client import ChatClient, RpcError
+from rpc import RpcRouter
+
+# ChatClient needs real sockets, so the tests that use it start their own server process (`server_process` in conftest.py).
+
+
+@pytest.mark.asyncio
+async def test_router_resolves_expires_and_drops():
+    router = RpcRouter()
+    replies = []
+
+    call = router.open("alice", "bob", lambda body, error: replies.append((body, error)), timeout=5)
+    assert not router.resolve(call.call_id, "mallory", "forged")
+    assert router.resolve(call.call_id, "bob", "pong")
+    assert not router.resolve(call.call_id, "bob", "again")
+
+    router.open("alice", "bob", lambda body, error: replies.append((body, error)), timeout=0.01)
+    await asyncio.sleep(0.05)
+
+    router.open("alice", "bob", lambda body, error: replies.append((body, error)), timeout=5)
+    router.open("bob", "alice", lambda body, error: replies.append((body, error)), timeout=5)
+    router.drop_user("bob")
+
+    assert [error and error["code"] for _, error in replies] == [None, 504, 503]
+    assert replies[0][0] == "pong"
+    assert router.pending == {} and router._by_user == {}
+
+
+@pytest.mark.asyncio
+async def test_call_round_trip_over_websocket_and_http(server_process):
+    base_url, ws_url = server_process.base_url, server_process.ws_url
+    async with ChatClient(base_url, ws_url) as caller, ChatClient(base_url, ws_url) as callee:
+        assert await caller.register(f"rpc_caller_{uuid.uuid4()}")
+        callee_name = f"rpc_callee_{uuid.uuid4()}"
+        assert await callee.register(callee_name)
+
+        async def handler(caller_name, body):
+            if body == "fail":
+                raise ValueError("no such tool")
+            return {"echo": body, "caller": caller_name}
+
+        callee.on_call(handler)
+        await caller.start()
+        await callee.start()
+
+        assert await caller.call(callee_name, "ping") == {"echo": "ping", "caller": caller.username}
+        results = await asyncio.gather(*(caller.call(callee_name, i) for i in range(20)))
+        assert [r["echo"] for r in results] == list(range(20))
+
+        with pytest.raises(RpcError) as failed:
+            await caller.call(callee_name, "fail")
+        assert failed.value.code == 500
+
+        response = await caller.http.post(
+            "/api/rpc/call",
+            json={"recipient_name": callee_name, "body": "over http"},
+            headers={"x-user-id": caller.user_id},
+        )
+        assert response.status_code == 200
+        assert response.json()["body"]["echo"] == "over http"
+
+
+@pytest.mark.asyncio
+async def test_call_times_out_and_offline_callee_fails_fast(server_process):
+    base_url, ws_url = server_process.base_url, server_process.ws_url
+    async with ChatClient(base_url, ws_url) as caller, ChatClient(base_url, ws_url) as callee:
+        assert await caller.register(f"rpc_caller_{uuid.uuid4()}")
+        callee_name = f"rpc_silent_{uuid.uuid4()}"
+        assert await callee.register(callee_name)
+        await caller.start()
+
+        with pytest.raises(RpcError) as offline:
+            await caller.call(callee_name, "anyone?")
+        assert offline.value.code == 404
+
+        await callee.start()  # Connected, but never answers
+        with pytest.raises(RpcError) as timed_out:
+            await caller.call(callee_name, "anyone?", timeout=0.2)
+        assert timed_out.value.code == 504
+
+        metrics = (await caller.http.get("/api/metrics")).json()
+        assert metrics["counters"]["rpc_timeouts"] >= 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error, expected", [
+    ({"message": "no code"}, (500, "no code")),
+    ({"code": "oops", "message": "bad code"}, (500, "bad code")),
+    ({"code": 422}, (422, "Call failed")),
+    ({"code": 7, "message": "odd"}, (502, "odd")),
+    ("plain string", (500, "plain string")),
+])
+async def test_malformed_callee_errors_are_normalized(server, error, expected):
+    # In-process `server` fixture from conftest.py
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    ws = await server.websocket(bob)
+    call = asyncio.create_task(server.http.post(
+        "/api/rpc/call", json={"recipient_name": "bob", "timeout_ms": 2000}, headers={"x-user-id": alice}
+    ))
+    request = await ws.recv_json()
+    await ws.send_json({"type": "rpc_response", "call_id": request["call_id"], "error": error})
+    response = await call
+    status_code, message = expected
+    assert response.status_code == status_code
+    assert response.json()["detail"]["message"] == message
+
+
+@pytest.mark.asyncio
+async def test_calls_and_streams_refuse_recipients_without_a_websocket(server):
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    await server.http.get("/api/messages/poll", params={"timeout": 0}, headers={"x-user-id": bob})
+
+    response = await server.http.post("/api/rpc/call", json={"recipient_name": "bob"}, headers={"x-user-id": alice})
+    assert response.status_code == 409
+
+    ws = await server.websocket(alice)
+    await ws.send_json({"type": "stream_open", "stream_id": "s1", "to": "bob"})
+    error = await ws.recv_json()
+    assert error["type"] == "stream_error" and error["error"]["code"] == 409
@@ -0,0 +1,77 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from history import HistoryStore
+from search import SearchIndex
+
+
+def build_index():
+    store, index = HistoryStore(), SearchIndex()
+    messages = [
+        ("alice", "bob", "the deploy is scheduled for friday", 1.0),
+        ("bob", "alice", "deploy went fine, no rollback needed", 2.0),
+        ("bob", "carol", "deploy deploy deploy, the deploy failed", 3.0),
+        ("carol", "alice", "lunch tomorrow?", 4.0),
+    ]
+    for i, (sender, recipient, text, ts) in enumerate(messages):
+        index.add(store.append(store.direct_key(sender, recipient), f"m{i}", sender, text, timestamp=ts))
+    return store, index
+
+
+def test_search_ranks_and_filters():
+    store, index = build_index()
+    hits = index.search("deploy")
+    assert [h.entry.message_id for h in hits][0] == "m2"  # highest term frequency
+    assert {h.entry.message_id for h in hits} == {"m0", "m1", "m2"}
+
+    assert [h.entry.message_id for h in index.search("deploy rollback")] == ["m1"]
+    assert {h.entry.message_id for h in index.search("Deploy", participant="alice")} == {"m0", "m1"}
+    assert {h.entry.message_id for h in index.search("deploy", since=1.5, until=2.5)} == {"m1"}
+    carol = [store.conversations[key] for key in store.direct_conversations("carol")]
+    assert [h.entry.message_id for h in index.search("deploy", scope=carol)] == ["m2"]
+    assert index.search("deploy", scope=carol, until=2.5) == []
+    assert index.search("lunch deploy", scope=carol) == []
+    # A scope bigger than the rarest term's postings takes the intersection path instead
+    everyone = list(store.conversations.values())
+    assert {h.entry.message_id for h in index.search("rollback", scope=everyone)} == {"m1"}
+    assert index.search("missingword") == []
+    assert len(index.search("deploy", limit=1)) == 1
+
+
+def test_search_snippet_centers_on_match():
+    index = SearchIndex()
+    store = HistoryStore()
+    text = "x" * 200 + " what about the deploy " + "y" * 200
+    index.add(store.append(store.direct_key("a", "b"), "m", "a", text))
+    (hit,) = index.search("deploy")
+    assert "deploy" in hit.snippet
+    assert hit.snippet.startswith("…") and hit.snippet.endswith("…")
+    assert len(hit.snippet) < len(text)
+
+
+@pytest.mark.asyncio
+async def test_search_endpoint_is_incremental_and_scoped(server):
+    # In-process `server` fixture from conftest.py
+    alice_id = await server.create_user("alice")
+    bob_id = await server.create_user("bob")
+    eve_id = await server.create_user("eve")
+    await server.websocket(bob_id)
+    response = await server.http.post(
+        "/api/messages/send",
+        json={"recipient_name": "bob", "message": "the zebra deploy is done"},
+        headers={"x-user-id": alice_id},
+    )
+    assert response.status_code == 200
+
+    response = await server.http.get("/api/messages/search", params={"q": "zebra"}, headers={"x-user-id": bob_id})
+    (result,) = response.json()["results"]
+    assert result["from_user"] == "alice"
+    assert result["with_user"] == "alice"
+    assert "zebra" in result["snippet"]
+
+    # Other users cannot see the conversation
+    response = await server.http.get("/api/messages/search", params={"q": "zebra"}, headers={"x-user-id": eve_id})
+    assert response.json()["results"] == []
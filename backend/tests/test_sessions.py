@@ -0,0 +1,148 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import metrics
+from sessions import SendLimits, Session
+
+TRY_AGAIN_LATER = 1013
+
+
+class StalledWebSocket:
+    """Peer that never reads: every send blocks until released"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+
+    async def send_text(self, payload):
+        await self.release.wait()
+        self.sent.append(payload)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = (code, reason)
+
+
+@pytest.mark.asyncio
+async def test_session_drains_below_low_watermark():
+    ws = StalledWebSocket()
+    limits = SendLimits(high_watermark_bytes=100, low_watermark_bytes=20, high_watermark_frames=50,
+                        low_watermark_frames=10, hard_limit_bytes=1000, grace_seconds=60)
+    session = Session("u1", ws, limits, TRY_AGAIN_LATER)
+    for _ in range(12):
+        assert session.send("x" * 10)
+    assert session.queued_frames == 12
+    assert session.over_limit_since is not None
+
+    ws.release.set()
+    await asyncio.sleep(0.05)
+    assert session.queued_bytes == 0 and session.queued_frames == 0
+    assert session.over_limit_since is None
+    assert len(ws.sent) == 12
+    await session.close(1000)
+
+
+@pytest.mark.asyncio
+async def test_session_evicted_after_grace_period():
+    before = metrics.counters["slow_consumer_evictions"]
+    ws = StalledWebSocket()
+    limits = SendLimits(high_watermark_bytes=100, low_watermark_bytes=20, hard_limit_bytes=10_000, grace_seconds=0.05)
+    session = Session("u2", ws, limits, TRY_AGAIN_LATER)
+    for _ in range(20):
+        session.send("x" * 10)
+    assert not session.closed
+
+    await asyncio.sleep(0.06)
+    session.check_slow()
+    await asyncio.sleep(0.01)
+    assert session.closed
+    assert session.queued_bytes == 0
+    assert ws.closed_with[0] == TRY_AGAIN_LATER
+    assert "slow consumer" in ws.closed_with[1]
+    assert not session.send("late")
+    assert metrics.counters["slow_consumer_evictions"] == before + 1
+
+
+@pytest.mark.asyncio
+async def test_session_evicted_immediately_over_hard_limit():
+    ws = StalledWebSocket()
+    limits = SendLimits(high_watermark_bytes=100, low_watermark_bytes=20, hard_limit_bytes=500, grace_seconds=60)
+    session = Session("u3", ws, limits, TRY_AGAIN_LATER)
+    results = [session.send("x" * 100) for _ in range(6)]
+    assert results == [True] * 5 + [False]
+    await asyncio.sleep(0.01)
+    assert ws.closed_with == (TRY_AGAIN_LATER, "send buffer limit exceeded")
+
+
+class SteppedWebSocket(StalledWebSocket):
+    """Peer that accepts one write per ``step()``"""
+
+    def __init__(self):
+        super().__init__()
+        self.steps = asyncio.Semaphore(0)
+
+    async def send_text(self, payload):
+        await self.steps.acquire()
+        self.sent.append(payload)
+
+    async def step(self, writes=1):
+        for _ in range(writes):
+            self.steps.release()
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_control_frames_overtake_queued_bulk_frames():
+    ws = SteppedWebSocket()
+    session = Session("u1", ws, SendLimits(), TRY_AGAIN_LATER)
+    for i in range(3):
+        session.send(f"bulk{i}")
+    await asyncio.sleep(0.01)  # The writer is now blocked writing bulk0
+    session.send("ack", control=True)
+    await ws.step(4)
+    assert ws.sent == ["bulk0", "ack", "bulk1", "bulk2"]
+    await session.close(1000)
+
+
+@pytest.mark.asyncio
+async def test_large_frames_are_fragmented_around_control_frames():
+    ws = SteppedWebSocket()
+    session = Session("u1", ws, SendLimits(), TRY_AGAIN_LATER, fragment_size=10)
+    payload = '{"message": "' + "y" * 30 + '"}'
+    session.send(payload)
+    session.send("small")
+    await asyncio.sleep(0.01)  # The writer is now blocked writing the first piece
+    session.send("heartbeat", control=True)
+    await ws.step(7)
+
+    fragments = [json.loads(sent) for sent in ws.sent if sent.startswith('{"type": "fragment"')]
+    assert len(fragments) == 5 and [f["final"] for f in fragments] == [False] * 4 + [True]
+    assert "".join(f["data"] for f in fragments) == payload
+    assert ws.sent.index("heartbeat") == 1  # Between the first and second pieces
+    assert ws.sent[-1] == "small"
+    await session.close(1000)
+
+
+@pytest.mark.asyncio
+async def test_fragments_only_for_clients_that_ask(server):
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    plain = await server.websocket(alice)
+    fragmenting = await server.websocket(bob, headers={"x-accept-fragments": "1"})
+    message = "z" * 200_000
+    for name in ("alice", "bob"):
+        await server.http.post("/api/messages/send", json={"recipient_name": name, "message": message},
+                               headers={"x-user-id": alice})
+
+    assert (await plain.recv_json())["message"] == message
+    pieces = []
+    while not pieces or not pieces[-1]["final"]:
+        pieces.append(await fragmenting.recv_json())
+    assert len(pieces) == 4 and all(p["type"] == "fragment" for p in pieces)
+    assert json.loads("".join(p["data"] for p in pieces))["message"] == message
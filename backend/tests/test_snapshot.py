@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import struct
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import snapshot
+from harness import InProcessServer
+from soak import ServerProcess
+
+
+def test_snapshot_round_trip_and_damage(tmp_path):
+    path = str(tmp_path / "state.bin")
+    names = ["alice", "bøb", "\ud800odd", ""]
+    ids = [uuid.uuid4().bytes for _ in names]
+    frames = [(ids[1], 0.0, '{"message": "hé"}'), (ids[1], 1e10, "second")]
+    old_umask = os.umask(0o022)
+    try:
+        snapshot.write(path, names, ids, frames)
+    finally:
+        os.umask(old_umask)
+    assert os.stat(path).st_mode & 0o777 == 0o600  # User IDs are credentials
+
+    saved = snapshot.load(path)
+    assert (saved.names, saved.ids, saved.frames) == (names, ids, frames)
+    assert saved.created_at == pytest.approx(time.time(), abs=5)
+
+    data = bytearray(Path(path).read_bytes())
+    data[-3] ^= 0xFF
+    Path(path).write_bytes(data)
+    with pytest.raises(snapshot.SnapshotError, match="checksum"):
+        snapshot.load(path)
+
+    data = bytearray(snapshot.encode(names, ids, frames))
+    struct.pack_into("<H", data, 4, snapshot.VERSION + 1)
+    Path(path).write_bytes(data)
+    with pytest.raises(snapshot.SnapshotError, match="version"):
+        snapshot.load(path)
+    Path(path).write_bytes(b"")
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.load(path)
+
+
+def test_overlapping_writes_never_tear_the_snapshot(tmp_path):
+    path = str(tmp_path / "state.bin")
+    versions = [([f"user{i}_{n}" for n in range(2000)], [uuid.uuid4().bytes for _ in range(2000)]) for i in range(2)]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        for _ in range(5):
+            list(pool.map(lambda version: snapshot.write(path, *version, []), versions))
+            saved = snapshot.load(path)
+            assert (saved.names, saved.ids) in versions
+    assert os.listdir(tmp_path) == ["state.bin"]  # No temporary files left behind
+
+
+@pytest.mark.asyncio
+async def test_restart_restores_users_and_queued_messages(tmp_path):
+    env = {"COHORA_SNAPSHOT_FILE": str(tmp_path / "state.bin")}
+    async with InProcessServer(env) as server:
+        alice = await server.create_user("alice")
+        bob = await server.create_user("bob")
+        await server.http.get("/api/messages/poll?timeout=0", headers={"x-user-id": bob})  # Opens bob's mailbox
+        for i, ttl in enumerate((None, 60_000, 1)):
+            body = {"recipient_name": "bob", "message": f"m{i}", **({"ttl_ms": ttl} if ttl else {})}
+            response = await server.http.post("/api/messages/send", json=body, headers={"x-user-id": alice})
+            assert response.status_code == 200
+        await asyncio.sleep(0.01)  # Past m2's 1 ms TTL
+    # Shutdown wrote the snapshot
+
+    async with InProcessServer(env) as server:
+        assert (await server.http.get("/api/users/list")).json()["users"] == {"alice": alice, "bob": bob}
+        ws = await server.websocket(bob)
+        assert [(await ws.recv_json())["message"] for _ in range(2)] == ["m0", "m1"]
+        with pytest.raises(asyncio.TimeoutError):
+            await ws.recv(timeout=0.1)
+
+
+@pytest.mark.asyncio
+async def test_damaged_snapshot_starts_empty(tmp_path):
+    path = tmp_path / "state.bin"
+    path.write_bytes(b"COHS" + b"\0" * 40)
+    async with InProcessServer({"COHORA_SNAPSHOT_FILE": str(path)}) as server:
+        assert (await server.http.get("/api/users/list")).json()["users"] == {}
+        await server.create_user("carol")
+    assert snapshot.load(str(path)).names == ["carol"]
+
+
+@pytest.mark.asyncio
+async def test_server_process_restart_keeps_registry(tmp_path):
+    server = ServerProcess(8151, {"COHORA_SNAPSHOT_FILE": str(tmp_path / "state.bin")})
+    await server.start()
+    try:
+        async with httpx.AsyncClient(base_url=server.base_url) as client:
+            names = [f"agent_{i}" for i in range(1000)]
+            response = await client.post("/api/users/create_batch", json={"names": names})
+            created = {r["name"]: r["id"] for r in map(json.loads, response.text.splitlines())}
+        server.stop()  # SIGTERM: a graceful shutdown writes the snapshot
+        await server.start()
+        async with httpx.AsyncClient(base_url=server.base_url) as client:
+            assert (await client.get("/api/users/list")).json()["users"] == created
+    finally:
+        server.stop()
@@ -0,0 +1,29 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from soak import run_soak
+
+# Short runs of the soak harness (tests/soak.py); it starts its own servers on 8131/8132
+
+
+@pytest.mark.asyncio
+async def test_soak_without_chaos_loses_nothing():
+    report = await run_soak(agents=6, duration=2, rate=10, port=8131)
+    assert report.accepted > 50
+    assert report.lost == 0
+    assert report.duplicated == 0
+    assert report.reordered == 0
+    assert report.received == report.accepted
+
+
+@pytest.mark.asyncio
+async def test_soak_survives_socket_kills_and_server_restart():
+    report = await run_soak(agents=6, duration=3, rate=10, kill_rate=0.5, restart_every=1.5, port=8132)
+    assert report.server_restarts >= 1
+    assert report.socket_kills > 0
+    assert report.reconnects > 6  # Everyone reconnected at least once after the restart
+    assert report.duplicated == 0
+    assert report.accepted > 0 and report.received > 0
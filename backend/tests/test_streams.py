@@ -0,0 +1,94 @@
+import asyncio
+import json
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from chat_client import ChatClient, RpcError
+from sessions import SendLimits, Session
+from streams import StreamRelay
+
+# ChatClient needs real sockets, so the tests that use it start their own server process (`server_process` in conftest.py).
+
+
+class GatedWebSocket:
+    """Peer whose writes wait until the test opens the gate"""
+
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+
+    async def send_text(self, payload):
+        await self.gate.wait()
+        self.sent.append(json.loads(payload))
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_relay_enforces_window_and_returns_credit():
+    sender_ws, recipient_ws = GatedWebSocket(), GatedWebSocket()
+    sender = Session("sender", sender_ws, SendLimits(), 1013)
+    recipient = Session("recipient", recipient_ws, SendLimits(), 1013)
+    sender_ws.gate.set()
+    relay = StreamRelay(window=4, max_streams_per_user=1)
+
+    stream = relay.open(sender, recipient, "alice")
+    assert relay.open(sender, recipient, "alice") is None  # Per-user cap
+    # Streams sent to a user do not count against the streams they may open
+    reply = relay.open(recipient, sender, "bob")
+    assert reply is not None
+    relay.close(reply)
+    for i in range(4):
+        assert relay.relay(stream, f"tok{i}") is None
+    assert relay.relay(stream, "one too many") == "Flow control window exceeded"
+
+    recipient_ws.gate.set()
+    await asyncio.sleep(0.01)
+    assert [f["seq"] for f in recipient_ws.sent] == [0, 1, 2, 3]
+    credits = [f["credit"] for f in sender_ws.sent if f["type"] == "stream_credit"]
+    assert sum(credits) == 4 and len(credits) == 2
+    assert stream.in_flight == 0
+
+    relay.drop_session(sender)
+    await asyncio.sleep(0.01)
+    assert recipient_ws.sent[-1]["type"] == "stream_close"
+    assert recipient_ws.sent[-1]["error"]["code"] == 503
+    assert relay.streams == {} and relay._by_user == {} and relay._outgoing == {}
+    await sender.close(1000)
+    await recipient.close(1000)
+
+
+@pytest.mark.asyncio
+async def test_stream_relays_ordered_chunks_under_one_message_id(server_process):
+    base_url, ws_url = server_process.base_url, server_process.ws_url
+    async with ChatClient(base_url, ws_url) as sender, ChatClient(base_url, ws_url) as receiver:
+        assert await sender.register(f"stream_sender_{uuid.uuid4()}")
+        receiver_name = f"stream_receiver_{uuid.uuid4()}"
+        assert await receiver.register(receiver_name)
+        frames = asyncio.Queue()
+        for frame_type in ("stream_open", "stream_chunk", "stream_close"):
+            receiver.on(frame_type, frames.put_nowait)
+        await sender.start()
+        await receiver.start()
+
+        async with await sender.stream(receiver_name) as stream:
+            for i in range(500):  # Far more chunks than the window, so credit must flow back
+                await stream.write(f"tok{i} ")
+
+        opened = await asyncio.wait_for(frames.get(), timeout=3)
+        assert opened["type"] == "stream_open" and opened["from"] == sender.username
+        chunks = [await asyncio.wait_for(frames.get(), timeout=3) for _ in range(500)]
+        assert {c["message_id"] for c in chunks} == {opened["message_id"]}
+        assert [c["seq"] for c in chunks] == list(range(500))
+        assert "".join(c["data"] for c in chunks) == "".join(f"tok{i} " for i in range(500))
+        closed = await asyncio.wait_for(frames.get(), timeout=3)
+        assert closed == {"type": "stream_close", "message_id": opened["message_id"], "chunks": 500}
+
+        with pytest.raises(RpcError) as offline:
+            await sender.stream(f"nobody_{uuid.uuid4()}")
+        assert offline.value.code == 404
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+from harness import InProcessServer
+from tracing import NOOP_TRACE, Tracer
+
+# This suite starts its own server with tracing fully sampled
+BASE_URL = "http://127.0.0.1:8121"
+DEBUG_TOKEN = "trace-test-token"
+WS_URL = "ws://127.0.0.1:8121/ws"
+
+
+def test_tracer_disabled_returns_noop():
+    tracer = Tracer(sample_rate=0)
+    trace = tracer.start("x", trace_id="forced")
+    assert trace is NOOP_TRACE
+    with trace.span("stage"):
+        pass
+    trace.release()
+    assert tracer.recent() == []
+
+
+def test_trace_exported_after_last_release(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(sample_rate=1.0, ring_size=2, jsonl_path=str(path))
+    trace = tracer.start("send")
+    with trace.span("stage"):
+        pass
+    trace.hold()
+    trace.release()
+    assert tracer.recent() == []
+    trace.release()
+    (record,) = tracer.recent()
+    assert record["trace_id"] == trace.trace_id
+    assert [s["name"] for s in record["spans"]] == ["stage"]
+    assert json.loads(path.read_text())["trace_id"] == trace.trace_id
+
+    for _ in range(3):
+        tracer.start("more").release()
+    assert len(tracer.recent()) == 2
+
+
+@pytest.fixture(scope="module")
+def traced_server():
+    env = dict(os.environ, COHORA_TRACE_SAMPLE_RATE="1.0", COHORA_DEBUG_TOKEN=DEBUG_TOKEN)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", BASE_URL.rsplit(":", 1)[1]],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 15
+    while True:
+        try:
+            httpx.get(f"{BASE_URL}/api/users/list").raise_for_status()
+            break
+        except httpx.HTTPError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+    yield BASE_URL
+    process.terminate()
+    process.wait()
+
+
+@pytest.mark.asyncio
+async def test_send_trace_covers_pipeline_and_reaches_recipient(traced_server):
+    async with httpx.AsyncClient() as client:
+        sender = f"trace_sender_{uuid.uuid4()}"
+        recipient = f"trace_recipient_{uuid.uuid4()}"
+        sender_id = (await client.post(f"{BASE_URL}/api/users/create", json={"name": sender})).json()["id"]
+        recipient_id = (await client.post(f"{BASE_URL}/api/users/create", json={"name": recipient})).json()["id"]
+
+        ws = await websockets.connect(WS_URL, extra_headers={"x-user-id": recipient_id})
+        try:
+            await asyncio.wait_for(ws.recv(), timeout=3)
+            trace_id = uuid.uuid4().hex
+            response = await client.post(
+                f"{BASE_URL}/api/messages/send",
+                json={"recipient_name": recipient, "message": "traced"},
+                headers={"x-user-id": sender_id, "x-trace-id": trace_id},
+            )
+            assert response.status_code == 200
+            frame = json.loads(await asyncio.wait_for(ws.recv(), timeout=3))
+            assert frame["trace_id"] == trace_id
+
+            await asyncio.sleep(0.05)
+            assert (await client.get(f"{BASE_URL}/debug/traces")).status_code == 403
+            response = await client.get(
+                f"{BASE_URL}/debug/traces", params={"trace_id": trace_id}, headers={"x-debug-token": DEBUG_TOKEN}
+            )
+            (trace,) = response.json()["traces"]
+            names = [span["name"] for span in trace["spans"]]
+            assert names[0] == "receive_and_validate"
+            for stage in ("authenticate", "lookup_recipient", "enqueue", "queue_wait", "socket_write"):
+                assert stage in names
+            assert trace["attributes"]["recipient"] == recipient
+        finally:
+            await ws.close()
+
+
+@pytest.mark.asyncio
+async def test_debug_endpoints_need_a_configured_token():
+    # In-process requests arrive from 127.0.0.1, as tunnelled ones do
+    async with InProcessServer() as server:
+        assert (await server.http.get("/debug/traces")).status_code == 403
+    async with InProcessServer({"COHORA_DEBUG_TOKEN": DEBUG_TOKEN}) as server:
+        assert (await server.http.get("/debug/loop", headers={"x-debug-token": "wrong"})).status_code == 403
+        assert (await server.http.get("/debug/loop", headers={"x-debug-token": DEBUG_TOKEN})).status_code == 200
@@ -0,0 +1,88 @@
+import asyncio
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from sessions import SendLimits, Session
+from timingwheel import TimingWheel
+
+
+def test_wheel_fires_every_timer_on_its_tick():
+    rng = random.Random(7)
+    wheel = TimingWheel(resolution=1, bits=3, levels=3)  # Covers 512 ticks; later timers get parked
+    fired, expected = [], {}
+    for i in range(3000):
+        timer = wheel.schedule(rng.randint(1, 2000), lambda i: fired.append((i, wheel.current)), i)
+        expected[i] = timer.deadline
+        if rng.random() < 0.1:
+            timer.cancel()
+            del expected[i]
+    for _ in range(2001):
+        wheel.tick()
+    assert sorted(fired) == sorted(expected.items())
+    assert len(wheel) == 0
+
+
+class GatedWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+
+    async def send_text(self, payload):
+        await self.gate.wait()
+        self.sent.append(payload)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_queued_frame_expires_and_is_skipped():
+    wheel = TimingWheel(resolution=0.01)
+    wheel.start()
+    ws = GatedWebSocket()
+    session = Session("u1", ws, SendLimits(), 1013, wheel)
+    expired = []
+    assert session.send("blocker")  # Taken by the writer, which then waits on the gate
+    await asyncio.sleep(0)
+    assert session.send("short-lived", ttl=0.02, on_expired=lambda: expired.append(1))
+    assert session.send("keeper", ttl=5)
+    await asyncio.sleep(0.1)
+    assert expired == [1]
+    assert session.queued_frames == 1 and session.queued_bytes == len("keeper")
+
+    ws.gate.set()
+    await asyncio.sleep(0.01)
+    assert ws.sent == ["blocker", "keeper"]
+    await session.close(1000)
+    wheel.stop()
+
+
+@pytest.mark.asyncio
+async def test_message_expires_in_mailbox_and_sender_is_told(server):
+    # In-process `server` fixture from conftest.py
+    sender_id = await server.create_user("ttl_sender")
+    recipient_id = await server.create_user("ttl_recipient")
+    sender_ws = await server.websocket(sender_id)
+    # The recipient polls once to get a mailbox, then stops polling
+    await server.http.get("/api/messages/poll", params={"timeout": 0}, headers={"x-user-id": recipient_id})
+
+    send = {"recipient_name": "ttl_recipient", "message": "ephemeral", "ttl_ms": 100, "report_expiry": True}
+    sent = await server.http.post("/api/messages/send", json=send, headers={"x-user-id": sender_id})
+    assert sent.status_code == 200
+    kept = dict(send, message="durable", ttl_ms=60_000)
+    assert (await server.http.post("/api/messages/send", json=kept, headers={"x-user-id": sender_id})).status_code == 200
+
+    report = await sender_ws.recv_json(timeout=3)
+    assert report == {"type": "message_expired", "message_id": sent.json()["message_id"], "recipient": "ttl_recipient"}
+
+    response = await server.http.get("/api/messages/poll", params={"timeout": 0}, headers={"x-user-id": recipient_id})
+    assert [f["message"] for f in response.json()["frames"]] == ["durable"]
+
+    bad = await server.http.post("/api/messages/send", json=dict(send, ttl_ms=0), headers={"x-user-id": sender_id})
+    assert bad.status_code == 400
+    metrics = (await server.http.get("/api/metrics")).json()
+    assert metrics["counters"]["messages_expired"] >= 1
@@ -0,0 +1,74 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from unread import UnreadTracker
+
+# The endpoint tests use the in-process `server` fixture from conftest.py.
+
+
+def test_counts_follow_deliveries_and_read_receipts():
+    tracker = UnreadTracker()
+    dm, room = ("dm", "alice", "bob"), ("room", "general")
+    for cursor in (1, 2, 5):
+        tracker.record("bob", dm, cursor)
+    tracker.record("bob", room, 3)
+    assert tracker.total("bob") == 4
+
+    assert tracker.mark_read("bob", dm, 2) == 1
+    assert tracker.mark_read("bob", dm, 1) == 1  # Cursors never move back
+    states = dict(tracker.summary("bob"))
+    assert states[dm].last_read == 2 and states[dm].last_received == 5
+    assert tracker.mark_read("bob", dm) == 0 and states[dm].last_read == 5
+    assert tracker.total("bob") == 1
+
+    assert tracker.mark_read("bob", ("dm", "bob", "carol")) == 0
+    tracker.drop_user("bob")
+    assert tracker.total("bob") == 0 and tracker.summary("bob") == []
+
+
+async def send(server, sender_id: str, recipient: str, message: str) -> None:
+    response = await server.http.post(
+        "/api/messages/send", json={"recipient_name": recipient, "message": message}, headers={"x-user-id": sender_id}
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_unread_summary_and_read_receipts(server):
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    carol = await server.create_user("carol")
+    await server.websocket(bob)
+    for message in ("one", "two", "three"):
+        await send(server, alice, "bob", message)
+    await send(server, carol, "bob", "hey")
+    await server.http.post("/api/rooms/create", json={"name": "general"}, headers={"x-user-id": alice})
+    await server.http.post("/api/rooms/general/join", headers={"x-user-id": bob})
+    await server.http.post("/api/rooms/general/send", json={"message": "hi all"}, headers={"x-user-id": alice})
+    headers = {"x-user-id": bob}
+
+    summary = (await server.http.get("/api/messages/unread", headers=headers)).json()
+    assert summary["total_unread"] == 5
+    by_name = {c["with_user"] or c["room"]: c for c in summary["conversations"]}
+    assert by_name["alice"]["unread"] == 3 and by_name["alice"]["last_read"] is None
+    assert by_name["carol"]["unread"] == 1 and by_name["general"]["unread"] == 1
+
+    # Read up to the second message from alice, using its history cursor
+    history = (await server.http.get("/api/messages/history", params={"with_user": "alice"}, headers=headers)).json()
+    cursor = history["messages"][1]["cursor"]
+    response = await server.http.post("/api/messages/read", json={"with_user": "alice", "cursor": cursor}, headers=headers)
+    assert response.json() == {"unread": 1, "total_unread": 3}
+    response = await server.http.post("/api/messages/read", json={"room": "general"}, headers=headers)
+    assert response.json() == {"unread": 0, "total_unread": 2}
+
+    summary = (await server.http.get("/api/messages/unread", headers=headers)).json()
+    by_name = {c["with_user"] or c["room"]: c for c in summary["conversations"]}
+    assert by_name["alice"]["last_read"] == cursor and by_name["alice"]["last_message"] > cursor
+    assert (await server.http.get("/api/messages/unread", headers={"x-user-id": alice})).json()["total_unread"] == 0
+
+    bad = await server.http.post("/api/messages/read", json={}, headers=headers)
+    assert bad.status_code == 400
+    assert (await server.http.post("/api/messages/read", json={"room": "general"})).status_code == 401
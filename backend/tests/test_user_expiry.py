@@ -0,0 +1,80 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from harness import InProcessServer, WebSocketClosed
+
+# These tests use the in-process `server` fixture from conftest.py and need no running server.
+
+
+@pytest.mark.asyncio
+async def test_user_deletes_themselves(server):
+    alice_id = await server.create_user("alice")
+    bob_id = await server.create_user("bob")
+    await server.http.post("/api/rooms/create", json={"name": "general"}, headers={"x-user-id": bob_id})
+    await server.http.post("/api/rooms/general/join", headers={"x-user-id": alice_id})
+    ws = await server.websocket(alice_id)
+
+    assert (await server.http.delete("/api/users/alice", headers={"x-user-id": bob_id})).status_code == 403
+    assert (await server.http.delete("/api/users/nobody", headers={"x-user-id": bob_id})).status_code == 404
+    assert (await server.http.delete("/api/users/alice", headers={"x-user-id": alice_id})).status_code == 204
+
+    with pytest.raises(WebSocketClosed) as excinfo:
+        await ws.recv(timeout=3)
+    assert excinfo.value.code == 4003
+    assert "alice" not in (await server.http.get("/api/users/list")).json()["users"]
+    assert (await server.http.post("/api/rooms/general/leave", headers={"x-user-id": bob_id})).json()["members"] == []
+    response = await server.http.post("/api/messages/send", json={"recipient_name": "bob", "message": "hi"},
+                                      headers={"x-user-id": alice_id})
+    assert response.status_code == 401
+    # The name is free again, under a new ID
+    assert await server.create_user("alice") != alice_id
+
+
+@pytest.mark.asyncio
+async def test_idle_users_expire_and_active_ones_stay():
+    async with InProcessServer({"COHORA_USER_TTL": "1"}) as server:
+        idle_id = await server.create_user("idle")
+        silent = await server.websocket(await server.create_user("silent"))
+        active = await server.websocket(await server.create_user("active"))
+        sender_id = await server.create_user("sender")
+
+        for _ in range(8):
+            await active.send("")  # Heartbeat
+            await server.http.get("/api/messages/history?with_user=active", headers={"x-user-id": sender_id})
+            await asyncio.sleep(0.3)
+
+        with pytest.raises(WebSocketClosed) as excinfo:
+            while True:
+                await silent.recv(timeout=3)
+        assert excinfo.value.code == 4003
+        users = (await server.http.get("/api/users/list")).json()["users"]
+        assert sorted(users) == ["active", "sender"]
+        response = await server.http.get("/api/messages/history?with_user=active", headers={"x-user-id": idle_id})
+        assert response.status_code == 401
+        counters = (await server.http.get("/api/metrics")).json()["counters"]
+        assert counters["users_expired"] == 2
+
+
+@pytest.mark.asyncio
+async def test_reregistered_name_does_not_inherit_history(server):
+    alice = await server.create_user("alice")
+    bob = await server.create_user("bob")
+    await server.websocket(bob)
+    response = await server.http.post(
+        "/api/messages/send", json={"recipient_name": "bob", "message": "the secret plan"}, headers={"x-user-id": alice}
+    )
+    assert response.status_code == 200
+    assert (await server.http.delete("/api/users/bob", headers={"x-user-id": bob})).status_code == 204
+
+    new_bob = await server.create_user("bob")
+    headers = {"x-user-id": new_bob}
+    history = await server.http.get("/api/messages/history", params={"with_user": "alice"}, headers=headers)
+    assert history.json()["messages"] == []
+    search = await server.http.get("/api/messages/search", params={"q": "secret"}, headers=headers)
+    assert search.json()["results"] == []
+    assert len(server.main.search_index) == 0 and len(server.main.history) == 0
+    assert (await server.http.get("/api/messages/search", params={"q": "secret"}, headers={"x-user-id": alice})).json()["results"] == []
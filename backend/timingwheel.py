@@ -0,0 +1,124 @@
+import asyncio
+import time
+from typing import Any, Callable, List, Optional
+
+
+class Timer:
+    __slots__ = ("deadline", "callback", "arg", "cancelled")
+
+    def __init__(self, deadline: int, callback: Callable[[Any], None], arg: Any):
+        self.deadline = deadline  # In ticks
+        self.callback = callback
+        self.arg = arg
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimingWheel:
+    """Hierarchical timing wheel: O(1) to schedule, cancel and advance one tick.
+
+    Level 0 has ``2**bits`` one-tick buckets; each higher level's buckets
+    span a whole rotation of the level below. A timer goes into the lowest
+    level whose range covers it, and a higher-level bucket is cascaded down
+    when time reaches it, so each timer moves at most ``levels - 1`` times.
+    Cancelling only marks the timer; it is discarded when its bucket comes up.
+    """
+
+    def __init__(self, resolution: float = 0.05, bits: int = 8, levels: int = 4):
+        self.resolution = resolution
+        self.bits = bits
+        self.levels = levels
+        self.mask = (1 << bits) - 1
+        self.wheels: List[List[List[Timer]]] = [[[] for _ in range(1 << bits)] for _ in range(levels)]
+        self.current = 0  # Ticks processed so far
+        self.pending = 0
+        self._origin = time.monotonic()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def now_tick(self) -> int:
+        return int((time.monotonic() - self._origin) / self.resolution)
+
+    def schedule(self, delay: float, callback: Callable[[Any], None], arg: Any = None) -> Timer:
+        """Call ``callback(arg)`` after ``delay`` seconds, rounded up to the next tick"""
+        if self.pending == 0:
+            # Nothing is waiting, so skip the idle ticks instead of replaying them
+            self.current = max(self.current, self.now_tick())
+        ticks = max(1, -int(-delay // self.resolution))
+        timer = Timer(self.current + ticks, callback, arg)
+        self._place(timer)
+        self.pending += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return timer
+
+    def _place(self, timer: Timer):
+        for level in range(self.levels):
+            shift = level * self.bits
+            block = timer.deadline >> shift
+            if block - (self.current >> shift) <= self.mask:
+                self.wheels[level][block & self.mask].append(timer)
+                return
+        # Beyond the top level's range: park it in the furthest top bucket to be re-placed later
+        shift = (self.levels - 1) * self.bits
+        self.wheels[-1][((self.current >> shift) + self.mask) & self.mask].append(timer)
+
+    def tick(self):
+        """Advance one tick: cascade higher-level buckets that came due, then fire level 0"""
+        self.current += 1
+        for level in range(1, self.levels):
+            if self.current & ((1 << (level * self.bits)) - 1):
+                break
+            bucket_index = (self.current >> (level * self.bits)) & self.mask
+            bucket = self.wheels[level][bucket_index]
+            self.wheels[level][bucket_index] = []
+            for timer in bucket:
+                if timer.cancelled:
+                    self.pending -= 1
+                else:
+                    self._place(timer)
+        bucket_index = self.current & self.mask
+        due = self.wheels[0][bucket_index]
+        self.wheels[0][bucket_index] = []
+        for timer in due:
+            self.pending -= 1
+            if timer.cancelled:
+                continue
+            if timer.deadline > self.current:  # A parked timer from beyond the wheel's range
+                self._place(timer)
+                self.pending += 1
+                continue
+            try:
+                timer.callback(timer.arg)
+            except Exception as e:
+                print(f"[Server] Timer callback failed: {e}")
+
+    def advance(self):
+        """Process every tick that has elapsed in real time"""
+        target = self.now_tick()
+        while self.current < target and self.pending:
+            self.tick()
+        if not self.pending:
+            self.current = max(self.current, target)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                # Sleep until something is scheduled rather than ticking an empty wheel
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await asyncio.sleep(self.resolution)
+            self.advance()
@@ -0,0 +1,147 @@
+import json
+import os
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Any, Deque, Dict, List, Optional
+
+
+class Trace:
+    """Spans for one request or frame, exported once every holder releases it.
+
+    The handler owns the first hold; passing the trace to a session's writer
+    adds another, so the socket write is part of the same trace.
+    """
+
+    sampled = True
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: Optional[str] = None, started: Optional[float] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started = time.perf_counter() if started is None else started
+        self.wall_started = time.time() - (time.perf_counter() - self.started)
+        self.spans: List[Dict[str, Any]] = []
+        self.attributes: Dict[str, Any] = {}
+        self._holds = 1
+
+    def add_span(self, name: str, start: float, end: float):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.started) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+        })
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.perf_counter())
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def hold(self) -> "Trace":
+        self._holds += 1
+        return self
+
+    def release(self):
+        self._holds -= 1
+        if self._holds == 0:
+            self.tracer.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.wall_started,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "attributes": self.attributes,
+            "spans": self.spans,
+        }
+
+
+class _NoopTrace:
+    """Stand-in for unsampled requests; every operation is free"""
+
+    sampled = False
+    trace_id = None
+
+    def add_span(self, name, start, end):
+        pass
+
+    def span(self, name):
+        return nullcontext()
+
+    def set(self, key, value):
+        pass
+
+    def hold(self):
+        return self
+
+    def release(self):
+        pass
+
+
+NOOP_TRACE = _NoopTrace()
+
+
+class Tracer:
+    """Samples traces and keeps finished ones in a ring, optionally appending them to a JSONL file"""
+
+    def __init__(self, sample_rate: float = 0.0, ring_size: int = 1000, jsonl_path: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.ring: Deque[Dict[str, Any]] = deque(maxlen=ring_size)
+        self.jsonl_path = jsonl_path
+        self._file = open(jsonl_path, "a", buffering=1) if jsonl_path else None
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """Configure from COHORA_TRACE_SAMPLE_RATE (0..1) and COHORA_TRACE_FILE"""
+        return cls(
+            sample_rate=float(os.environ.get("COHORA_TRACE_SAMPLE_RATE", "0")),
+            jsonl_path=os.environ.get("COHORA_TRACE_FILE") or None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self, name: str, trace_id: Optional[str] = None, started: Optional[float] = None):
+        """Begin a trace, or return NOOP_TRACE if this one is not sampled.
+
+        A caller-supplied ``trace_id`` is always sampled while tracing is enabled.
+        """
+        if not self.enabled:
+            return NOOP_TRACE
+        if trace_id is None and random.random() >= self.sample_rate:
+            return NOOP_TRACE
+        return Trace(self, name, trace_id, started)
+
+    def export(self, trace: Trace):
+        record = trace.to_dict()
+        self.ring.append(record)
+        if self._file:
+            self._file.write(json.dumps(record) + "\n")
+
+    def recent(self, limit: int = 100, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        records = list(self.ring)
+        if trace_id:
+            records = [r for r in records if r["trace_id"] == trace_id]
+        return records[-limit:]
+
+
+class ReceiveTimeMiddleware:
+    """Stamps each request with its arrival time so handlers can trace parsing and validation"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            scope.setdefault("state", {})["received_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
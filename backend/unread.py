@@ -0,0 +1,78 @@
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from history import ConversationKey
+
+
+class ReadState:
+    """One user's position in one conversation.
+
+    ``unread`` holds the history cursors of received messages past
+    ``last_read``, oldest first, so a read receipt pops from the left and
+    the unread count is its length.
+    """
+
+    __slots__ = ("unread", "last_read", "last_received")
+
+    def __init__(self):
+        self.unread: Deque[int] = deque()
+        self.last_read: Optional[int] = None
+        self.last_received: Optional[int] = None
+
+
+class UnreadTracker:
+    """Per-user unread counts and read cursors, kept up to date as messages arrive and are read.
+
+    Recording a message and reading up to the newest one are O(1); a read
+    receipt for an older cursor costs one pop per message it marks read. A
+    user's summary visits only the conversations they have received in.
+    """
+
+    def __init__(self):
+        self._states: Dict[str, Dict[ConversationKey, ReadState]] = {}
+        self._totals: Dict[str, int] = {}
+
+    def record(self, user_id: str, key: ConversationKey, cursor: int):
+        """Count a message delivered to ``user_id`` as unread"""
+        conversations = self._states.get(user_id)
+        if conversations is None:
+            conversations = self._states[user_id] = {}
+        state = conversations.get(key)
+        if state is None:
+            state = conversations[key] = ReadState()
+        state.unread.append(cursor)
+        state.last_received = cursor
+        self._totals[user_id] = self._totals.get(user_id, 0) + 1
+
+    def mark_read(self, user_id: str, key: ConversationKey, cursor: Optional[int] = None) -> int:
+        """Move the read cursor up to ``cursor`` (default: everything received); returns the unread left"""
+        state = self._states.get(user_id, {}).get(key)
+        if state is None:
+            return 0
+        before = len(state.unread)
+        if cursor is None or (state.last_received is not None and cursor >= state.last_received):
+            state.unread.clear()
+            cursor = state.last_received if cursor is None else cursor
+        else:
+            while state.unread and state.unread[0] <= cursor:
+                state.unread.popleft()
+        # Cursors only move forward, so a late receipt cannot mark messages unread again
+        if state.last_read is None or cursor > state.last_read:
+            state.last_read = cursor
+        self._totals[user_id] -= before - len(state.unread)
+        return len(state.unread)
+
+    def total(self, user_id: str) -> int:
+        return self._totals.get(user_id, 0)
+
+    def summary(self, user_id: str) -> List[Tuple[ConversationKey, ReadState]]:
+        return list(self._states.get(user_id, {}).items())
+
+    def drop_conversation(self, user_id: str, key: ConversationKey):
+        state = self._states.get(user_id, {}).pop(key, None)
+        if state is not None:
+            self._totals[user_id] -= len(state.unread)
+
+    def drop_user(self, user_id: str):
+        self._states.pop(user_id, None)
+        self._totals.pop(user_id, None)
@@ -71,26 +71,61 @@ export async function getUsers(): Promise<Record<string, string>> {
   return data.users;
 }
 
-// Send a message to another user
-export async function sendMessage(recipientName: string, message: string): Promise<void> {
+const SEND_RETRY_BASE_MS = 200; // First backoff; doubles per attempt
+const SEND_RETRY_MAX_MS = 5000; // Longest single wait
+const MAX_SEND_RETRIES = 5; // Upper bound on the caller's retries
+
+// Full jitter: a random wait up to the capped exponential delay, so clients
+// that failed together do not retry in lockstep
+function retryDelay(attempt: number): number {
+  const ceiling = Math.min(SEND_RETRY_MAX_MS, SEND_RETRY_BASE_MS * 2 ** attempt);
+  return Math.random() * ceiling;
+}
+
+function isRetryable(status: number): boolean {
+  return status === 429 || status >= 500;
+}
+
+// Send a message to another user. Network errors, 429 and 5xx answers are
+// retried up to `retries` times (at most MAX_SEND_RETRIES) with exponential
+// backoff. Every attempt reuses the same Idempotency-Key, so the server
+// delivers the message at most once.
+export async function sendMessage(recipientName: string, message: string, retries = 2): Promise<void> {
   if (!userId) {
     throw new Error("User not authenticated");
   }
 
-  const response = await fetch(`${BASE_URL}/api/messages/send`, {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json",
-      "X-User-Id": userId,
-    },
-    body: JSON.stringify({
-      recipient_name: recipientName,
-      message,
-    }),
-  });
-
-  if (!response.ok) {
-    throw new Error(`Failed to send message: ${response.statusText}`);
+  const maxRetries = Math.min(Math.max(retries, 0), MAX_SEND_RETRIES);
+  const idempotencyKey = crypto.randomUUID();
+  for (let attempt = 0; ; attempt++) {
+    let response: Response;
+    try {
+      response = await fetch(`${BASE_URL}/api/messages/send`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "X-User-Id": userId,
+          "Idempotency-Key": idempotencyKey,
+        },
+        body: JSON.stringify({
+          recipient_name: recipientName,
+          message,
+        }),
+      });
+    } catch (error) {
+      if (attempt >= maxRetries) throw error;
+      await new Promise((resolve) => setTimeout(resolve, retryDelay(attempt)));
+      continue;
+    }
+
+    if (!response.ok) {
+      if (isRetryable(response.status) && attempt < maxRetries) {
+        await new Promise((resolve) => setTimeout(resolve, retryDelay(attempt)));
+        continue;
+      }
+      throw new Error(`Failed to send message: ${response.statusText}`);
+    }
+    return;
   }
 }
 